@@ -0,0 +1,111 @@
+import sys
+from array import array
+from itertools import groupby
+from typing import Dict, FrozenSet, Iterable, List, Optional
+from sqlalchemy import bindparam, event, select, update
+from sqlalchemy.orm import Session
+from models import Recipe, Ingredient, Allergy, SocialMedia
+
+# Allergen index: every recipe carries the catalog ids of its ingredients
+# as a packed array (Recipe.CatalogIDs, kept up to date on flush), and a
+# user's allergies compile to a frozenset of catalog ids. A recipe contains
+# an allergen when one of its ids is in the set, which takes no string
+# comparisons and no join, and costs one hash lookup per id however large
+# the catalog ids grow.
+
+# Recipe ids per IN (...) query when checking in bulk
+CHUNK_SIZE = 1000
+
+
+def pack_ids(ids: Iterable[int]) -> bytes:
+    # Sorted unsigned 32-bit ids, little-endian whatever the host
+    packed = array('I', sorted({i for i in ids if i is not None}))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def unpack_ids(data: bytes) -> List[int]:
+    packed = array('I')
+    packed.frombytes(data)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tolist()
+
+def hits(allergen_ids: FrozenSet[int], data: bytes):
+    # Whether any id packed in `data` is one of `allergen_ids`
+    return bool(allergen_ids) and not allergen_ids.isdisjoint(unpack_ids(data))
+
+def user_allergen_ids(db, user_id: str) -> FrozenSet[int]:
+    """
+    Compile a user's allergies to a set of catalog ids (one indexed query).
+    """
+    ids = db.execute(select(Allergy.CatalogID).where(Allergy.UserID == user_id)).scalars()
+    return frozenset(i for i in ids if i is not None)
+
+def recipe_catalog_ids(db, recipe_ids: List[str]) -> Dict[str, bytes]:
+    """
+    Packed catalog ids of the given recipes. Recipes written before the
+    index existed are packed from their ingredient rows.
+    """
+    packed = {}
+    for start in range(0, len(recipe_ids), CHUNK_SIZE):
+        chunk = recipe_ids[start:start + CHUNK_SIZE]
+        packed.update(db.execute(select(Recipe.RecipeID, Recipe.CatalogIDs).where(Recipe.RecipeID.in_(chunk))).all())
+    missing = [recipe_id for recipe_id, data in packed.items() if data is None]
+    packed.update(ingredient_catalog_ids(db, missing))
+    return packed
+
+def post_catalog_ids(db, smid: str) -> Optional[bytes]:
+    # Packed catalog ids of the recipe behind a post, None for an unknown post
+    recipe_id = db.scalar(select(SocialMedia.RecipeID).where(SocialMedia.SMID == smid))
+    if recipe_id is None:
+        return None
+    return recipe_catalog_ids(db, [recipe_id]).get(recipe_id)
+
+def ingredient_catalog_ids(db, recipe_ids: List[str]) -> Dict[str, bytes]:
+    # Pack catalog ids straight from the ingredients table
+    packed = {recipe_id: pack_ids([]) for recipe_id in recipe_ids}
+    for start in range(0, len(recipe_ids), CHUNK_SIZE):
+        rows = db.execute(
+            select(Ingredient.RecipeID, Ingredient.CatalogID)
+            .where(Ingredient.RecipeID.in_(recipe_ids[start:start + CHUNK_SIZE]))
+            .order_by(Ingredient.RecipeID)
+        ).all()
+        for recipe_id, group in groupby(rows, key=lambda row: row[0]):
+            packed[recipe_id] = pack_ids(row[1] for row in group)
+    return packed
+
+def check_recipes(db, user_id: str, recipe_ids: List[str]) -> Dict[str, bool]:
+    """
+    Whether each recipe contains one of the user's allergens, in one pass
+    over the packed ids: the user's allergen ids are loaded once and tested
+    against every recipe. Unknown recipe ids are left out.
+    """
+    allergen_ids = user_allergen_ids(db, user_id)
+    packed = recipe_catalog_ids(db, list(dict.fromkeys(recipe_ids)))
+    return {recipe_id: hits(allergen_ids, data) for recipe_id, data in packed.items()}
+
+def refresh_recipe_catalog_ids(db, recipe_ids: List[str]):
+    # Recompute the packed ids of recipes whose ingredients changed
+    packed = ingredient_catalog_ids(db, recipe_ids)
+    if packed:
+        db.execute(
+            update(Recipe.__table__).where(Recipe.__table__.c.RecipeID == bindparam('recipe_id'))
+            .values(CatalogIDs=bindparam('catalog_ids')),
+            [{'recipe_id': recipe_id, 'catalog_ids': data} for recipe_id, data in packed.items()]
+        )
+
+@event.listens_for(Session, 'before_flush')
+def collect_changed_recipes(session, flush_context, instances):
+    changed = {
+        row.RecipeID for row in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(row, Ingredient) and row.RecipeID is not None
+    }
+    if changed:
+        session.info.setdefault('allergen_index_recipes', set()).update(changed)
+
+@event.listens_for(Session, 'after_flush_postexec')
+def update_changed_recipes(session, flush_context):
+    changed = session.info.pop('allergen_index_recipes', None)
+    if changed:
+        refresh_recipe_catalog_ids(session.connection(), sorted(changed))
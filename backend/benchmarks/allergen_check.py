@@ -0,0 +1,67 @@
+"""
+Benchmark allergen checks of many recipes for one user.
+
+Seeds an in-memory SQLite database with recipes of 8 ingredients each and
+a user with 5 allergies, then checks every recipe:
+  strings - the previous check_allergens, once per recipe: load the
+            ingredient and allergy names and compare the lists
+  index   - one check_recipes pass: the user's allergen ids against each
+            recipe's packed catalog ids
+
+Run from the backend folder:
+    python -m benchmarks.allergen_check
+"""
+import random
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from allergens import check_recipes
+from llm import RecipeLLM
+from models import Base, User, Ingredient, Allergy
+from routers.recipes import insert_recipes
+
+SIZES = [1_000, 10_000, 50_000]
+INGREDIENTS = [f"ingredient {i}" for i in range(500)]
+
+
+def check_with_strings(db, user_id, recipe_id):
+    ingredients = db.query(Ingredient).filter(Ingredient.RecipeID == recipe_id).all()
+    ingredient_names = [ingredient.IngredientName for ingredient in ingredients]
+    allergens = db.query(Allergy).filter(Allergy.UserID == user_id).all()
+    allergen_names = [allergy.IngredientName for allergy in allergens]
+    return any(ingredient in allergen_names for ingredient in ingredient_names)
+
+def run(count):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(Email="bench@example.com", Password="x", Name="Bench")
+    db.add(user)
+    db.commit()
+    user_id = user.UserID
+    randomizer = random.Random(0)
+    db.add_all(Allergy(UserID=user_id, IngredientName=name) for name in randomizer.sample(INGREDIENTS, 5))
+    recipes = [
+        RecipeLLM(title=f"Recipe {i}", content="Cook.", ingredients=randomizer.sample(INGREDIENTS, 8), userGenerated=True, cuisine="Unknown")
+        for i in range(count)
+    ]
+    recipe_ids = insert_recipes(db, user_id, recipes)
+    db.commit()
+
+    start = time.perf_counter()
+    by_strings = {recipe_id: check_with_strings(db, user_id, recipe_id) for recipe_id in recipe_ids}
+    strings_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    by_index = check_recipes(db, user_id, recipe_ids)
+    index_elapsed = time.perf_counter() - start
+    assert by_strings == by_index
+    db.close()
+    engine.dispose()
+    return sum(by_index.values()), strings_elapsed, index_elapsed
+
+if __name__ == "__main__":
+    print(f"{'recipes':>8} {'flagged':>8} {'strings s':>10} {'index s':>8} {'speedup':>8}")
+    for size in SIZES:
+        flagged, strings_elapsed, index_elapsed = run(size)
+        print(f"{size:>8} {flagged:>8} {strings_elapsed:>10.3f} {index_elapsed:>8.3f} {strings_elapsed / index_elapsed:>7.0f}x")
@@ -0,0 +1,86 @@
+"""
+Benchmark response compression on typical payloads.
+
+Builds a /posts page and a /recipesall page of template-generated recipes
+(50 and 200 items) and reports, for each installed coding and level, the
+bytes on the wire and the CPU time to compress one response.
+
+Run from the backend folder:
+    python -m benchmarks.compression
+"""
+import json
+import random
+import time
+import uuid
+from types import SimpleNamespace
+import compression
+from compression import GzipCompressor, BrotliCompressor, ZstdCompressor
+from feed import serialize_recipe, entry_fragment
+from llm import GenerateRecipeRequest, TemplateRecipeProvider
+from models import Recipe
+from payloads import json_object, json_array
+
+PAGE_SIZES = [50, 200]
+INGREDIENTS = ["chicken", "rice", "garlic", "onion", "tomato", "basil", "tofu", "ginger", "lime", "beans", "cheese", "spinach"]
+REPEATS = 50
+
+
+def make_recipes(count):
+    provider = TemplateRecipeProvider()
+    randomizer = random.Random(0)
+    recipes = []
+    for i in range(count):
+        request = GenerateRecipeRequest(
+            question=f"A {randomizer.choice(provider.CUISINES)} dinner", ingredients=randomizer.sample(INGREDIENTS, 4),
+            dietary_restrictions=[]
+        )
+        recipe = provider.render(request)
+        recipes.append(Recipe(
+            RecipeID=str(uuid.uuid4()), UserID=str(uuid.uuid4()), RecipeName=recipe["title"],
+            RecipeContent=recipe["content"], Cuisine=recipe["cuisine"], Visibility=True, UserGenerated=False,
+            Version=1
+        ))
+    return recipes
+
+def posts_payload(recipes):
+    entries = [
+        SimpleNamespace(SMID=str(uuid.uuid4()), Likes=i, Comments=i % 7, Payload=json.dumps(serialize_recipe(recipe)))
+        for i, recipe in enumerate(recipes)
+    ]
+    return json_object({"posts": json_array(entry_fragment(entry) for entry in entries), "next_cursor": None})
+
+def recipes_payload(recipes):
+    # RecipeOutput fields, as /recipesall returns them
+    fields = ["RecipeID", "UserID", "RecipeName", "RecipeContent", "Cuisine", "Visibility"]
+    return json.dumps([{field: getattr(recipe, field) for field in fields} for recipe in recipes]).encode()
+
+def codecs():
+    yield "gzip 1", lambda: GzipCompressor(1)
+    yield "gzip 6", lambda: GzipCompressor(6)
+    yield "gzip 9", lambda: GzipCompressor(9)
+    if compression.brotli is not None:
+        yield "br 4", lambda: BrotliCompressor(4)
+        yield "br 11", lambda: BrotliCompressor(11)
+    if compression.zstandard is not None:
+        yield "zstd 3", lambda: ZstdCompressor(3)
+        yield "zstd 19", lambda: ZstdCompressor(19)
+
+def measure(factory, body):
+    start = time.process_time()
+    for _ in range(REPEATS):
+        compressor = factory()
+        encoded = compressor.compress(body) + compressor.finish()
+    return len(encoded), (time.process_time() - start) / REPEATS
+
+if __name__ == "__main__":
+    missing = [name for name, module in [("br", compression.brotli), ("zstd", compression.zstandard)] if module is None]
+    if missing:
+        print(f"not installed: {', '.join(missing)}")
+    print(f"{'payload':<16} {'coding':<8} {'bytes':>9} {'ratio':>6} {'cpu ms':>8}")
+    for size in PAGE_SIZES:
+        recipes = make_recipes(size)
+        for name, body in [(f"/posts {size}", posts_payload(recipes)), (f"/recipesall {size}", recipes_payload(recipes))]:
+            print(f"{name:<16} {'identity':<8} {len(body):>9} {1:>6.1f} {0:>8.3f}")
+            for coding, factory in codecs():
+                encoded, seconds = measure(factory, body)
+                print(f"{name:<16} {coding:<8} {encoded:>9} {len(body) / encoded:>6.1f} {seconds * 1000:>8.3f}")
@@ -0,0 +1,192 @@
+"""
+Load test: 5,000 idle clients connected to the feed event stream.
+
+Serves the app with uvicorn on one worker and opens 5,000 connections to
+GET /feed/events (--clients to change it). With every client connected and
+idle it reports the memory they take, the p50/p99 latency of GET / before
+and during, and then, for a few likes, how long the `like` event takes to
+reach every client.
+
+Clients and server share this process, so the memory per connection is an
+upper bound for the server alone.
+
+Run from the backend folder:
+    python -m benchmarks.feed_events
+    python -m benchmarks.feed_events --clients 1000
+"""
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+from datetime import timedelta
+import httpx
+import uvicorn
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import get_db, get_async_db
+from feed_events import feed_broker
+from models import Base, User, Recipe, SocialMedia
+from routers.auth import create_access_token
+
+CONNECT_CONCURRENCY = 200
+LIKES = 5
+
+
+def serve(asgi_app):
+    # Run an app with uvicorn on a free local port, in a background thread.
+    # Lifespan is off: the startup handlers would use the real database
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(
+        asgi_app, host="127.0.0.1", port=port, log_level="warning", lifespan="off", backlog=4096
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, port
+
+def rss_kb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def seed(path):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(Email="events@example.com", Password="x", Name="Events")
+    db.add(user)
+    db.flush()
+    recipe = Recipe(RecipeName="Live", UserID=user.UserID, RecipeContent="Mix.", Cuisine="Unknown", Visibility=True)
+    db.add(recipe)
+    db.flush()
+    post = SocialMedia(RecipeID=recipe.RecipeID, UserID=user.UserID)
+    db.add(post)
+    db.commit()
+    user_id, smid = user.UserID, post.SMID
+    db.close()
+
+    def override_get_db():
+        db = sessionmaker(bind=engine)()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async_session = async_sessionmaker(
+        bind=create_async_engine(f"sqlite+aiosqlite:///{path}"), autoflush=False, expire_on_commit=False
+    )
+    async def override_get_async_db():
+        async with async_session() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    return user_id, smid
+
+async def connect(port, token, semaphore):
+    # A raw HTTP/1.1 connection reading the stream up to the retry line
+    async with semaphore:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write((
+            f"GET /feed/events HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer {token}\r\n"
+            "Accept: text/event-stream\r\n\r\n"
+        ).encode())
+        await writer.drain()
+        while not (await reader.readline()).startswith(b"retry:"):
+            pass
+        return reader, writer
+
+async def listen(reader, arrivals):
+    # Records when each `like` event arrives
+    while line := await reader.readline():
+        if line.startswith(b"event: like"):
+            arrivals.append(time.perf_counter())
+
+async def probe(client, samples, seconds=2):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/")
+        assert response.status_code == 200
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+async def main(clients):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    user_id, smid = seed(path)
+    token = create_access_token({"sub": user_id}, timedelta(hours=1))
+    headers = {"Authorization": f"Bearer {token}"}
+    server, thread, port = serve(app)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+        before = []
+        await probe(client, before)
+
+        baseline = rss_kb()
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+        connections = await asyncio.gather(*(connect(port, token, semaphore) for _ in range(clients)))
+        connect_seconds = time.perf_counter() - start
+        while len(feed_broker.hub.subscriptions) < clients:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(1)
+        per_connection_kb = (rss_kb() - baseline) / clients
+
+        during = []
+        await probe(client, during)
+
+        arrivals = []
+        listeners = [asyncio.create_task(listen(reader, arrivals)) for reader, _ in connections]
+        fanout = []
+        for i in range(LIKES):
+            arrivals.clear()
+            sent = time.perf_counter()
+            if i % 2 == 0:
+                response = await client.post(f"/like_post/{smid}", headers=headers)
+            else:
+                response = await client.post("/unlike_post", json={"smid": smid}, headers=headers)
+            assert response.status_code == 200
+            while len(arrivals) < clients:
+                await asyncio.sleep(0.005)
+            fanout.append([(at - sent) * 1000 for at in arrivals])
+
+        for task in listeners:
+            task.cancel()
+        for _, writer in connections:
+            writer.close()
+        await asyncio.gather(*listeners, return_exceptions=True)
+
+    server.should_exit = True
+    thread.join(timeout=10)
+    os.remove(path)
+
+    print(f"clients: {clients}, connected in {connect_seconds:.1f} s")
+    print(f"memory:  {per_connection_kb:.1f} KB per idle connection (clients included)")
+    print(f"GET / before  p50 {percentile(before, 50):6.2f} ms  p99 {percentile(before, 99):6.2f} ms")
+    print(f"GET / during  p50 {percentile(during, 50):6.2f} ms  p99 {percentile(during, 99):6.2f} ms")
+    for i, latencies in enumerate(fanout):
+        print(
+            f"like {i + 1}: all {clients} clients in {max(latencies):7.1f} ms"
+            f"  (p50 {percentile(latencies, 50):6.1f} ms, p99 {percentile(latencies, 99):6.1f} ms)"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=5_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.clients))
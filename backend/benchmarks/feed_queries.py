@@ -0,0 +1,90 @@
+"""
+Benchmark the /posts feed engine.
+
+Seeds an in-memory SQLite database with an increasing number of posts and
+reports how many SQL statements and how much time `build_feed` needs to
+serve the first (largest allowed) page of the feed from the feed_entries
+read model, for two users:
+  peanut - allergic to one of the 8 ingredients, which 3 in 8 posts contain
+  all    - allergic to every ingredient, so every post is filtered out and
+           the whole table is scanned to return an empty page
+
+Run from the backend folder:
+    python -m benchmarks.feed_queries
+"""
+import time
+import uuid
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from models import Base, User, Recipe, Ingredient, Allergy, SocialMedia
+from feed import build_feed, rebuild_feed_entries
+from catalog import catalog_ids
+from pagination import PageParams, MAX_PAGE_SIZE
+
+SIZES = [100, 1_000, 10_000, 100_000]
+INGREDIENTS = ["flour", "sugar", "egg", "milk", "butter", "peanut", "salt", "rice"]
+ALLERGIES = {"peanut": ["peanut"], "all": INGREDIENTS}
+
+
+def seed(db, user_id, count):
+    ids = catalog_ids(db, INGREDIENTS)
+    recipes, ingredients, posts = [], [], []
+    for i in range(count):
+        recipe_id = str(uuid.uuid4())
+        recipes.append({
+            "RecipeID": recipe_id,
+            "UserID": user_id,
+            "RecipeName": f"Recipe {i}",
+            "RecipeContent": "Mix and bake.",
+            "Cuisine": "Unknown",
+            "Visibility": True,
+            "UserGenerated": False,
+        })
+        for j in range(3):
+            name = INGREDIENTS[(i + j) % len(INGREDIENTS)]
+            ingredients.append({
+                "IngredientID": str(uuid.uuid4()),
+                "RecipeID": recipe_id,
+                "IngredientName": name,
+                "CatalogID": ids[name],
+            })
+        posts.append({"SMID": str(uuid.uuid4()), "RecipeID": recipe_id, "UserID": user_id, "Likes": 0})
+    db.execute(insert(Recipe), recipes)
+    db.execute(insert(Ingredient), ingredients)
+    db.execute(insert(SocialMedia), posts)
+    rebuild_feed_entries(db)
+    db.commit()
+
+
+def run(count, allergies):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(Email="bench@example.com", Password="x", Name="Bench")
+    db.add(user)
+    db.commit()
+    user_id = user.UserID
+    db.add_all(Allergy(UserID=user_id, IngredientName=name) for name in allergies)
+    db.commit()
+    seed(db, user_id, count)
+
+    statements = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    start = time.perf_counter()
+    posts, _ = build_feed(db, user_id, PageParams(limit=MAX_PAGE_SIZE))
+    elapsed = time.perf_counter() - start
+    db.close()
+    engine.dispose()
+    return len(statements), len(posts), elapsed
+
+
+if __name__ == "__main__":
+    print(f"{'allergy':<8} {'posts':>8} {'queries':>8} {'returned':>9} {'seconds':>8}")
+    for name, allergies in ALLERGIES.items():
+        for size in SIZES:
+            queries, returned, elapsed = run(size, allergies)
+            print(f"{name:<8} {size:>8} {queries:>8} {returned:>9} {elapsed:>8.3f}")
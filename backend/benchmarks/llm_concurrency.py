@@ -0,0 +1,206 @@
+"""
+Load test: responsiveness of the app while recipe generations are in flight.
+
+Starts a fake OpenAI-compatible server that answers every chat completion
+after a fixed delay, points the LLM client at it and fires concurrent
+/generate-recipe requests (50 by default, all distinct so the generation
+cache does not absorb them) while probing GET / and reporting its p50/p99
+latency before and during the generations.
+
+With --stream the generations go through /generate-recipe/stream instead,
+the fake server streams the completion in chunks spread over the delay,
+and the time to the first streamed content is reported as well.
+
+--provider picks the client under test: the OpenAI client (default) or the
+OpenAI-compatible HTTP client against the fake server, or the offline
+template provider with the same simulated delay and no network at all.
+
+Run from the backend folder:
+    python -m benchmarks.llm_concurrency
+    python -m benchmarks.llm_concurrency --blocking   # sync OpenAI call on the event loop, as before
+    python -m benchmarks.llm_concurrency --stream
+    python -m benchmarks.llm_concurrency --provider template
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import threading
+import time
+import httpx
+import openai
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from main import app
+from generation import generation_cache
+from llm import OpenAIRecipeClient, OpenAICompatibleRecipeClient, TemplateRecipeProvider, RecipeLLM, build_messages, build_prompt, get_llm_client, validate_recipe
+from principal import UserPrincipal, get_current_user
+
+RECIPE = {"title": "Bench cake", "content": "Mix and bake.", "ingredients": ["flour"], "userGenerated": False, "cuisine": "Unknown"}
+STREAM_CHUNKS = 20
+
+
+def fake_llm_app(delay):
+    fake = FastAPI()
+
+    def chunk(delta, finish_reason=None):
+        return "data: " + json.dumps({
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + "\n\n"
+
+    async def stream_completion():
+        # The content arrives in STREAM_CHUNKS pieces spread over the delay
+        content = json.dumps(RECIPE)
+        size = -(-len(content) // STREAM_CHUNKS)
+        for i in range(0, len(content), size):
+            await asyncio.sleep(delay / STREAM_CHUNKS)
+            yield chunk({"role": "assistant", "content": content[i:i + size]})
+        yield chunk({}, "stop")
+        yield "data: [DONE]\n\n"
+
+    @fake.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        if (await request.json()).get("stream"):
+            return StreamingResponse(stream_completion(), media_type="text/event-stream")
+        await asyncio.sleep(delay)
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": json.dumps(RECIPE)}}],
+        }
+
+    return fake
+
+def serve(asgi_app):
+    # Run an app with uvicorn on a free local port, in a background thread
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+class BlockingRecipeClient:
+    """
+    The previous behaviour: the sync OpenAI client called on the event loop.
+    """
+    model = "gpt-4o"
+
+    def __init__(self, base_url):
+        self._client = openai.OpenAI(api_key="bench", base_url=base_url)
+
+    async def generate(self, request):
+        response = self._client.beta.chat.completions.parse(
+            model=self.model, messages=build_messages(build_prompt(request)), response_format=RecipeLLM
+        )
+        return validate_recipe(response.choices[0].message.content)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def probe(client, stop, samples):
+    # Records (latency, finished at) pairs; a blocked loop shows up as a
+    # long gap between finished probes rather than as slow ones
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get("/")
+        assert response.status_code == 200
+        finished = time.perf_counter()
+        samples.append(((finished - start) * 1000, finished))
+        await asyncio.sleep(0.01)
+
+def max_gap_ms(samples):
+    finished = [at for _, at in samples]
+    return max((b - a) * 1000 for a, b in zip(finished, finished[1:])) if len(finished) > 1 else float("nan")
+
+async def generate(client, body):
+    response = await client.post("/generate-recipe", json=body)
+    return response.status_code == 201, None
+
+async def generate_streamed(client, body):
+    # Returns whether a recipe event arrived and the ms until the first delta
+    start, first = time.perf_counter(), None
+    async with client.stream("POST", "/generate-recipe/stream", json=body) as response:
+        async for line in response.aiter_lines():
+            if first is None and line == "event: delta":
+                first = (time.perf_counter() - start) * 1000
+            if line == "event: recipe":
+                return True, first
+    return False, first
+
+async def main(generations, delay, blocking, stream, provider):
+    servers = []
+    if provider == "template":
+        llm = TemplateRecipeProvider(delay)
+    else:
+        llm_server, llm_thread, llm_url = serve(fake_llm_app(delay))
+        servers.append((llm_server, llm_thread))
+        base_url = llm_url + "/v1"
+        if blocking:
+            llm = BlockingRecipeClient(base_url)
+        elif provider == "http":
+            llm = OpenAICompatibleRecipeClient(base_url=base_url)
+        else:
+            llm = OpenAIRecipeClient(api_key="bench", base_url=base_url)
+    app.dependency_overrides[get_llm_client] = lambda: llm
+    app.dependency_overrides[get_current_user] = lambda: UserPrincipal(UserID="bench", Role=True, Name="Bench", Email="bench@example.com")
+    generation_cache.store.clear()
+
+    # The app runs in its own server so streamed responses arrive as they are sent
+    app_server, app_thread, app_url = serve(app)
+    servers.insert(0, (app_server, app_thread))
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=app_url, timeout=None, limits=limits) as client:
+        idle, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(client, stop, idle))
+        await asyncio.sleep(1)
+        stop.set()
+        await task
+
+        busy, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(client, stop, busy))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            (generate_streamed if stream else generate)(
+                client, {"question": f"Cake number {i}", "ingredients": ["flour"], "dietary_restrictions": []}
+            )
+            for i in range(generations)
+        ))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join()
+    app.dependency_overrides.pop(get_llm_client, None)
+    app.dependency_overrides.pop(get_current_user, None)
+
+    ok = sum(succeeded for succeeded, _ in results)
+    print(f"generations: {ok}/{generations} succeeded in {elapsed:.2f}s ({delay:.1f}s per completion, "
+          f"{'blocking' if blocking else provider} client{', streamed' if stream else ''})")
+    if stream:
+        first = [ms for _, ms in results if ms is not None]
+        print(f"time to first content: p50 {statistics.median(first):.0f} ms, p99 {percentile(first, 99):.0f} ms")
+    print(f"{'GET /':<22} {'samples':>8} {'p50 ms':>8} {'p99 ms':>8} {'max gap ms':>11}")
+    for label, samples in (("idle", idle), ("during generations", busy)):
+        latencies = [latency for latency, _ in samples]
+        print(f"{label:<22} {len(samples):>8} {statistics.median(latencies):>8.2f} "
+              f"{percentile(latencies, 99):>8.2f} {max_gap_ms(samples):>11.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--generations", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=2.0, help="seconds the fake LLM takes per completion")
+    parser.add_argument("--blocking", action="store_true", help="call the sync OpenAI client on the event loop")
+    parser.add_argument("--stream", action="store_true", help="generate through /generate-recipe/stream")
+    parser.add_argument("--provider", choices=("openai", "http", "template"), default="openai")
+    args = parser.parse_args()
+    asyncio.run(main(args.generations, args.delay, args.blocking, args.stream, args.provider))
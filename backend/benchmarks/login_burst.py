@@ -0,0 +1,110 @@
+"""
+Load test: latency of an unrelated endpoint during a login burst.
+
+Fires a burst of /login requests (500 per second by default) at the app
+in-process while probing GET /auth/verify, a sync endpoint served from the
+shared request threadpool, and reports its p50/p99 latency before and
+during the burst.
+
+Run from the backend folder:
+    python -m benchmarks.login_burst
+    python -m benchmarks.login_burst --inline   # bcrypt on the request threadpool, as before
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import anyio
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import get_db
+from models import Base, User
+from password_pool import password_pool
+from routers.auth import pwd_context
+
+EMAIL = "burst@example.com"
+PASSWORD = "password123"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def probe(client, headers, stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get("/auth/verify", headers=headers)
+        assert response.status_code == 200
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+async def login(client, delay):
+    await asyncio.sleep(delay)
+    return await client.post("/login", data={"email": EMAIL, "password": PASSWORD})
+
+async def main(logins, rate, rounds):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    db.add(User(Email=EMAIL, Password=pwd_context.hash(PASSWORD, rounds=rounds), Name="Burst"))
+    db.commit()
+    db.close()
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+    app.dependency_overrides[get_db] = override_get_db
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        token = (await client.post("/login", data={"email": EMAIL, "password": PASSWORD})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        idle, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(client, headers, stop, idle))
+        await asyncio.sleep(1)
+        stop.set()
+        await task
+
+        busy, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(client, headers, stop, busy))
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(login(client, i / rate) for i in range(logins)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await task
+
+    app.dependency_overrides.pop(get_db, None)
+    engine.dispose()
+    os.close(fd)
+    os.remove(path)
+
+    ok = sum(response.status_code == 200 for response in responses)
+    print(f"logins: {ok}/{logins} succeeded in {elapsed:.2f}s (bcrypt rounds={rounds})")
+    print(f"password pool: {password_pool.stats()}")
+    print(f"{'/auth/verify':<16} {'samples':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, samples in (("idle", idle), ("during burst", busy)):
+        print(f"{label:<16} {len(samples):>8} {statistics.median(samples):>8.2f} {percentile(samples, 99):>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=500, help="logins started per second")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost of the test user's hash")
+    parser.add_argument("--inline", action="store_true",
+                        help="hash on the shared request threadpool instead of the password pool")
+    args = parser.parse_args()
+    if args.inline:
+        async def run_inline(fn, *fn_args):
+            return await anyio.to_thread.run_sync(fn, *fn_args)
+        password_pool.run = run_inline
+    asyncio.run(main(args.logins, args.rate, args.rounds))
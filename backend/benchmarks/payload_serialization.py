@@ -0,0 +1,99 @@
+"""
+Benchmark the serialization CPU of 1,000-post responses.
+
+Builds 1,000 posts in memory and measures the process CPU time of
+producing the response body of
+  /posts      - from feed entries: decoding every stored payload and
+                json.dumps of the whole response (dicts), against splicing
+                the stored payloads into the body (fragments)
+  /bookmarks  - from ORM recipes: serialize_recipe for every recipe and
+                json.dumps (dicts), against recipe fragments from the warm
+                payload cache (fragments)
+Fragments are measured with the standard library encoder and, when it is
+installed, with orjson.
+
+Run from the backend folder:
+    python -m benchmarks.payload_serialization
+"""
+import json
+import time
+import uuid
+from types import SimpleNamespace
+import payloads
+from feed import serialize_recipe, serialize_entry, recipe_fragment, entry_fragment
+from models import Recipe
+from payloads import json_object, json_array
+
+POSTS = 1_000
+REPEATS = 100
+
+
+def make_recipes():
+    return [
+        Recipe(
+            RecipeID=str(uuid.uuid4()), UserID=str(uuid.uuid4()), RecipeName=f"Recipe {i}",
+            RecipeContent="Mix the flour and sugar, add the eggs and bake for 30 minutes. " * 4,
+            Cuisine="Unknown", Visibility=True, UserGenerated=False, Version=1
+        )
+        for i in range(POSTS)
+    ]
+
+def make_entries(recipes):
+    return [
+        SimpleNamespace(SMID=str(uuid.uuid4()), Likes=i, Comments=i % 7, Payload=json.dumps(serialize_recipe(recipe)))
+        for i, recipe in enumerate(recipes)
+    ]
+
+def posts_with_dicts(entries):
+    return json.dumps({"posts": [serialize_entry(entry) for entry in entries], "next_cursor": None}).encode()
+
+def posts_with_fragments(entries):
+    return json_object({"posts": json_array(entry_fragment(entry) for entry in entries), "next_cursor": None})
+
+def bookmarks_with_dicts(recipes):
+    return json.dumps({
+        "bookmarks": [{"BookmarkID": recipe.RecipeID, "SMID": recipe.RecipeID, "Recipe": serialize_recipe(recipe)} for recipe in recipes],
+        "next_cursor": None
+    }).encode()
+
+def bookmarks_with_fragments(recipes):
+    return json_object({
+        "bookmarks": json_array(
+            json_object({"BookmarkID": recipe.RecipeID, "SMID": recipe.RecipeID, "Recipe": recipe_fragment(recipe)})
+            for recipe in recipes
+        ),
+        "next_cursor": None
+    })
+
+def cpu_per_response(build, rows):
+    build(rows)  # warms the payload cache
+    start = time.process_time()
+    for _ in range(REPEATS):
+        build(rows)
+    return (time.process_time() - start) / REPEATS
+
+def measure(with_dicts, with_fragments, rows):
+    installed = payloads.orjson
+    results = [("dicts", cpu_per_response(with_dicts, rows))]
+    try:
+        payloads.orjson = None
+        payloads.recipe_fragments.clear()
+        results.append(("fragments", cpu_per_response(with_fragments, rows)))
+    finally:
+        payloads.orjson = installed
+    if installed is not None:
+        payloads.recipe_fragments.clear()
+        results.append(("+ orjson", cpu_per_response(with_fragments, rows)))
+    return results
+
+if __name__ == "__main__":
+    recipes = make_recipes()
+    entries = make_entries(recipes)
+    print(f"{'response':<11} {'path':<10} {'cpu ms':>8} {'speedup':>8}")
+    for name, results in [
+        ("/posts", measure(posts_with_dicts, posts_with_fragments, entries)),
+        ("/bookmarks", measure(bookmarks_with_dicts, bookmarks_with_fragments, recipes)),
+    ]:
+        baseline = results[0][1]
+        for path, seconds in results:
+            print(f"{name:<11} {path:<10} {seconds * 1000:>8.3f} {baseline / seconds:>7.1f}x")
@@ -0,0 +1,102 @@
+"""
+Benchmark recipe creation throughput.
+
+Writes the same recipes to a file-backed SQLite database tuned like the
+app's (WAL, synchronous=NORMAL) in three ways and reports recipes per
+second:
+  per-row   - the previous create_recipe: commit the recipe, refresh it,
+              add each ingredient and commit again
+  one-tx    - the current create_recipe: one transaction and one multi-row
+              INSERT per table for each recipe
+  import    - /recipes/import: IMPORT_BATCH recipes per transaction
+
+Run from the backend folder:
+    python -m benchmarks.recipe_import
+    python -m benchmarks.recipe_import --recipes 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import apply_sqlite_pragmas
+from llm import RecipeLLM
+from models import Base, User, Recipe, Ingredient
+from routers.recipes import insert_recipes, RECIPE_IMPORT_MAX_ITEMS
+
+INGREDIENTS = ["flour", "sugar", "egg", "milk", "butter", "salt", "rice", "leek"]
+IMPORT_BATCH = RECIPE_IMPORT_MAX_ITEMS
+
+
+def make_recipes(count):
+    return [
+        RecipeLLM(
+            title=f"Recipe {i}",
+            content="Mix and bake.",
+            ingredients=[INGREDIENTS[(i + j) % len(INGREDIENTS)] for j in range(5)],
+            userGenerated=True,
+            cuisine="Unknown",
+        )
+        for i in range(count)
+    ]
+
+def create_per_row(db, user_id, recipes):
+    for recipe in recipes:
+        new_recipe = Recipe(
+            UserID=user_id,
+            RecipeName=recipe.title,
+            RecipeContent=recipe.content,
+            Cuisine=recipe.cuisine,
+            UserGenerated=recipe.userGenerated,
+        )
+        db.add(new_recipe)
+        db.commit()
+        db.refresh(new_recipe)
+        for ingredient in recipe.ingredients:
+            db.add(Ingredient(RecipeID=new_recipe.RecipeID, IngredientName=ingredient))
+        db.commit()
+
+def create_one_transaction(db, user_id, recipes):
+    for recipe in recipes:
+        insert_recipes(db, user_id, [recipe])
+        db.commit()
+
+def create_imported(db, user_id, recipes):
+    for start in range(0, len(recipes), IMPORT_BATCH):
+        insert_recipes(db, user_id, recipes[start:start + IMPORT_BATCH])
+        db.commit()
+
+def run(strategy, recipes):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    apply_sqlite_pragmas(engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(Email="bench@example.com", Password="x", Name="Bench")
+    db.add(user)
+    db.commit()
+    user_id = user.UserID
+
+    start = time.perf_counter()
+    strategy(db, user_id, recipes)
+    elapsed = time.perf_counter() - start
+    stored = db.query(Ingredient).count()
+    db.close()
+    engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return elapsed, stored
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recipes", type=int, default=5000)
+    args = parser.parse_args()
+    recipes = make_recipes(args.recipes)
+
+    print(f"{'strategy':<10} {'recipes':>8} {'ingredients':>12} {'seconds':>8} {'recipes/s':>10}")
+    for name, strategy in (("per-row", create_per_row), ("one-tx", create_one_transaction), ("import", create_imported)):
+        elapsed, stored = run(strategy, recipes)
+        print(f"{name:<10} {len(recipes):>8} {stored:>12} {elapsed:>8.2f} {len(recipes) / elapsed:>10.0f}")
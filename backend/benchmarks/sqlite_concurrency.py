@@ -0,0 +1,138 @@
+"""
+Concurrent read/write benchmark for the SQLite performance profile.
+
+Runs reader threads building feed pages while writer threads like posts and
+add comments, first against a plain SQLite engine (rollback journal, no
+pragmas) and then with the profile from database.py (WAL, pragmas and
+writers taking turns on a FIFO writer lock).
+
+Run from the backend folder:
+    python -m benchmarks.sqlite_concurrency
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from database import (
+    engine_options, apply_sqlite_pragmas, create_writer_engine, RoutingSession, FairLock
+)
+from feed import build_feed, rebuild_feed_entries, change_feed_counts
+from models import Base, User, Recipe, SocialMedia, Comment
+from pagination import PageParams
+
+
+def seed(session_factory, posts):
+    db = session_factory()
+    user = User(Email="bench@example.com", Password="x", Name="Bench")
+    db.add(user)
+    db.commit()
+    user_id = user.UserID
+    recipes = [{
+        "RecipeID": str(uuid.uuid4()), "UserID": user_id, "RecipeName": f"Recipe {i}",
+        "RecipeContent": "Mix and bake.", "Cuisine": "Unknown", "Visibility": True,
+    } for i in range(posts)]
+    db.execute(insert(Recipe), recipes)
+    smids = [str(uuid.uuid4()) for _ in recipes]
+    db.execute(insert(SocialMedia), [
+        {"SMID": smid, "RecipeID": recipe["RecipeID"], "UserID": user_id, "Likes": 0}
+        for smid, recipe in zip(smids, recipes)
+    ])
+    rebuild_feed_entries(db)
+    db.commit()
+    db.close()
+    return user_id, smids
+
+def make_session_factory(url, tuned):
+    engine = create_engine(url, **engine_options(url))
+    if not tuned:
+        return sessionmaker(bind=engine), [engine]
+    apply_sqlite_pragmas(engine)
+    writer = create_writer_engine(url, lock=FairLock())
+    session_factory = sessionmaker(class_=RoutingSession, reader=engine, writer=writer)
+    return session_factory, [engine, writer]
+
+def run(tuned, readers, writers, duration, posts):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    url = f"sqlite:///{path}"
+    session_factory, engines = make_session_factory(url, tuned)
+    Base.metadata.create_all(bind=engines[-1])
+    user_id, smids = seed(session_factory, posts)
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    results = {"reads": 0, "writes": 0, "errors": 0, "write_ms": []}
+
+    def reader():
+        while not stop.is_set():
+            db = session_factory()
+            try:
+                build_feed(db, user_id, PageParams(limit=50))
+                with lock:
+                    results["reads"] += 1
+            except OperationalError:
+                with lock:
+                    results["errors"] += 1
+            finally:
+                db.close()
+
+    def writer(index):
+        i = 0
+        while not stop.is_set():
+            smid = smids[(index + i) % len(smids)]
+            i += 1
+            start = time.perf_counter()
+            db = session_factory()
+            try:
+                db.execute(update(SocialMedia).where(SocialMedia.SMID == smid).values(Likes=SocialMedia.Likes + 1))
+                db.add(Comment(SMID=smid, UserID=user_id, CommentText="Looks great"))
+                change_feed_counts(db, smid, likes=1, comments=1)
+                db.commit()
+                with lock:
+                    results["writes"] += 1
+                    results["write_ms"].append((time.perf_counter() - start) * 1000)
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    results["errors"] += 1
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    for engine in engines:
+        engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per profile")
+    parser.add_argument("--posts", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.duration:.0f}s per profile")
+    print(f"{'profile':<10} {'reads/s':>9} {'writes/s':>9} {'errors':>7} {'write p50 ms':>13} {'write p99 ms':>13}")
+    for label, tuned in (("default", False), ("tuned", True)):
+        results = run(tuned, args.readers, args.writers, args.duration, args.posts)
+        write_ms = sorted(results["write_ms"]) or [0.0]
+        p99 = write_ms[min(len(write_ms) - 1, int(len(write_ms) * 0.99))]
+        print(f"{label:<10} {results['reads'] / args.duration:>9.1f} {results['writes'] / args.duration:>9.1f} "
+              f"{results['errors']:>7} {statistics.median(write_ms):>13.2f} {p99:>13.2f}")
@@ -0,0 +1,83 @@
+import re
+from typing import Dict, Iterable
+from sqlalchemy import event, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import IngredientCatalog, Ingredient, Allergy, ShoppingListItem
+
+# Ingredient names are matched through the ingredient catalog: "Eggs",
+# " egg " and "EGG" are one catalog entry, so allergen checks, shopping-list
+# dedupe and ingredient search compare integer ids instead of strings.
+
+# Words ending in s that are already singular
+SINGULAR_WORDS = {
+    'asparagus', 'bass', 'citrus', 'couscous', 'cress', 'grass', 'hummus', 'lemongrass', 'molasses',
+    'octopus', 'swiss', 'watercress', 'series', 'species',
+}
+# Words whose plural ends in -ies but whose singular ends in -ie, not -y
+IE_WORDS = {'brownie', 'calorie', 'cookie', 'pie', 'potpie', 'smoothie', 'veggie'}
+# Tables whose rows reference the catalog through IngredientName
+CATALOGUED = (Ingredient, Allergy, ShoppingListItem)
+
+
+def singular(word: str):
+    if len(word) <= 3 or word in SINGULAR_WORDS or word.endswith(('ss', 'us', 'is')):
+        return word
+    if word.endswith('ies'):
+        return word[:-1] if word[:-1] in IE_WORDS else word[:-3] + 'y'
+    if word.endswith(('oes', 'ches', 'shes', 'xes', 'sses')):
+        return word[:-2]
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+def normalize_ingredient(name: str):
+    """
+    Canonical catalog name: lower case, punctuation dropped, single spaces
+    and the last word singular ("Green  Onions!" -> "green onion").
+    """
+    words = re.sub(r"[^\w\s'-]", ' ', name.lower()).split()
+    if not words:
+        return ''
+    words[-1] = singular(words[-1])
+    return ' '.join(words)
+
+def catalog_ids(db, names: Iterable[str]) -> Dict[str, int]:
+    """
+    Map ingredient names to their catalog ids, adding the missing entries.
+    `db` is a Session or a Connection. Names that normalize to nothing are
+    left out.
+    """
+    normalized = {name: normalize_ingredient(name) for name in names}
+    wanted = sorted(set(normalized.values()) - {''})
+    if not wanted:
+        return {}
+    table = IngredientCatalog.__table__
+    dialect = db.dialect if hasattr(db, 'dialect') else db.get_bind().dialect
+    insert = postgresql.insert if dialect.name == 'postgresql' else sqlite.insert
+    # Concurrent writers may add the same names, existing entries are kept
+    db.execute(insert(table).values([{'Name': name} for name in wanted]).on_conflict_do_nothing(index_elements=['Name']))
+    ids = dict(db.execute(select(table.c.Name, table.c.CatalogID).where(table.c.Name.in_(wanted))).all())
+    return {name: ids[key] for name, key in normalized.items() if key}
+
+def catalog_id(db, name: str):
+    # Catalog id of one name, without adding it; None if unknown
+    key = normalize_ingredient(name)
+    return db.execute(select(IngredientCatalog.CatalogID).where(IngredientCatalog.Name == key)).scalar()
+
+@event.listens_for(Session, 'before_flush')
+def assign_catalog_ids(session, flush_context, instances):
+    """
+    Fill CatalogID for new rows, and for rows whose IngredientName changed,
+    so code and tests can keep working with names only.
+    """
+    pending = [
+        row for row in (*session.new, *session.dirty)
+        if isinstance(row, CATALOGUED)
+        and (row.CatalogID is None or inspect(row).attrs.IngredientName.history.has_changes())
+    ]
+    if not pending:
+        return
+    ids = catalog_ids(session.connection(), {row.IngredientName for row in pending})
+    for row in pending:
+        row.CatalogID = ids.get(row.IngredientName)
@@ -0,0 +1,220 @@
+import os
+import zlib
+from typing import Dict, Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from streaming import SSE_MEDIA_TYPE
+
+try:
+    import brotli
+except ImportError:  # optional, br is not offered without it
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # optional, zstd is not offered without it
+    zstandard = None
+
+# Response compression negotiated from Accept-Encoding. Bodies under
+# COMPRESSION_MIN_SIZE are sent as they are, since compressing them costs
+# more CPU than it saves on the wire. Streamed responses are compressed as
+# they go and flushed after every chunk, so an NDJSON row reaches the client
+# when it is sent, not when a compressor block fills up. Content types in
+# COMPRESSION_SKIP_TYPES are never compressed: Server-Sent Events are small
+# and must reach the client untouched by proxies.
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', '1') == '1'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))
+ZSTD_LEVEL = int(os.getenv('ZSTD_LEVEL', '3'))
+COMPRESSION_SKIP_TYPES = [
+    media_type.strip() for media_type in os.getenv('COMPRESSION_SKIP_TYPES', SSE_MEDIA_TYPE).split(',')
+    if media_type.strip()
+]
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        # wbits 31: deflate with a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+class BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+class ZstdCompressor:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+def available_encodings(gzip_level: int = GZIP_LEVEL, brotli_quality: int = BROTLI_QUALITY, zstd_level: int = ZSTD_LEVEL):
+    """
+    Compressor factories by content-coding, in server preference order.
+    """
+    encodings = {}
+    if zstandard is not None:
+        encodings['zstd'] = lambda: ZstdCompressor(zstd_level)
+    if brotli is not None:
+        encodings['br'] = lambda: BrotliCompressor(brotli_quality)
+    encodings['gzip'] = lambda: GzipCompressor(gzip_level)
+    return encodings
+
+def negotiate(accept_encoding: str, encodings) -> Optional[str]:
+    """
+    Pick the content-coding for an Accept-Encoding header: the highest q
+    value wins, ties go to the server's preference order. Returns None when
+    no offered coding is acceptable.
+    """
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = weights.get(name, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with the coding negotiated from
+    Accept-Encoding (zstd, br or gzip, as installed). Responses that are
+    already encoded, bodyless or of a skipped content type pass through.
+    """
+
+    def __init__(
+        self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE, skip_types=COMPRESSION_SKIP_TYPES,
+        encodings=None
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.skip_types = tuple(skip_types)
+        self.encodings = encodings if encodings is not None else available_encodings()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(self.app, encoding, self.encodings[encoding], self.minimum_size, self.skip_types)
+        await responder(scope, receive, send)
+
+class CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, compressor_factory, minimum_size: int, skip_types):
+        self.app = app
+        self.encoding = encoding
+        self.compressor_factory = compressor_factory
+        self.minimum_size = minimum_size
+        self.skip_types = skip_types
+        self.send = None
+        self.start_message: Message = {}
+        self.compressor = None
+        self.passthrough = False
+        self.started = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    def skipped(self, message: Message):
+        headers = Headers(raw=message['headers'])
+        media_type = headers.get('content-type', '').split(';')[0].strip().lower()
+        return (
+            message['status'] < 200 or message['status'] == 204
+            or 'content-encoding' in headers
+            or media_type in self.skip_types
+        )
+
+    def negotiated_headers(self, message: Message):
+        # Every response that could be compressed, whether it is or not (too
+        # small, a 304), varies on Accept-Encoding and carries the same weak
+        # ETag as the encoded body; If-None-Match compares weakly so it still
+        # matches on the next poll
+        headers = MutableHeaders(raw=message['headers'])
+        headers.add_vary_header('Accept-Encoding')
+        etag = headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = f'W/{etag}'
+        return headers
+
+    async def send_compressed(self, message: Message):
+        if message['type'] == 'http.response.start':
+            # Held back until the first body chunk decides the headers
+            self.start_message = message
+            self.passthrough = self.skipped(message) or message['status'] == 304
+            if self.passthrough:
+                if message['status'] == 304:
+                    self.negotiated_headers(message)
+                await self.send(message)
+            return
+        if message['type'] != 'http.response.body' or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if not self.started:
+            self.started = True
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                self.negotiated_headers(self.start_message)
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = self.compressor_factory()
+            headers = self.negotiated_headers(self.start_message)
+            headers['Content-Encoding'] = self.encoding
+            if more_body:
+                del headers['Content-Length']
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers['Content-Length'] = str(len(body))
+                await self.send(self.start_message)
+                await self.send({'type': 'http.response.body', 'body': body, 'more_body': False})
+                return
+            await self.send(self.start_message)
+
+        # Streamed body: every chunk is flushed so the client can decode it
+        # right away, without waiting for the next ones
+        chunk = self.compressor.compress(body)
+        chunk += self.compressor.flush() if more_body else self.compressor.finish()
+        if chunk or not more_body:
+            await self.send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
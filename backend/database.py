@@ -1,18 +1,265 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+import asyncio
+import os
+import threading
+from collections import deque
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util import await_only
 from models import Base
+import catalog  # registers the flush hook filling ingredient CatalogIDs
+import allergens  # and the one keeping Recipe.CatalogIDs up to date
 
-DATABASE_URL = 'sqlite:///mydatabase.db'
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///mydatabase.db')
 
-engine = create_engine(DATABASE_URL, connect_args={'check_same_thread': False})
-SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+# Async drivers used when ASYNC_DATABASE_URL is not set explicitly
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+# Connection pool tuning, shared by the sync and async engines
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+# SQLite performance profile: WAL lets readers run while a write commits,
+# and writes take turns on one lock shared by the sync and async writer
+# engines, so concurrent commits queue in order instead of failing with
+# "database is locked".
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', '1') == '1'
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative values are KiB
+    'busy_timeout': 5000,  # ms
+    'temp_store': 'MEMORY',
+}
+
+def to_async_url(url: str):
+    """
+    Map a sync database URL to the matching async driver, e.g.
+    sqlite:///app.db -> sqlite+aiosqlite:///app.db.
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}', set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def engine_options(url: str):
+    # In-memory SQLite lives in a single connection and cannot be pooled
+    parsed = make_url(url)
+    options = {'pool_pre_ping': DB_POOL_PRE_PING}
+    if parsed.get_backend_name() == 'sqlite':
+        options['connect_args'] = {'check_same_thread': False}
+        if parsed.database in (None, '', ':memory:'):
+            return options
+    if parsed.get_dialect().is_async:
+        # aiosqlite defaults to NullPool, reuse connections like the sync engine does
+        options['poolclass'] = AsyncAdaptedQueuePool
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+def uses_sqlite_profile(url: str):
+    parsed = make_url(url)
+    return (
+        SQLITE_TUNING
+        and parsed.get_backend_name() == 'sqlite'
+        and parsed.database not in (None, '', ':memory:')
+    )
+
+def apply_sqlite_pragmas(engine):
+    # Run the profile pragmas on every new DBAPI connection of the engine
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+class FairLock:
+    """
+    Lock granted in request order, to threads and coroutines alike. A plain
+    pool lets the thread that just released the writer connection take it
+    straight back, starving the others; this hands it to the longest
+    waiter instead.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._waiters = deque()  # grant callables, oldest first
+        self._locked = False
+
+    def acquire(self):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # Blocking here would stall the loop the holder may need to finish
+            raise RuntimeError("FairLock.acquire() called on an event loop thread, use acquire_async()")
+        with self._mutex:
+            if not self._locked and not self._waiters:
+                self._locked = True
+                return
+            waiter = threading.Event()
+
+            def grant():
+                waiter.set()
+                return True
+
+            self._waiters.append(grant)
+        waiter.wait()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        with self._mutex:
+            if not self._locked and not self._waiters:
+                self._locked = True
+                return
+            waiter = loop.create_future()
+            granted = False
+
+            def grant():
+                nonlocal granted
+                try:
+                    loop.call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+                except RuntimeError:
+                    return False  # its loop is closed, skip to the next waiter
+                granted = True
+                return True
+
+            self._waiters.append(grant)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._mutex:
+                owned = granted
+                if not owned:
+                    self._waiters.remove(grant)
+            if owned:
+                self.release()
+            raise
+
+    def release(self):
+        with self._mutex:
+            while self._waiters:
+                # Ownership passes directly to the next waiter
+                if self._waiters.popleft()():
+                    return
+            self._locked = False
+
+def share_writer_lock(engine, lock: FairLock):
+    """
+    Hold `lock` for as long as a connection of `engine` is checked out, so
+    every engine sharing the lock writes to the database one at a time.
+    Async engines wait for it without blocking the event loop.
+    """
+    sync_engine = getattr(engine, 'sync_engine', engine)
+    is_async = sync_engine.dialect.is_async
+
+    @event.listens_for(sync_engine, 'checkout')
+    def take_writer_lock(dbapi_connection, connection_record, connection_proxy):
+        if is_async:
+            await_only(lock.acquire_async())
+        else:
+            lock.acquire()
+        connection_record.info['writer_lock'] = lock
+
+    @event.listens_for(sync_engine, 'checkin')
+    def release_writer_lock(dbapi_connection, connection_record):
+        # Only connections that got the lock give it back, not failed checkouts
+        if connection_record.info.pop('writer_lock', None) is not None:
+            lock.release()
+
+def create_writer_engine(url: str, engine_factory=create_engine, lock: FairLock = None):
+    """
+    Engine for writes. Without a `lock` it has a single pooled connection
+    and writers wait their turn in the pool. With one, writers wait on the
+    lock in request order instead, and engines sharing it (the sync and the
+    async writer) never write at the same time.
+    """
+    options = engine_options(url)
+    if lock is None:
+        options.update(pool_size=1, max_overflow=0)
+    writer = engine_factory(url, **options)
+    apply_sqlite_pragmas(writer.sync_engine if hasattr(writer, 'sync_engine') else writer)
+    if lock is not None:
+        share_writer_lock(writer, lock)
+    return writer
+
+class RoutingSession(Session):
+    """
+    Session reading through the pooled reader engine and sending writes to
+    the writer engine. Once a transaction has written, the rest of it stays
+    on the writer connection so it reads its own changes.
+    """
+
+    def __init__(self, reader, writer, **kw):
+        super().__init__(**kw)
+        self.reader = reader
+        self.writer = writer
+        self.writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.writing or self._flushing or isinstance(clause, UpdateBase):
+            self.writing = True
+            return self.writer
+        return self.reader
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def reset_routing(session, transaction):
+    if transaction.parent is None:
+        session.writing = False
+
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', to_async_url(DATABASE_URL))
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+
+if uses_sqlite_profile(DATABASE_URL):
+    apply_sqlite_pragmas(engine)
+    apply_sqlite_pragmas(async_engine.sync_engine)
+    # One lock for both writer engines: sync sessions, async sessions, job
+    # workers and the like flusher all take turns on it
+    writer_lock = FairLock()
+    writer_engine = create_writer_engine(DATABASE_URL, lock=writer_lock)
+    async_writer_engine = create_writer_engine(ASYNC_DATABASE_URL, create_async_engine, lock=writer_lock)
+    SessionLocal = scoped_session(sessionmaker(
+        class_=RoutingSession, reader=engine, writer=writer_engine, autocommit=False, autoflush=False
+    ))
+    AsyncSessionLocal = async_sessionmaker(
+        sync_session_class=RoutingSession,
+        reader=async_engine.sync_engine, writer=async_writer_engine.sync_engine,
+        autoflush=False, expire_on_commit=False
+    )
+else:
+    writer_engine = engine
+    async_writer_engine = async_engine
+    SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_async_engines():
+    # Pooled aiosqlite connections run on their own threads, close them so
+    # the process can exit
+    await async_engine.dispose()
+    if async_writer_engine is not async_engine:
+        await async_writer_engine.dispose()
+
@@ -0,0 +1,223 @@
+import json
+from typing import Iterable
+from sqlalchemy import delete, exists, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+from allergens import ingredient_catalog_ids
+from models import SocialMedia, Recipe, Comment, FeedEntry, Ingredient, Allergy
+from pagination import PageParams, paginate
+from payloads import dumps, json_object, recipe_fragments, cached_fragment
+from etags import FEED_VERSION, POSTED_RECIPES_VERSION, bump_versions
+
+# The feed is served from FeedEntry, a denormalized read model holding one
+# row per post with everything a feed item needs: the serialized recipe,
+# like and comment counts and the recipe's packed catalog ids for allergen
+# filtering. Writes to the source tables update it in the same transaction:
+# refresh_feed_entries when a post or its recipe changes, change_feed_counts
+# for likes and comments, delete_feed_entries when a recipe goes away. Each
+# of them bumps the feed's ETag version counters.
+
+# Posts per query when checking or rebuilding every entry
+CHUNK_SIZE = 1000
+
+ENTRY_COLUMNS = ['RecipeID', 'Payload', 'Likes', 'Comments', 'CatalogIDs', 'CreatedAt']
+
+
+def serialize_recipe(recipe):
+    """Helper function to serialize a Recipe object"""
+    return {
+        "RecipeID": recipe.RecipeID,
+        "RecipeName": recipe.RecipeName,
+        "RecipeContent": recipe.RecipeContent,
+        "Visibility": recipe.Visibility,
+        "UserGenerated": recipe.UserGenerated,
+        "Cuisine": recipe.Cuisine,
+        "UserID": recipe.UserID
+    }
+
+def recipe_fragment(recipe) -> bytes:
+    # serialize_recipe output as JSON, cached for the recipe's version
+    return cached_fragment(recipe_fragments, (recipe.RecipeID, recipe.Version), lambda: serialize_recipe(recipe))
+
+def serialize_entry(entry):
+    return {
+        "SMID": entry.SMID,
+        "Likes": entry.Likes,
+        "Comments": entry.Comments,
+        "Recipe": json.loads(entry.Payload)
+    }
+
+def entry_fragment(entry) -> bytes:
+    # The stored payload is JSON already and goes into the response as is
+    return json_object({
+        "SMID": entry.SMID,
+        "Likes": entry.Likes,
+        "Comments": entry.Comments,
+        "Recipe": entry.Payload.encode()
+    })
+
+def feed_entry_rows(db, criteria):
+    """
+    Compute the feed entries of the posts matching `criteria` from the
+    source tables. Posts whose recipe no longer exists get no entry.
+    """
+    comments = select(func.count()).where(Comment.SMID == SocialMedia.SMID).scalar_subquery()
+    rows = db.execute(
+        select(
+            SocialMedia.SMID, SocialMedia.Likes, SocialMedia.CreatedAt, comments.label('Comments'),
+            Recipe.RecipeID, Recipe.RecipeName, Recipe.RecipeContent, Recipe.Visibility,
+            Recipe.UserGenerated, Recipe.Cuisine, Recipe.UserID, Recipe.CatalogIDs
+        )
+        .join(Recipe, Recipe.RecipeID == SocialMedia.RecipeID)
+        .where(criteria)
+    ).all()
+    # Recipes written before the allergen index existed are packed here
+    missing = ingredient_catalog_ids(db, [row.RecipeID for row in rows if row.CatalogIDs is None])
+    return [
+        {
+            'SMID': row.SMID,
+            'RecipeID': row.RecipeID,
+            'Payload': dumps(serialize_recipe(row)).decode(),
+            'Likes': row.Likes or 0,
+            'Comments': row.Comments,
+            'CatalogIDs': missing.get(row.RecipeID, row.CatalogIDs),
+            'CreatedAt': row.CreatedAt,
+        }
+        for row in rows
+    ]
+
+def refresh_feed_entries(db: Session, smids: Iterable[str] = (), recipe_ids: Iterable[str] = ()):
+    """
+    Recompute the entries of the given posts and of every post of the given
+    recipes, in the session's transaction. Pending ORM changes are flushed
+    first so the entries reflect them.
+    """
+    smids, recipe_ids = list(smids), list(recipe_ids)
+    db.flush()
+    entries = feed_entry_rows(db, or_(SocialMedia.SMID.in_(smids), SocialMedia.RecipeID.in_(recipe_ids)))
+    db.execute(delete(FeedEntry).where(or_(FeedEntry.SMID.in_(smids), FeedEntry.RecipeID.in_(recipe_ids))))
+    if entries:
+        db.execute(insert(FeedEntry), entries)
+    bump_versions(db, [FEED_VERSION, POSTED_RECIPES_VERSION])
+
+def delete_feed_entries(db: Session, recipe_id: str):
+    db.execute(delete(FeedEntry).where(FeedEntry.RecipeID == recipe_id))
+    bump_versions(db, [FEED_VERSION, POSTED_RECIPES_VERSION])
+
+def change_feed_counts(db: Session, smid: str, likes: int = 0, comments: int = 0):
+    # Atomic counter update of one entry
+    db.execute(
+        update(FeedEntry)
+        .where(FeedEntry.SMID == smid)
+        .values(Likes=FeedEntry.Likes + likes, Comments=FeedEntry.Comments + comments)
+    )
+    bump_versions(db, [FEED_VERSION])
+
+def feed_page(db: Session, user_id: str, page: PageParams = None):
+    """
+    Load one page of the allergen-filtered feed for a user, newest first,
+    in a single keyset-paginated query on feed_entries. Posts whose recipe
+    has an ingredient the user is allergic to are excluded in SQL by a NOT
+    EXISTS over the ingredient and allergy catalog ids, so a page costs one
+    query however many posts exist or are filtered out. Returns the entry
+    rows and the cursor of the next page.
+    """
+    page = page or PageParams()
+    has_allergen = exists().where(
+        Ingredient.RecipeID == FeedEntry.RecipeID,
+        Allergy.UserID == user_id,
+        Allergy.CatalogID == Ingredient.CatalogID,
+    )
+    query = db.query(
+        FeedEntry.SMID, FeedEntry.Payload, FeedEntry.Likes, FeedEntry.Comments, FeedEntry.CreatedAt
+    ).filter(~has_allergen)
+    return paginate(query, FeedEntry.CreatedAt, FeedEntry.SMID, page)
+
+def build_feed(db: Session, user_id: str, page: PageParams = None):
+    """
+    Build one page of the feed as dicts. Returns the posts and the cursor
+    of the next page.
+    """
+    entries, next_cursor = feed_page(db, user_id, page)
+    return [serialize_entry(entry) for entry in entries], next_cursor
+
+def stored_feed_entries(db, smids):
+    rows = db.execute(select(FeedEntry.__table__).where(FeedEntry.SMID.in_(smids))).mappings()
+    return {row['SMID']: dict(row) for row in rows}
+
+def same_entry(stored, expected):
+    # Payloads are compared decoded, key order does not matter
+    return all(
+        json.loads(stored[column]) == json.loads(expected[column]) if column == 'Payload'
+        else stored[column] == expected[column]
+        for column in ENTRY_COLUMNS
+    )
+
+def check_feed_entries(db: Session):
+    """
+    Rebuild every feed entry from the source tables and diff the result
+    against feed_entries. Returns the SMIDs of entries that are missing,
+    stale (differ from their rebuilt value) or orphaned (no longer backed
+    by a post), each sorted.
+    """
+    smids = sorted(
+        set(db.execute(select(SocialMedia.SMID)).scalars())
+        | set(db.execute(select(FeedEntry.SMID)).scalars())
+    )
+    report = {'missing': [], 'stale': [], 'orphaned': []}
+    for start in range(0, len(smids), CHUNK_SIZE):
+        chunk = smids[start:start + CHUNK_SIZE]
+        expected = {entry['SMID']: entry for entry in feed_entry_rows(db, SocialMedia.SMID.in_(chunk))}
+        stored = stored_feed_entries(db, chunk)
+        for smid in chunk:
+            if smid not in stored:
+                if smid in expected:
+                    report['missing'].append(smid)
+            elif smid not in expected:
+                report['orphaned'].append(smid)
+            elif not same_entry(stored[smid], expected[smid]):
+                report['stale'].append(smid)
+    return report
+
+def repair_feed_entries(db: Session, report):
+    # Refresh the entries a check_feed_entries report flagged
+    drifted = sorted(report['missing'] + report['stale'] + report['orphaned'])
+    for start in range(0, len(drifted), CHUNK_SIZE):
+        refresh_feed_entries(db, drifted[start:start + CHUNK_SIZE])
+
+def rebuild_feed_entries(db: Session):
+    """
+    Replace every feed entry with one rebuilt from the source tables.
+    """
+    db.execute(delete(FeedEntry))
+    smids = sorted(db.execute(select(SocialMedia.SMID)).scalars())
+    for start in range(0, len(smids), CHUNK_SIZE):
+        entries = feed_entry_rows(db, SocialMedia.SMID.in_(smids[start:start + CHUNK_SIZE]))
+        if entries:
+            db.execute(insert(FeedEntry), entries)
+    bump_versions(db, [FEED_VERSION, POSTED_RECIPES_VERSION])
+
+if __name__ == "__main__":
+    import argparse
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(prog="python -m feed")
+    parser.add_argument("command", choices=("check", "rebuild"))
+    parser.add_argument("--repair", action="store_true", help="refresh the entries the check finds out of date")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            rebuild_feed_entries(db)
+            db.commit()
+            print("Rebuilt the feed entries")
+        else:
+            report = check_feed_entries(db)
+            for kind, smids in report.items():
+                print(f"{kind:<9} {len(smids)}" + (": " + ", ".join(smids[:20]) if smids else ""))
+            if args.repair and any(report.values()):
+                repair_feed_entries(db, report)
+                db.commit()
+                print("Repaired the feed entries")
+    finally:
+        db.close()
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import FrozenSet, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import (
+    Column, Float, Integer, LargeBinary, MetaData, String, Table, Text, create_engine, delete, func, insert, inspect,
+    select, text
+)
+from allergens import hits
+from database import apply_sqlite_pragmas
+from streaming import sse_event
+
+logger = logging.getLogger(__name__)
+
+# Push channel for the feed: likes, comments and new posts are published as
+# small delta events and sent to every connected client over Server-Sent
+# Events, so open tabs no longer poll /posts and /comments/{smid}. Events
+# carry the packed catalog ids of the post's recipe, and like the feed, a
+# client never gets events about a recipe with one of its user's allergens.
+#
+# Each connection reads from its own bounded queue. A client that cannot
+# keep up fills its queue; the pending events are then dropped and replaced
+# by a single `resync` event telling it to refetch, so a slow reader never
+# holds memory or delays the others.
+FEED_EVENTS_BACKEND = os.getenv('FEED_EVENTS_BACKEND', 'memory')  # memory or sqlite
+# The SQLite broker keeps its own file so every worker process sees every event
+FEED_EVENTS_PATH = os.getenv('FEED_EVENTS_PATH', 'feed_events.db')
+FEED_EVENTS_POLL_INTERVAL_MS = int(os.getenv('FEED_EVENTS_POLL_INTERVAL_MS', '200'))
+FEED_EVENTS_QUEUE_SIZE = int(os.getenv('FEED_EVENTS_QUEUE_SIZE', '100'))
+FEED_EVENTS_KEEPALIVE_SECONDS = float(os.getenv('FEED_EVENTS_KEEPALIVE_SECONDS', '15'))
+
+# Events published by the social media routes
+POST_EVENT = 'post'  # {"SMID", "RecipeID"}: a post was added
+LIKE_EVENT = 'like'  # {"SMID", "Likes"}: the post's like count changed
+COMMENT_EVENT = 'comment'  # {"SMID", "CommentID"}: a comment was added
+RESYNC_EVENT = 'resync'  # sent in place of events dropped for a slow client
+
+# How long published events are kept in the SQLite broker's table
+EVENT_RETENTION_SECONDS = 60
+
+# Reconnection delay sent to clients when their stream opens
+RETRY_MS = 3000
+
+KEEPALIVE = ': keepalive\n\n'
+CLOSED = None
+
+
+class Subscription:
+    """
+    One connected client: a bounded queue of formatted events, and the
+    catalog ids of its user's allergens.
+    """
+
+    def __init__(self, maxsize: int, allergen_ids: FrozenSet[int] = frozenset()):
+        self.queue = asyncio.Queue(maxsize)
+        self.allergen_ids = allergen_ids
+        self.resyncs = 0
+
+    def offer(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Replace the backlog with one resync, the client refetches instead
+            self.resyncs += 1
+            self._clear()
+            self.queue.put_nowait(sse_event(RESYNC_EVENT, {}))
+
+    def close(self):
+        self._clear()
+        self.queue.put_nowait(CLOSED)
+
+    def _clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def messages(self, keepalive: float = FEED_EVENTS_KEEPALIVE_SECONDS):
+        """
+        Formatted events until the subscription is closed, with a keepalive
+        comment after `keepalive` seconds without one so proxies keep the
+        connection open.
+        """
+        while True:
+            try:
+                message = await asyncio.wait_for(self.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE
+                continue
+            if message is CLOSED:
+                return
+            yield message
+
+class FeedHub:
+    """
+    Fan-out of events to the subscriptions of this process. Every event is
+    formatted once, whatever the number of subscribers.
+    """
+
+    def __init__(self, queue_size: int = FEED_EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscriptions = set()
+        self.delivered = 0
+
+    def subscribe(self, allergen_ids: FrozenSet[int] = frozenset()):
+        subscription = Subscription(self.queue_size, allergen_ids)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def deliver(self, event: str, data, catalog_ids: Optional[bytes] = None):
+        message = sse_event(event, data)
+        for subscription in self.subscriptions:
+            if catalog_ids is not None and hits(subscription.allergen_ids, catalog_ids):
+                continue
+            subscription.offer(message)
+        self.delivered += 1
+
+    def close_all(self):
+        # End every open stream, e.g. at shutdown
+        for subscription in list(self.subscriptions):
+            subscription.close()
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscriptions),
+            "delivered": self.delivered,
+            "resyncs": sum(subscription.resyncs for subscription in self.subscriptions),
+        }
+
+class MemoryFeedBroker:
+    """
+    Broker of a single worker process: published events go straight to the
+    local hub.
+    """
+
+    def __init__(self, hub: FeedHub = None):
+        self.hub = hub or FeedHub()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.hub.close_all()
+
+    async def publish(self, event: str, data, catalog_ids: Optional[bytes] = None):
+        self.hub.deliver(event, data, catalog_ids)
+
+class SQLiteFeedBroker:
+    """
+    Broker shared by every worker process through a SQLite table. Publishing
+    appends a row; each worker polls for rows newer than the last it has
+    seen and delivers them to its own hub. Rows are purged after
+    EVENT_RETENTION_SECONDS.
+    """
+
+    def __init__(self, path: str, poll_interval_ms: int = FEED_EVENTS_POLL_INTERVAL_MS, hub: FeedHub = None):
+        self.hub = hub or FeedHub()
+        self.poll_interval_ms = poll_interval_ms
+        self.engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+        apply_sqlite_pragmas(self.engine)
+        self.table = Table(
+            'feed_events', MetaData(),
+            Column('EventID', Integer, primary_key=True, autoincrement=True),
+            Column('Event', String, nullable=False),
+            Column('Data', Text, nullable=False),
+            Column('CatalogIDs', LargeBinary, nullable=True),
+            Column('CreatedAt', Float, nullable=False, index=True),
+            # Ids are never reused once purged rows leave the table empty
+            sqlite_autoincrement=True,
+        )
+        self._ready = False
+        self._last_id = 0
+        self._task = None
+
+    def _ensure_table(self):
+        # Created on first use so importing the app runs no DDL
+        if not self._ready:
+            self.table.create(self.engine, checkfirst=True)
+            # Files created before events carried catalog ids lack the column
+            if 'CatalogIDs' not in {column['name'] for column in inspect(self.engine).get_columns('feed_events')}:
+                with self.engine.begin() as conn:
+                    conn.execute(text('ALTER TABLE feed_events ADD COLUMN "CatalogIDs" BLOB'))
+            self._ready = True
+
+    def _append(self, event: str, data, catalog_ids: Optional[bytes]):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(insert(self.table).values(
+                Event=event, Data=json.dumps(data), CatalogIDs=catalog_ids, CreatedAt=time.time()
+            ))
+
+    def _read_new(self):
+        self._ensure_table()
+        columns = self.table.c
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(columns.EventID, columns.Event, columns.Data, columns.CatalogIDs)
+                .where(columns.EventID > self._last_id)
+                .order_by(columns.EventID)
+            ).all()
+            conn.execute(delete(self.table).where(columns.CreatedAt < time.time() - EVENT_RETENTION_SECONDS))
+        return rows
+
+    def _latest_id(self):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            return conn.execute(select(func.coalesce(func.max(self.table.c.EventID), 0))).scalar()
+
+    async def start(self):
+        # Only events published from now on are delivered
+        self._last_id = await run_in_threadpool(self._latest_id)
+        self._task = asyncio.create_task(self._relay())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.hub.close_all()
+
+    async def publish(self, event: str, data, catalog_ids: Optional[bytes] = None):
+        await run_in_threadpool(self._append, event, data, catalog_ids)
+
+    async def poll(self):
+        # Deliver the events appended since the last poll, returns how many
+        rows = await run_in_threadpool(self._read_new)
+        for event_id, event, data, catalog_ids in rows:
+            self.hub.deliver(event, json.loads(data), catalog_ids)
+            self._last_id = event_id
+        return len(rows)
+
+    async def _relay(self):
+        while True:
+            await asyncio.sleep(self.poll_interval_ms / 1000)
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Feed event poll failed, retrying")
+
+def make_feed_broker(backend: str = FEED_EVENTS_BACKEND):
+    if backend == 'memory':
+        return MemoryFeedBroker()
+    if backend == 'sqlite':
+        return SQLiteFeedBroker(FEED_EVENTS_PATH)
+    raise ValueError(f"Unknown FEED_EVENTS_BACKEND '{backend}', use 'memory' or 'sqlite'")
+
+feed_broker = make_feed_broker()
+
+async def publish(event: str, data, catalog_ids: Optional[bytes] = None):
+    """
+    Publish a feed event after the write it describes has committed, with
+    the packed catalog ids of the post's recipe so clients allergic to it
+    are skipped. A failure is logged, never raised: the write already
+    succeeded and clients still converge on their next fetch.
+    """
+    try:
+        await feed_broker.publish(event, data, catalog_ids)
+    except Exception:
+        logger.exception("Feed event publish failed")
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import List
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Column, Float, MetaData, String, Table, Text, create_engine, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from cache import TTLCache
+from database import apply_sqlite_pragmas
+
+logger = logging.getLogger(__name__)
+
+# Generated recipes are cached by a normalized form of the request, so the
+# same ingredients and restrictions in another order or case, or the same
+# question with different spacing, reuse one completion.
+GENERATION_CACHE_BACKEND = os.getenv('GENERATION_CACHE_BACKEND', 'memory')  # memory or sqlite
+GENERATION_CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', '1000'))
+GENERATION_CACHE_TTL_SECONDS = int(os.getenv('GENERATION_CACHE_TTL_SECONDS', str(24 * 3600)))
+# The SQLite backend keeps its own file so every worker process shares it
+GENERATION_CACHE_PATH = os.getenv('GENERATION_CACHE_PATH', 'generation_cache.db')
+
+# Batch generation: items per request, and upstream calls a user can have
+# in flight at once across all of their batches
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '20'))
+BATCH_USER_CONCURRENCY = int(os.getenv('BATCH_USER_CONCURRENCY', '4'))
+
+
+def normalize_text(value: str):
+    # Lower-case, collapse whitespace and drop trailing punctuation
+    return re.sub(r'\s+', ' ', value).strip().lower().rstrip('.!?')
+
+def normalize_items(values: List[str]):
+    return sorted({normalize_text(value) for value in values} - {''})
+
+def generation_key(question: str, ingredients: List[str], dietary_restrictions: List[str], model: str = ''):
+    normalized = [model, normalize_text(question), normalize_items(ingredients), normalize_items(dietary_restrictions)]
+    return hashlib.sha256(json.dumps(normalized).encode()).hexdigest()
+
+
+class MemoryGenerationStore:
+    """
+    Per-process store, an LRU cache with a TTL.
+    """
+    blocking = False
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class SQLiteGenerationStore:
+    """
+    Store in a SQLite table, shared by every worker process and kept across
+    restarts. Entries expire after the TTL and the least recently used ones
+    are evicted beyond `maxsize`.
+    """
+    blocking = True
+
+    def __init__(self, path: str, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+        apply_sqlite_pragmas(self.engine)
+        self.table = Table(
+            'generation_cache', MetaData(),
+            Column('Key', String(64), primary_key=True),
+            Column('Value', Text, nullable=False),
+            Column('ExpiresAt', Float, nullable=False),
+            Column('LastUsedAt', Float, nullable=False, index=True),
+        )
+        self._ready = False
+
+    def _ensure_table(self):
+        # Created on first use so importing the app runs no DDL
+        if not self._ready:
+            self.table.create(self.engine, checkfirst=True)
+            self._ready = True
+
+    def get(self, key):
+        self._ensure_table()
+        now = time.time()
+        with self.engine.begin() as conn:
+            value = conn.execute(
+                select(self.table.c.Value).where(self.table.c.Key == key, self.table.c.ExpiresAt > now)
+            ).scalar()
+            if value is None:
+                self.misses += 1
+                return None
+            conn.execute(update(self.table).where(self.table.c.Key == key).values(LastUsedAt=now))
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        self._ensure_table()
+        now = time.time()
+        statement = insert(self.table).values(Key=key, Value=json.dumps(value), ExpiresAt=now + self.ttl, LastUsedAt=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.table.c.Key],
+            set_={'Value': statement.excluded.Value, 'ExpiresAt': statement.excluded.ExpiresAt, 'LastUsedAt': now}
+        )
+        with self.engine.begin() as conn:
+            conn.execute(statement)
+            conn.execute(delete(self.table).where(self.table.c.ExpiresAt <= now))
+            excess = conn.execute(select(func.count()).select_from(self.table)).scalar() - self.maxsize
+            if excess > 0:
+                oldest = select(self.table.c.Key).order_by(self.table.c.LastUsedAt).limit(excess)
+                conn.execute(delete(self.table).where(self.table.c.Key.in_(oldest.scalar_subquery())))
+
+    def clear(self):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table))
+
+    def stats(self):
+        self._ensure_table()
+        with self.engine.connect() as conn:
+            size = conn.execute(select(func.count()).select_from(self.table)).scalar()
+        return {"hits": self.hits, "misses": self.misses, "size": size}
+
+
+class GenerationCache:
+    """
+    Cache in front of the LLM. Concurrent requests for the same key are
+    coalesced: the first one calls the LLM and the others wait for its
+    result instead of making their own upstream call. Failures are not
+    cached.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.coalesced = 0
+        self._inflight = {}  # key -> future of the running generation
+
+    async def _call(self, fn, *args):
+        if self.store.blocking:
+            return await run_in_threadpool(fn, *args)
+        return fn(*args)
+
+    async def get(self, key: str):
+        return await self._call(self.store.get, key)
+
+    async def set(self, key: str, value):
+        try:
+            await self._call(self.store.set, key, value)
+        except Exception:
+            # A cache write failure must not fail the request
+            logger.exception("Generation cache write failed")
+
+    async def get_or_generate(self, key: str, generate):
+        """
+        Return the cached value for `key`, or await `generate()` to produce
+        and cache it.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The leading request was cancelled, not this one: try again
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get_or_generate(key, generate)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await generate()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Mark the exception retrieved in case nobody was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(value)
+        await self.set(key, value)
+        return value
+
+    def stats(self):
+        return {**self.store.stats(), "coalesced": self.coalesced, "inflight": len(self._inflight)}
+
+class KeyedLimiter:
+    """
+    One concurrency limit per key, e.g. per user. Entries are dropped once
+    nobody holds or waits for them.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._entries = {}  # key -> [semaphore, holders and waiters]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [asyncio.Semaphore(self.limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._entries[key]
+
+def make_store(backend: str = GENERATION_CACHE_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteGenerationStore(GENERATION_CACHE_PATH, GENERATION_CACHE_SIZE, GENERATION_CACHE_TTL_SECONDS)
+    if backend == 'memory':
+        return MemoryGenerationStore(GENERATION_CACHE_SIZE, GENERATION_CACHE_TTL_SECONDS)
+    raise ValueError(f"Unknown GENERATION_CACHE_BACKEND '{backend}', use 'memory' or 'sqlite'")
+
+generation_cache = GenerationCache(make_store())
+batch_limiter = KeyedLimiter(BATCH_USER_CONCURRENCY)
@@ -1,9 +1,9 @@
-from models import Base
-from database import engine
+from database import writer_engine
+from migrations import upgrade
 
 def initialize_database():
-    Base.metadata.create_all(engine)
+    upgrade(writer_engine)
     print("Database initialized successfully.")
 
 if __name__ == '__main__':
-    initialize_database()
\ No newline at end of file
+    initialize_database()
@@ -0,0 +1,270 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import httpx
+from fastapi import HTTPException
+from sqlalchemy import and_, func, or_, select, update
+from database import async_writer_engine
+from generation import generation_cache, generation_key
+from llm import GenerateRecipeRequest, get_llm_client
+from models import GenerationJob
+from ratelimit import metered
+
+logger = logging.getLogger(__name__)
+
+# Background generation: jobs are rows of generation_jobs in the app
+# database, claimed by a pool of workers in each app process, so no
+# external broker is needed. A claimed job is leased for JOB_LEASE_SECONDS;
+# if its worker dies, another worker picks it up once the lease expires.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_POLL_INTERVAL_MS = int(os.getenv('JOB_POLL_INTERVAL_MS', '1000'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_RETRY_BASE_DELAY = float(os.getenv('JOB_RETRY_BASE_DELAY', '2'))
+JOB_RETRY_MAX_DELAY = float(os.getenv('JOB_RETRY_MAX_DELAY', '60'))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv('WEBHOOK_TIMEOUT_SECONDS', '5'))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '3'))
+# Hosts job callbacks may be sent to, comma-separated. When unset, any host
+# resolving only to public addresses is accepted.
+JOB_CALLBACK_HOSTS = [host.strip().lower() for host in os.getenv('JOB_CALLBACK_HOSTS', '').split(',') if host.strip()]
+
+QUEUED, RUNNING, SUCCEEDED, DEAD = 'queued', 'running', 'succeeded', 'dead'
+
+jobs_table = GenerationJob.__table__
+
+
+def backoff(attempt: int, base: float, cap: float):
+    # Full-jitter exponential backoff
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def resolve_host(host: str, port: int):
+    return {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+
+def check_callback_url(url: str):
+    """
+    Raise ValueError when job callbacks must not be sent to `url`: its host
+    is not in JOB_CALLBACK_HOSTS or, without an allowlist, it resolves to a
+    loopback, private, link-local or otherwise non-public address, so a
+    user cannot make the server call into its own network. Checked when the
+    job is created and again before each send, as DNS answers can change.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if JOB_CALLBACK_HOSTS:
+        if host not in JOB_CALLBACK_HOSTS:
+            raise ValueError("Callback host is not allowed")
+        return
+    try:
+        addresses = resolve_host(host, parts.port or (443 if parts.scheme == 'https' else 80))
+    except (OSError, UnicodeError):
+        raise ValueError("Callback host cannot be resolved")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError("Callback URL must resolve to a public address")
+
+def serialize_job(job):
+    return {
+        "job_id": job.JobID,
+        "status": job.Status,
+        "attempts": job.Attempts,
+        "result": json.loads(job.Result) if job.Result else None,
+        "error": job.Error,
+        "callback_status": job.CallbackStatus,
+        "created_at": job.CreatedAt.isoformat(),
+        "finished_at": job.FinishedAt.isoformat() if job.FinishedAt else None,
+    }
+
+def claimable(now: datetime):
+    # Queued jobs that are due, and running jobs whose worker lost its lease
+    return or_(
+        and_(jobs_table.c.Status == QUEUED, jobs_table.c.RunAt <= now),
+        and_(jobs_table.c.Status == RUNNING, jobs_table.c.LockedUntil < now),
+    )
+
+async def claim_job(engine, lease_seconds: int = JOB_LEASE_SECONDS):
+    """
+    Atomically take the next due job and lease it, or return None. The
+    outer condition is checked again on the row being updated, so two
+    workers racing for the same job cannot both get it.
+    """
+    now = datetime.utcnow()
+    next_job = select(jobs_table.c.JobID).where(claimable(now)).order_by(jobs_table.c.RunAt).limit(1).scalar_subquery()
+    statement = (
+        update(jobs_table)
+        .where(jobs_table.c.JobID == next_job, claimable(now))
+        .values(Status=RUNNING, Attempts=jobs_table.c.Attempts + 1, LockedUntil=now + timedelta(seconds=lease_seconds))
+        .returning(*jobs_table.c)
+    )
+    async with engine.begin() as conn:
+        return (await conn.execute(statement)).first()
+
+async def finish_job(engine, job_id: str, **values):
+    async with engine.begin() as conn:
+        await conn.execute(update(jobs_table).where(jobs_table.c.JobID == job_id).values(**values))
+
+async def queue_depth(engine):
+    """
+    Number of jobs per status, and the age in seconds of the oldest job
+    still waiting to run.
+    """
+    async with engine.connect() as conn:
+        counts = dict((await conn.execute(
+            select(jobs_table.c.Status, func.count()).group_by(jobs_table.c.Status)
+        )).all())
+        oldest = (await conn.execute(
+            select(func.min(jobs_table.c.CreatedAt)).where(jobs_table.c.Status == QUEUED)
+        )).scalar()
+    return {
+        "jobs": {status: counts.get(status, 0) for status in (QUEUED, RUNNING, SUCCEEDED, DEAD)},
+        "oldest_queued_seconds": round((datetime.utcnow() - oldest).total_seconds(), 3) if oldest else 0.0,
+    }
+
+
+class JobWorkerPool:
+    """
+    Workers running queued generation jobs. Failed attempts are retried
+    with jittered backoff up to the job's MaxAttempts, after which the job
+    is dead-lettered: it keeps status 'dead' with its last error until an
+    admin requeues it. A job's callback URL is sent the outcome once it
+    succeeds or dies.
+    """
+
+    def __init__(self, engine, workers: int = JOB_WORKERS, provider=None, transport: httpx.AsyncBaseTransport = None):
+        self.engine = engine
+        self.workers = workers
+        self.provider = provider
+        self.transport = transport
+        self._tasks = []
+        self._wakeup = None
+        self._loop = None
+        self._http = None
+        self._busy = 0
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.callbacks_delivered = 0
+        self.callbacks_failed = 0
+
+    def notify(self):
+        """
+        Wake idle workers as soon as a job is queued instead of at the next
+        poll. Safe to call from any thread: the sync routes run in the
+        threadpool, and the event may only be set on its own loop.
+        """
+        if self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._http = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS, transport=self.transport)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _work(self):
+        while True:
+            try:
+                job = await claim_job(self.engine)
+            except Exception:
+                logger.exception("Job claim failed")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL_MS / 1000)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._busy += 1
+            try:
+                await self.run(job)
+            except Exception:
+                # The lease expires and another worker retries the job
+                logger.exception("Job %s failed unexpectedly", job.JobID)
+            finally:
+                self._busy -= 1
+
+    async def run(self, job):
+        provider = self.provider or get_llm_client()
+        request = GenerateRecipeRequest.model_validate_json(job.Request)
+        key = generation_key(request.question, request.ingredients, request.dietary_restrictions, provider.model)
+        try:
+            recipe = await generation_cache.get_or_generate(key, lambda: metered(job.UserID, request, provider.generate(request)))
+        except Exception as exc:
+            error = exc.detail if isinstance(exc, HTTPException) else str(exc) or type(exc).__name__
+            if job.Attempts < job.MaxAttempts:
+                self.retried += 1
+                run_at = datetime.utcnow() + timedelta(seconds=backoff(job.Attempts, JOB_RETRY_BASE_DELAY, JOB_RETRY_MAX_DELAY))
+                await finish_job(self.engine, job.JobID, Status=QUEUED, RunAt=run_at, LockedUntil=None, Error=error)
+                return
+            self.dead_lettered += 1
+            await finish_job(self.engine, job.JobID, Status=DEAD, LockedUntil=None, Error=error, FinishedAt=datetime.utcnow())
+            await self.send_callback(job, {"job_id": job.JobID, "status": DEAD, "result": None, "error": error})
+            return
+        self.processed += 1
+        await finish_job(
+            self.engine, job.JobID,
+            Status=SUCCEEDED, LockedUntil=None, Result=json.dumps(recipe), Error=None, FinishedAt=datetime.utcnow()
+        )
+        await self.send_callback(job, {"job_id": job.JobID, "status": SUCCEEDED, "result": recipe, "error": None})
+
+    async def send_callback(self, job, payload):
+        if not job.CallbackURL:
+            return
+        try:
+            await asyncio.to_thread(check_callback_url, job.CallbackURL)
+        except ValueError as exc:
+            logger.warning("Job %s callback not sent: %s", job.JobID, exc)
+            self.callbacks_failed += 1
+            await finish_job(self.engine, job.JobID, CallbackStatus='rejected')
+            return
+        for attempt in range(WEBHOOK_MAX_ATTEMPTS):
+            try:
+                response = await self._http.post(job.CallbackURL, json=payload)
+                if response.status_code < 500:
+                    delivered = response.is_success
+                    break
+            except httpx.HTTPError:
+                pass
+            delivered = False
+            if attempt < WEBHOOK_MAX_ATTEMPTS - 1:
+                await asyncio.sleep(backoff(attempt, 0.5, 5))
+        if delivered:
+            self.callbacks_delivered += 1
+        else:
+            logger.warning("Job %s callback to %s failed after %d attempts", job.JobID, job.CallbackURL, WEBHOOK_MAX_ATTEMPTS)
+            self.callbacks_failed += 1
+        await finish_job(self.engine, job.JobID, CallbackStatus='delivered' if delivered else 'failed')
+
+    async def stats(self):
+        return {
+            **await queue_depth(self.engine),
+            "workers": len(self._tasks),
+            "busy": self._busy,
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "callbacks_delivered": self.callbacks_delivered,
+            "callbacks_failed": self.callbacks_failed,
+        }
+
+job_pool = JobWorkerPool(async_writer_engine)
+
+def get_job_pool():
+    # Dependency so tests can run their own pool
+    return job_pool
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from sqlalchemy import bindparam, update
+from models import SocialMedia, FeedEntry
+from etags import FEED_VERSION, bump_versions
+
+logger = logging.getLogger(__name__)
+
+# With batching enabled, like/unlike deltas for SocialMedia.Likes are kept in
+# memory and written in one executemany every LIKE_FLUSH_INTERVAL_MS, so a
+# viral post does not serialize every like on its row. PostLike rows are
+# still written in the request transaction and remain the source of truth.
+LIKE_BATCHING = os.getenv('LIKE_BATCHING', '0') == '1'
+LIKE_FLUSH_INTERVAL_MS = int(os.getenv('LIKE_FLUSH_INTERVAL_MS', '200'))
+LIKE_COUNTER_SHARDS = 16
+
+
+class ShardedCounter:
+    """
+    In-memory counter of pending deltas, split into independently locked
+    shards so concurrent writers on different keys rarely contend.
+    """
+
+    def __init__(self, shards: int = LIKE_COUNTER_SHARDS):
+        self._shards = [(threading.Lock(), defaultdict(int)) for _ in range(shards)]
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def add(self, key, delta: int = 1):
+        lock, counts = self._shard(key)
+        with lock:
+            counts[key] += delta
+
+    def pending(self, key):
+        lock, counts = self._shard(key)
+        with lock:
+            return counts.get(key, 0)
+
+    def drain(self):
+        """
+        Take every pending delta out of the counter, returning {key: delta}.
+        """
+        drained = {}
+        for lock, counts in self._shards:
+            with lock:
+                drained.update((key, delta) for key, delta in counts.items() if delta)
+                counts.clear()
+        return drained
+
+like_counter = ShardedCounter()
+
+# One UPDATE per post and one per feed entry, each a single executemany
+apply_like_deltas = (
+    update(SocialMedia.__table__)
+    .where(SocialMedia.__table__.c.SMID == bindparam('b_smid'))
+    .values(Likes=SocialMedia.__table__.c.Likes + bindparam('b_delta'))
+)
+apply_feed_like_deltas = (
+    update(FeedEntry.__table__)
+    .where(FeedEntry.__table__.c.SMID == bindparam('b_smid'))
+    .values(Likes=FeedEntry.__table__.c.Likes + bindparam('b_delta'))
+)
+
+async def flush_likes(engine, counter: ShardedCounter = like_counter):
+    """
+    Write the pending like deltas to the database in one transaction.
+    On failure the deltas go back into the counter for the next flush.
+    """
+    deltas = counter.drain()
+    if not deltas:
+        return 0
+    try:
+        async with engine.begin() as conn:
+            parameters = [{'b_smid': smid, 'b_delta': delta} for smid, delta in deltas.items()]
+            await conn.execute(apply_like_deltas, parameters)
+            await conn.execute(apply_feed_like_deltas, parameters)
+            await conn.run_sync(bump_versions, [FEED_VERSION])
+    except Exception:
+        for smid, delta in deltas.items():
+            counter.add(smid, delta)
+        raise
+    return len(deltas)
+
+async def run_like_flusher(engine, interval_ms: int = LIKE_FLUSH_INTERVAL_MS):
+    try:
+        while True:
+            await asyncio.sleep(interval_ms / 1000)
+            try:
+                await flush_likes(engine)
+            except Exception:
+                logger.exception("Like counter flush failed, retrying")
+    finally:
+        # Write whatever is left when the app shuts down
+        await flush_likes(engine)
@@ -0,0 +1,391 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import random
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, List
+import httpx
+import openai
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+
+logger = logging.getLogger(__name__)
+
+# Recipe generation provider, selected by config:
+#   openai   - OpenAI with structured output (default)
+#   http     - any OpenAI-compatible server, e.g. a local model
+#   template - offline, deterministic recipes built from the request
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+
+# Set your OpenAI API key, or OPENAI_API_KEY in the environment
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "API_KEY")
+# Optional proxy in front of the OpenAI API
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+LLM_HTTP_BASE_URL = os.getenv("LLM_HTTP_BASE_URL", "http://localhost:8000/v1")
+LLM_HTTP_API_KEY = os.getenv("LLM_HTTP_API_KEY", "not-needed")
+
+# Simulated generation time of the template provider, for load tests
+LLM_TEMPLATE_DELAY_SECONDS = float(os.getenv("LLM_TEMPLATE_DELAY_SECONDS", "0"))
+
+# Upstream call tuning: a completion takes seconds, so the read timeout is
+# generous while connecting should be quick. At most LLM_MAX_CONCURRENCY
+# calls run at once per worker, the others wait their turn.
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+
+# How long to wait for a client left by another event loop to close there
+CLIENT_CLOSE_TIMEOUT_SECONDS = 5
+
+SYSTEM_PROMPT = """You create recipes using given ingredients. 
+             Include the ingredients in the contents. Return only the names of ingredients
+               in a comma separated manner without any quantities."""
+
+# Servers without structured output get the expected shape in the prompt
+JSON_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+Answer with a single JSON object with the keys "title" (string), "content" (string),
+"ingredients" (list of strings), "userGenerated" (false) and "cuisine" (string)."""
+
+# Errors worth another attempt: timeouts, dropped connections, 429 and 5xx
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class RecipeBase(BaseModel):
+    title: str
+    content: str
+
+class RecipeLLM(RecipeBase):
+    ingredients: List[str]
+    userGenerated: bool
+    cuisine: str
+
+class GenerateRecipeRequest(BaseModel):
+    question: str
+    ingredients: List[str]
+    dietary_restrictions: List[str]
+
+def build_prompt(request: GenerateRecipeRequest):
+    return f"Create a recipe using the following ingredients: {request.ingredients}. Dietary restrictions: {request.dietary_restrictions}. Question: {request.question}"
+
+def build_messages(prompt: str, system_prompt: str = SYSTEM_PROMPT):
+    return [
+        { "role": "system", "content": system_prompt },
+        {
+            "role": "user",
+            "content": prompt,
+        },
+    ]
+
+def validate_recipe(content: str):
+    """
+    Validate a completion against RecipeLLM and return it as a dict.
+    """
+    try:
+        return RecipeLLM.model_validate_json(content).model_dump()
+    except ValidationError:
+        raise HTTPException(status_code=500, detail="Failed to parse recipe data from OpenAI response.")
+
+def retry_delay(attempt: int, error=None):
+    """
+    Full-jitter exponential backoff, never shorter than a Retry-After the
+    server asked for.
+    """
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass
+    return delay
+
+def upstream_error(error):
+    if isinstance(error, openai.APITimeoutError):
+        return HTTPException(status_code=504, detail="Recipe generation timed out.")
+    return HTTPException(status_code=502, detail="Recipe generation failed, try again later.")
+
+
+class RecipeProvider(ABC):
+    """
+    Interface of a recipe generation backend. `model` names the model and
+    is part of the generation cache key.
+    """
+    model: str
+
+    @abstractmethod
+    async def generate(self, request: GenerateRecipeRequest):
+        """
+        Return the generated recipe as a dict validated against RecipeLLM.
+        """
+
+    @abstractmethod
+    def stream(self, request: GenerateRecipeRequest) -> AsyncIterator[str]:
+        """
+        Yield the recipe JSON text as it is generated (implemented as an
+        async generator). The caller validates the concatenated text once
+        the stream ends.
+        """
+
+    async def close(self):
+        pass
+
+
+class OpenAIRecipeClient(RecipeProvider):
+    """
+    Async GPT-4o client for recipe generation. Connections are pooled and
+    reused, calls are bounded by a per-worker concurrency limit and
+    transient failures are retried with jittered backoff.
+    """
+
+    def __init__(
+        self,
+        model: str = LLM_MODEL,
+        api_key: str = OPENAI_API_KEY,
+        base_url: str = OPENAI_BASE_URL,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        connect_timeout: float = LLM_CONNECT_TIMEOUT_SECONDS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        max_retries: int = LLM_MAX_RETRIES,
+        transport: httpx.AsyncBaseTransport = None,
+    ):
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.transport = transport
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+
+    async def _ensure_client(self):
+        # The HTTP pool and the semaphore belong to the running event loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._client is not None:
+                await self._close_stale_client(self._client, self._loop)
+            http_client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            )
+            # Retries are handled here, with jitter and the concurrency slot released
+            self._client = openai.AsyncOpenAI(
+                api_key=self.api_key, base_url=self.base_url, http_client=http_client, max_retries=0
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._client
+
+    @staticmethod
+    async def _close_stale_client(client, loop):
+        """
+        Close a client left by another event loop. Its connections are bound
+        to that loop, so while it runs they are closed there and this waits
+        up to CLIENT_CLOSE_TIMEOUT_SECONDS for it; once it has stopped, the
+        client is closed here.
+        """
+        if loop.is_running():
+            closed = concurrent.futures.Future()
+
+            def report(task):
+                if task.cancelled():
+                    closed.cancel()
+                elif task.exception() is not None:
+                    closed.set_exception(task.exception())
+                else:
+                    closed.set_result(None)
+
+            def close_there():
+                # The coroutine is only created once that loop runs this, so a
+                # loop stopping first leaves nothing unawaited behind
+                loop.create_task(client.close()).add_done_callback(report)
+
+            try:
+                loop.call_soon_threadsafe(close_there)
+            except RuntimeError:
+                pass  # closed in the meantime, the client is closed here
+            else:
+                try:
+                    await asyncio.wait_for(asyncio.wrap_future(closed), CLIENT_CLOSE_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.warning("The LLM client of a previous event loop did not close in time")
+                except Exception:
+                    logger.exception("Closing the LLM client on its event loop failed")
+                return
+        try:
+            await client.close()
+        except Exception:
+            logger.exception("Closing the LLM client of a stopped event loop failed")
+
+    async def _complete(self, client, prompt: str):
+        response = await client.beta.chat.completions.parse(
+            model=self.model,
+            messages=build_messages(prompt),
+            response_format=RecipeLLM,
+        )
+        return response.choices[0].message.content
+
+    async def _deltas(self, client, prompt: str):
+        async with client.beta.chat.completions.stream(
+            model=self.model,
+            messages=build_messages(prompt),
+            response_format=RecipeLLM,
+        ) as stream:
+            async for event in stream:
+                if event.type == "content.delta":
+                    yield event.delta
+
+    async def generate(self, request: GenerateRecipeRequest):
+        prompt = build_prompt(request)
+        for attempt in range(self.max_retries + 1):
+            try:
+                client = await self._ensure_client()
+                async with self._semaphore:
+                    content = await self._complete(client, prompt)
+                break
+            except RETRYABLE_ERRORS as exc:
+                if attempt == self.max_retries:
+                    raise upstream_error(exc)
+                await asyncio.sleep(retry_delay(attempt, exc))
+            except openai.APIStatusError as exc:
+                raise upstream_error(exc)
+        return validate_recipe(content)
+
+    async def stream(self, request: GenerateRecipeRequest):
+        # Only failures before the first token are retried
+        prompt = build_prompt(request)
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                client = await self._ensure_client()
+                async with self._semaphore:
+                    async for delta in self._deltas(client, prompt):
+                        started = True
+                        yield delta
+                return
+            except ValidationError:
+                raise HTTPException(status_code=500, detail="Failed to parse recipe data from OpenAI response.")
+            except RETRYABLE_ERRORS as exc:
+                if started or attempt == self.max_retries:
+                    raise upstream_error(exc)
+                await asyncio.sleep(retry_delay(attempt, exc))
+            except openai.APIStatusError as exc:
+                raise upstream_error(exc)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = self._loop = self._semaphore = None
+
+
+class OpenAICompatibleRecipeClient(OpenAIRecipeClient):
+    """
+    Client for any OpenAI-compatible server (vLLM, llama.cpp, Ollama, ...).
+    Such servers rarely support structured output, so it asks for a plain
+    JSON object and the result is validated the same way.
+    """
+
+    def __init__(self, model: str = LLM_MODEL, api_key: str = LLM_HTTP_API_KEY, base_url: str = LLM_HTTP_BASE_URL, **kw):
+        super().__init__(model=model, api_key=api_key, base_url=base_url, **kw)
+
+    async def _complete(self, client, prompt: str):
+        response = await client.chat.completions.create(
+            model=self.model,
+            messages=build_messages(prompt, JSON_SYSTEM_PROMPT),
+            response_format={"type": "json_object"},
+        )
+        return response.choices[0].message.content
+
+    async def _deltas(self, client, prompt: str):
+        stream = await client.chat.completions.create(
+            model=self.model,
+            messages=build_messages(prompt, JSON_SYSTEM_PROMPT),
+            response_format={"type": "json_object"},
+            stream=True,
+        )
+        async with stream:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+class TemplateRecipeProvider(RecipeProvider):
+    """
+    Offline provider filling a recipe template from the request. The same
+    request always gives the same recipe, so CI and load tests can run the
+    whole generation path without any network. `delay` simulates the
+    generation time.
+    """
+    model = "template"
+
+    DISHES = ["Skillet", "Bake", "Salad", "Soup", "Stir-Fry", "Stew"]
+    CUISINES = ["Italian", "Mexican", "Indian", "Chinese", "Japanese", "French", "Thai", "Greek"]
+    STREAM_CHUNK_SIZE = 16
+
+    def __init__(self, delay: float = LLM_TEMPLATE_DELAY_SECONDS):
+        self.delay = delay
+
+    def render(self, request: GenerateRecipeRequest):
+        ingredients = list(dict.fromkeys(name.strip() for name in request.ingredients if name.strip()))
+        restrictions = [name.strip() for name in request.dietary_restrictions if name.strip()]
+        question = request.question.lower()
+        cuisine = next((cuisine for cuisine in self.CUISINES if cuisine.lower() in question), "Unknown")
+        # Pick the dish from a stable hash of the request, not Python's salted hash()
+        digest = hashlib.sha256(json.dumps([question, ingredients, restrictions]).encode()).digest()
+        dish = self.DISHES[digest[0] % len(self.DISHES)]
+
+        names = ", ".join(ingredients) if ingredients else "pantry staples"
+        title = f"{ingredients[0].title() if ingredients else 'Pantry'} {dish}"
+        if cuisine != "Unknown":
+            title = f"{cuisine} {title}"
+        steps = [f"Prepare the ingredients: {names}."]
+        steps += [f"Add the {name} and cook until done." for name in ingredients]
+        steps.append(f"Serve the {dish.lower()} warm.")
+        if restrictions:
+            steps.append(f"Suitable for: {', '.join(restrictions)}.")
+        content = "\n".join(f"{i}. {step}" for i, step in enumerate(steps, 1))
+        return {"title": title, "content": content, "ingredients": ingredients, "userGenerated": False, "cuisine": cuisine}
+
+    async def generate(self, request: GenerateRecipeRequest):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return RecipeLLM(**self.render(request)).model_dump()
+
+    async def stream(self, request: GenerateRecipeRequest):
+        text = json.dumps(self.render(request))
+        chunks = [text[i:i + self.STREAM_CHUNK_SIZE] for i in range(0, len(text), self.STREAM_CHUNK_SIZE)]
+        for chunk in chunks:
+            if self.delay:
+                await asyncio.sleep(self.delay / len(chunks))
+            yield chunk
+
+
+def make_provider(name: str = LLM_PROVIDER):
+    if name == "openai":
+        return OpenAIRecipeClient()
+    if name == "http":
+        return OpenAICompatibleRecipeClient()
+    if name == "template":
+        return TemplateRecipeProvider()
+    raise ValueError(f"Unknown LLM_PROVIDER '{name}', use 'openai', 'http' or 'template'")
+
+llm_client = make_provider()
+
+def get_llm_client():
+    # Dependency so tests can swap in a stub client
+    return llm_client
@@ -1,9 +1,16 @@
 from fastapi import FastAPI
 import uvicorn
 from starlette.middleware.sessions import SessionMiddleware
-from database import init_db
-from routers import shoppinglist, auth, recipes, social_media
+import asyncio
+from database import dispose_async_engines, async_writer_engine
+from like_counter import LIKE_BATCHING, run_like_flusher
+from llm import llm_client
+from jobs import job_pool
+from routers import shoppinglist, auth, recipes, social_media, jobs
 from starlette.middleware.cors import CORSMiddleware
+from pagination import NEXT_CURSOR_HEADER
+from compression import COMPRESSION_ENABLED, CompressionMiddleware
+from feed_events import feed_broker
 
 app = FastAPI()
 
@@ -13,14 +20,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
-init_db()
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
 
 app.include_router(shoppinglist.router)
 app.include_router(auth.router)
 app.include_router(recipes.router)
 app.include_router(social_media.router)
+app.include_router(jobs.router)
+
+@app.on_event("startup")
+async def startup_event():
+    if LIKE_BATCHING:
+        app.state.like_flusher = asyncio.create_task(run_like_flusher(async_writer_engine))
+    await job_pool.start()
+    await feed_broker.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if LIKE_BATCHING:
+        app.state.like_flusher.cancel()
+        await asyncio.gather(app.state.like_flusher, return_exceptions=True)
+    await feed_broker.stop()
+    await job_pool.stop()
+    await llm_client.close()
+    await dispose_async_engines()
 
 @app.get("/")
 async def test_endpoint():
@@ -0,0 +1,139 @@
+"""
+Versioned schema migrations.
+
+Each module in migrations/versions is one migration, applied in file name
+order and recorded in the schema_migrations table. A migration defines
+`upgrade(op)`, where `op` is an Operations object bound to the connection
+it runs on. Migrations that set `transactional = False` only build
+indexes; in online mode they run outside a transaction so the indexes are
+built without blocking writes (CREATE INDEX CONCURRENTLY on PostgreSQL,
+one short commit per index on SQLite).
+
+Run from the backend folder:
+    python -m migrations upgrade [--online]
+    python -m migrations status
+"""
+import importlib
+import pkgutil
+from datetime import datetime
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+from migrations import versions
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+migrations_table = Table(
+    MIGRATIONS_TABLE, MetaData(),
+    Column('Version', String, primary_key=True),
+    Column('AppliedAt', DateTime, nullable=False, default=datetime.utcnow),
+)
+
+
+class Operations:
+    """
+    Schema operations available to a migration. Every operation is a no-op
+    when its target already exists, so databases created by an older
+    create_all can be brought under migrations without special casing.
+    """
+
+    def __init__(self, conn, online: bool = False):
+        self.conn = conn
+        self.online = online
+
+    @property
+    def dialect(self):
+        return self.conn.dialect
+
+    def quote(self, name: str):
+        return self.dialect.identifier_preparer.quote(name)
+
+    def has_table(self, table_name: str):
+        return inspect(self.conn).has_table(table_name)
+
+    def has_column(self, table_name: str, column_name: str):
+        return column_name in {column['name'] for column in inspect(self.conn).get_columns(table_name)}
+
+    def has_index(self, table_name: str, index_name: str):
+        return inspect(self.conn).has_index(table_name, index_name)
+
+    def execute(self, statement, parameters=None):
+        return self.conn.execute(text(statement) if isinstance(statement, str) else statement, parameters)
+
+    def create_table(self, table: Table):
+        table.create(self.conn, checkfirst=True)
+
+    def add_column(self, table_name: str, column: Column):
+        """
+        Add a column to an existing table. Returns False when it already
+        exists. NOT NULL columns need a constant server_default on SQLite.
+        """
+        if self.has_column(table_name, column.name):
+            return False
+        # CreateColumn needs the column attached to a table
+        Table(table_name, MetaData(), column)
+        ddl = str(CreateColumn(column).compile(dialect=self.dialect))
+        for foreign_key in column.foreign_keys:
+            # Table-level constraints cannot be added to SQLite tables, inline it
+            target_table, target_column = foreign_key.target_fullname.split('.')
+            ddl += f' REFERENCES {self.quote(target_table)} ({self.quote(target_column)})'
+        self.execute(f'ALTER TABLE {self.quote(table_name)} ADD COLUMN {ddl}')
+        return True
+
+    def create_index(self, index_name: str, table_name: str, columns, unique: bool = False):
+        if self.dialect.name == 'postgresql' and self.online:
+            # A failed concurrent build leaves an invalid index behind, rebuild it
+            valid = self.execute(
+                'SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)',
+                {'name': index_name}
+            ).scalar()
+            if valid is False:
+                self.execute(f'DROP INDEX CONCURRENTLY {self.quote(index_name)}')
+        elif self.has_index(table_name, index_name):
+            return
+        concurrently = 'CONCURRENTLY ' if self.online and self.dialect.name == 'postgresql' else ''
+        self.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX {concurrently}IF NOT EXISTS {self.quote(index_name)} "
+            f"ON {self.quote(table_name)} ({', '.join(self.quote(column) for column in columns)})"
+        )
+
+    def drop_index(self, index_name: str):
+        concurrently = 'CONCURRENTLY ' if self.online and self.dialect.name == 'postgresql' else ''
+        self.execute(f'DROP INDEX {concurrently}IF EXISTS {self.quote(index_name)}')
+
+
+def discover():
+    """
+    Return the (version, module) pairs of every migration, oldest first.
+    The version is the module name, e.g. '0001_initial'.
+    """
+    names = sorted(module.name for module in pkgutil.iter_modules(versions.__path__))
+    return [(name, importlib.import_module(f'{versions.__name__}.{name}')) for name in names]
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        migrations_table.create(conn, checkfirst=True)
+        return set(conn.execute(select(migrations_table.c.Version)).scalars())
+
+def pending(engine):
+    applied = applied_versions(engine)
+    return [(version, module) for version, module in discover() if version not in applied]
+
+def upgrade(engine, online: bool = False):
+    """
+    Apply every pending migration and return the versions applied.
+    """
+    done = []
+    for version, module in pending(engine):
+        if online and not getattr(module, 'transactional', True):
+            # Each statement commits on its own; rerunning after a crash is
+            # safe because index creation skips what already exists
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+                module.upgrade(Operations(conn, online=True))
+                conn.execute(migrations_table.insert().values(Version=version))
+        else:
+            with engine.begin() as conn:
+                module.upgrade(Operations(conn))
+                conn.execute(migrations_table.insert().values(Version=version))
+        done.append(version)
+    return done
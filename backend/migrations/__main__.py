@@ -0,0 +1,17 @@
+import argparse
+from database import writer_engine
+from migrations import discover, applied_versions, upgrade
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m migrations")
+    parser.add_argument("command", choices=("upgrade", "status"))
+    parser.add_argument("--online", action="store_true", help="build indexes without blocking writes")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        done = upgrade(writer_engine, online=args.online)
+        print(f"Applied {len(done)} migration(s)" + (": " + ", ".join(done) if done else ""))
+    else:
+        applied = applied_versions(writer_engine)
+        for version, module in discover():
+            print(f"{'applied' if version in applied else 'pending':<8} {version}")
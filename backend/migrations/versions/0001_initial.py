@@ -0,0 +1,72 @@
+"""
+Initial schema, as created by create_all before migrations existed.
+"""
+from sqlalchemy import (
+    MetaData, Table, Column, String, Boolean, Integer, ForeignKey, Text, UniqueConstraint
+)
+
+metadata = MetaData()
+
+tables = [
+    Table(
+        'users', metadata,
+        Column('UserID', String(36), primary_key=True),
+        Column('Email', String, nullable=False, unique=True),
+        Column('Password', String, nullable=False),
+        Column('Role', Boolean),
+        Column('Name', String, nullable=False),
+    ),
+    Table(
+        'recipe', metadata,
+        Column('RecipeID', String(36), primary_key=True),
+        Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+        Column('RecipeName', String, nullable=False),
+        Column('RecipeContent', Text, nullable=False),
+        Column('Cuisine', String, nullable=False),
+        Column('Visibility', Boolean),
+        Column('UserGenerated', Boolean),
+    ),
+    Table(
+        'ingredients', metadata,
+        Column('IngredientID', String(36), primary_key=True),
+        Column('RecipeID', String(36), ForeignKey('recipe.RecipeID'), nullable=False),
+        Column('IngredientName', String, nullable=False),
+        UniqueConstraint('RecipeID', 'IngredientName', name='uq_recipe_ingredient'),
+    ),
+    Table(
+        'allergy', metadata,
+        Column('AllergyID', String(36), primary_key=True),
+        Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+        Column('IngredientName', String, ForeignKey('ingredients.IngredientName'), nullable=False),
+    ),
+    Table(
+        'social_media', metadata,
+        Column('SMID', String(36), primary_key=True),
+        Column('RecipeID', String(36), ForeignKey('recipe.RecipeID'), nullable=False),
+        Column('Likes', Integer),
+        Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+    ),
+    Table(
+        'comments', metadata,
+        Column('CommentID', String(36), primary_key=True),
+        Column('SMID', String(36), ForeignKey('social_media.SMID'), nullable=False),
+        Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+        Column('CommentText', Text, nullable=False),
+    ),
+    Table(
+        'bookmark', metadata,
+        Column('BookmarkID', String(36), primary_key=True),
+        Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+        Column('RecipeID', String(36), ForeignKey('recipe.RecipeID'), nullable=False),
+    ),
+    Table(
+        'shopping_list_items', metadata,
+        Column('ItemID', String(36), primary_key=True),
+        Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+        Column('IngredientName', String, nullable=False),
+    ),
+]
+
+def upgrade(op):
+    for table in tables:
+        op.create_table(table)
@@ -0,0 +1,14 @@
+"""
+Creation timestamps used for keyset pagination and list ordering.
+Rows that predate the column get the epoch, so they sort as the oldest.
+"""
+from sqlalchemy import Column, DateTime, text
+
+TABLES = ['recipe', 'allergy', 'social_media', 'comments', 'bookmark', 'shopping_list_items']
+
+def upgrade(op):
+    for table_name in TABLES:
+        op.add_column(table_name, Column(
+            'CreatedAt', DateTime, nullable=False,
+            server_default=text("'1970-01-01 00:00:00.000000'")
+        ))
@@ -0,0 +1,22 @@
+"""
+Per-user likes, so a user can like a post only once.
+"""
+from sqlalchemy import MetaData, Table, Column, String, DateTime, ForeignKey, UniqueConstraint
+
+metadata = MetaData()
+
+# Referenced tables, declared only so the foreign keys resolve
+Table('users', metadata, Column('UserID', String(36), primary_key=True))
+Table('social_media', metadata, Column('SMID', String(36), primary_key=True))
+
+post_likes = Table(
+    'post_likes', metadata,
+    Column('LikeID', String(36), primary_key=True),
+    Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+    Column('SMID', String(36), ForeignKey('social_media.SMID'), nullable=False),
+    Column('CreatedAt', DateTime, nullable=False),
+    UniqueConstraint('UserID', 'SMID', name='uq_post_like'),
+)
+
+def upgrade(op):
+    op.create_table(post_likes)
@@ -0,0 +1,34 @@
+"""
+Secondary indexes on the foreign-key and filter columns.
+"""
+
+# Only builds indexes, so it can run online
+transactional = False
+
+INDEXES = [
+    ('ix_recipe_user_created', 'recipe', ['UserID', 'CreatedAt', 'RecipeID'], False),
+    ('ix_recipe_created', 'recipe', ['CreatedAt', 'RecipeID'], False),
+    ('ix_recipe_visibility_cuisine', 'recipe', ['Visibility', 'Cuisine'], False),
+    ('ix_ingredients_name', 'ingredients', ['IngredientName'], False),
+    ('ix_allergy_user_ingredient', 'allergy', ['UserID', 'IngredientName'], False),
+    ('ix_allergy_user_created', 'allergy', ['UserID', 'CreatedAt', 'AllergyID'], False),
+    ('ix_allergy_created', 'allergy', ['CreatedAt', 'AllergyID'], False),
+    ('ix_social_media_recipe', 'social_media', ['RecipeID'], False),
+    ('ix_social_media_created', 'social_media', ['CreatedAt', 'SMID'], False),
+    ('ix_post_likes_smid', 'post_likes', ['SMID'], False),
+    ('ix_comments_smid_created', 'comments', ['SMID', 'CreatedAt', 'CommentID'], False),
+    ('uq_bookmark_user_recipe', 'bookmark', ['UserID', 'RecipeID'], True),
+    ('ix_bookmark_user_created', 'bookmark', ['UserID', 'CreatedAt', 'BookmarkID'], False),
+    ('ix_bookmark_recipe', 'bookmark', ['RecipeID'], False),
+    ('ix_shopping_list_user_ingredient', 'shopping_list_items', ['UserID', 'IngredientName'], False),
+]
+
+def upgrade(op):
+    # Concurrent bookmark requests could store the same bookmark twice,
+    # keep one of each before the unique index goes on
+    op.execute(
+        'DELETE FROM bookmark WHERE "BookmarkID" NOT IN '
+        '(SELECT MIN("BookmarkID") FROM bookmark GROUP BY "UserID", "RecipeID")'
+    )
+    for index_name, table_name, columns, unique in INDEXES:
+        op.create_index(index_name, table_name, columns, unique=unique)
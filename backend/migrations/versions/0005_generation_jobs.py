@@ -0,0 +1,32 @@
+"""
+Queue of background recipe generation jobs.
+"""
+from sqlalchemy import MetaData, Table, Column, String, Integer, Text, DateTime, ForeignKey, Index
+
+metadata = MetaData()
+
+# Referenced table, declared only so the foreign key resolves
+Table('users', metadata, Column('UserID', String(36), primary_key=True))
+
+generation_jobs = Table(
+    'generation_jobs', metadata,
+    Column('JobID', String(36), primary_key=True),
+    Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+    Column('Status', String, nullable=False),
+    Column('Request', Text, nullable=False),
+    Column('Result', Text),
+    Column('Error', Text),
+    Column('Attempts', Integer, nullable=False),
+    Column('MaxAttempts', Integer, nullable=False),
+    Column('RunAt', DateTime, nullable=False),
+    Column('LockedUntil', DateTime),
+    Column('CallbackURL', String),
+    Column('CallbackStatus', String),
+    Column('CreatedAt', DateTime, nullable=False),
+    Column('FinishedAt', DateTime),
+    Index('ix_generation_jobs_status_run_at', 'Status', 'RunAt'),
+    Index('ix_generation_jobs_user_created', 'UserID', 'CreatedAt'),
+)
+
+def upgrade(op):
+    op.create_table(generation_jobs)
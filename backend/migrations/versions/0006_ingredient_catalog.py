@@ -0,0 +1,120 @@
+"""
+Ingredient catalog: integer ids for ingredient names.
+
+Adds CatalogID to ingredients, allergy and shopping_list_items, fills it
+from the existing names, and swaps the name indexes for catalog id ones.
+The allergy table loses its foreign key to the non-unique
+ingredients.IngredientName; SQLite cannot drop a constraint, so there the
+table is rebuilt.
+"""
+import re
+from sqlalchemy import MetaData, Table, Column, String, Integer, DateTime, ForeignKey, UniqueConstraint, inspect, text
+
+metadata = MetaData()
+
+# Referenced table, declared only so the foreign keys resolve
+Table('users', metadata, Column('UserID', String(36), primary_key=True))
+
+ingredient_catalog = Table(
+    'ingredient_catalog', metadata,
+    Column('CatalogID', Integer, primary_key=True, autoincrement=True),
+    Column('Name', String, nullable=False),
+    UniqueConstraint('Name', name='uq_ingredient_catalog_name'),
+)
+
+# The allergy table without the foreign key on IngredientName
+allergy_rebuilt = Table(
+    'allergy_rebuilt', metadata,
+    Column('AllergyID', String(36), primary_key=True),
+    Column('UserID', String(36), ForeignKey('users.UserID'), nullable=False),
+    Column('IngredientName', String, nullable=False),
+    Column('CatalogID', Integer, ForeignKey('ingredient_catalog.CatalogID')),
+    Column('CreatedAt', DateTime, nullable=False),
+)
+
+CATALOGUED_TABLES = ['ingredients', 'allergy', 'shopping_list_items']
+
+DROPPED_INDEXES = ['ix_ingredients_name', 'ix_allergy_user_ingredient', 'ix_shopping_list_user_ingredient']
+
+INDEXES = [
+    ('ix_ingredients_catalog', 'ingredients', ['CatalogID', 'RecipeID']),
+    ('ix_allergy_user_catalog', 'allergy', ['UserID', 'CatalogID']),
+    ('ix_allergy_user_created', 'allergy', ['UserID', 'CreatedAt', 'AllergyID']),
+    ('ix_allergy_created', 'allergy', ['CreatedAt', 'AllergyID']),
+    ('ix_shopping_list_user_catalog', 'shopping_list_items', ['UserID', 'CatalogID']),
+]
+
+# Names are normalized as catalog.normalize_ingredient did at this version;
+# later changes to the rule come with their own migration (e.g. 0011)
+SINGULAR_WORDS = {
+    'asparagus', 'bass', 'citrus', 'couscous', 'cress', 'grass', 'hummus', 'lemongrass', 'molasses',
+    'octopus', 'swiss', 'watercress', 'series', 'species', 'chips',
+}
+
+def singular(word):
+    if len(word) <= 3 or word in SINGULAR_WORDS or word.endswith(('ss', 'us', 'is')):
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith(('oes', 'ches', 'shes', 'xes', 'sses')):
+        return word[:-2]
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+def normalize_ingredient(name):
+    words = re.sub(r"[^\w\s'-]", ' ', name.lower()).split()
+    if not words:
+        return ''
+    words[-1] = singular(words[-1])
+    return ' '.join(words)
+
+def backfill(op):
+    names = set()
+    for table_name in CATALOGUED_TABLES:
+        names.update(op.execute(f'SELECT DISTINCT "IngredientName" FROM {table_name} WHERE "CatalogID" IS NULL').scalars())
+    normalized = {name: normalize_ingredient(name) for name in names}
+    catalog = sorted(set(normalized.values()) - {''})
+    known = set(op.execute('SELECT "Name" FROM ingredient_catalog').scalars())
+    missing = [{'name': name} for name in catalog if name not in known]
+    if missing:
+        op.execute('INSERT INTO ingredient_catalog ("Name") VALUES (:name)', missing)
+    ids = dict(op.execute('SELECT "Name", "CatalogID" FROM ingredient_catalog').all())
+    updates = [{'name': name, 'id': ids[key]} for name, key in normalized.items() if key]
+    for table_name in CATALOGUED_TABLES:
+        if updates:
+            op.execute(
+                f'UPDATE {table_name} SET "CatalogID" = :id WHERE "IngredientName" = :name AND "CatalogID" IS NULL',
+                updates
+            )
+
+def drop_allergy_name_foreign_key(op):
+    foreign_keys = [
+        foreign_key for foreign_key in inspect(op.conn).get_foreign_keys('allergy')
+        if foreign_key['referred_table'] == 'ingredients'
+    ]
+    if not foreign_keys:
+        return
+    if op.dialect.name != 'sqlite':
+        for foreign_key in foreign_keys:
+            op.execute(f'ALTER TABLE allergy DROP CONSTRAINT {op.quote(foreign_key["name"])}')
+        return
+    op.create_table(allergy_rebuilt)
+    op.execute(
+        'INSERT INTO allergy_rebuilt ("AllergyID", "UserID", "IngredientName", "CatalogID", "CreatedAt") '
+        'SELECT "AllergyID", "UserID", "IngredientName", "CatalogID", "CreatedAt" FROM allergy'
+    )
+    # The indexes go with the old table and are recreated below
+    op.execute('DROP TABLE allergy')
+    op.execute('ALTER TABLE allergy_rebuilt RENAME TO allergy')
+
+def upgrade(op):
+    op.create_table(ingredient_catalog)
+    for table_name in CATALOGUED_TABLES:
+        op.add_column(table_name, Column('CatalogID', Integer, ForeignKey('ingredient_catalog.CatalogID')))
+    backfill(op)
+    drop_allergy_name_foreign_key(op)
+    for index_name in DROPPED_INDEXES:
+        op.drop_index(index_name)
+    for index_name, table_name, columns in INDEXES:
+        op.create_index(index_name, table_name, columns)
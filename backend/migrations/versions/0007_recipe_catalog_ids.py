@@ -0,0 +1,33 @@
+"""
+Allergen index: the packed catalog ids of each recipe's ingredients.
+"""
+import sys
+from array import array
+from itertools import groupby
+from sqlalchemy import Column, LargeBinary, bindparam, text
+
+BATCH_SIZE = 1000
+
+def pack_ids(ids):
+    # Sorted unsigned 32-bit ids, little-endian, as allergens.pack_ids at this version
+    packed = array('I', sorted({i for i in ids if i is not None}))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def upgrade(op):
+    op.add_column('recipe', Column('CatalogIDs', LargeBinary))
+    rows = op.execute(
+        'SELECT recipe."RecipeID", ingredients."CatalogID" FROM recipe '
+        'LEFT JOIN ingredients ON ingredients."RecipeID" = recipe."RecipeID" '
+        'WHERE recipe."CatalogIDs" IS NULL ORDER BY recipe."RecipeID"'
+    ).all()
+    updates = [
+        {'recipe_id': recipe_id, 'catalog_ids': pack_ids(row[1] for row in group)}
+        for recipe_id, group in groupby(rows, key=lambda row: row[0])
+    ]
+    statement = text('UPDATE recipe SET "CatalogIDs" = :catalog_ids WHERE "RecipeID" = :recipe_id').bindparams(
+        bindparam('catalog_ids', type_=LargeBinary)
+    )
+    for start in range(0, len(updates), BATCH_SIZE):
+        op.execute(statement, updates[start:start + BATCH_SIZE])
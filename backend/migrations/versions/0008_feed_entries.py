@@ -0,0 +1,102 @@
+"""
+Feed read model: one denormalized row per post, filled from the posts,
+their recipes and comment counts.
+"""
+import json
+import sys
+from array import array
+from itertools import groupby
+from sqlalchemy import (
+    MetaData, Table, Column, String, Integer, Boolean, Text, DateTime, LargeBinary, ForeignKey, Index,
+    bindparam, text
+)
+
+BATCH_SIZE = 1000
+
+metadata = MetaData()
+
+# Referenced tables, declared only so the foreign keys resolve
+Table('social_media', metadata, Column('SMID', String(36), primary_key=True))
+Table('recipe', metadata, Column('RecipeID', String(36), primary_key=True))
+
+feed_entries = Table(
+    'feed_entries', metadata,
+    Column('SMID', String(36), ForeignKey('social_media.SMID'), primary_key=True),
+    Column('RecipeID', String(36), ForeignKey('recipe.RecipeID'), nullable=False),
+    Column('Payload', Text, nullable=False),
+    Column('Likes', Integer, nullable=False),
+    Column('Comments', Integer, nullable=False),
+    Column('CatalogIDs', LargeBinary),
+    Column('CreatedAt', DateTime, nullable=False),
+    Index('ix_feed_entries_created', 'CreatedAt', 'SMID'),
+    Index('ix_feed_entries_recipe', 'RecipeID'),
+)
+
+def pack_ids(ids):
+    # Sorted unsigned 32-bit ids, little-endian, as allergens.pack_ids at this version
+    packed = array('I', sorted({i for i in ids if i is not None}))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def serialize_recipe(row):
+    # The feed payload of a recipe, as feed.serialize_recipe at this version
+    return {
+        "RecipeID": row.RecipeID,
+        "RecipeName": row.RecipeName,
+        "RecipeContent": row.RecipeContent,
+        "Visibility": row.Visibility,
+        "UserGenerated": row.UserGenerated,
+        "Cuisine": row.Cuisine,
+        "UserID": row.UserID
+    }
+
+def recipe_catalog_ids(op, recipe_ids):
+    # Packed ids of recipes the allergen index backfill did not reach
+    if not recipe_ids:
+        return {}
+    rows = op.execute(
+        text('SELECT "RecipeID", "CatalogID" FROM ingredients WHERE "RecipeID" IN :ids ORDER BY "RecipeID"')
+        .bindparams(bindparam('ids', expanding=True)),
+        {'ids': recipe_ids}
+    ).all()
+    packed = {recipe_id: pack_ids([]) for recipe_id in recipe_ids}
+    packed.update((recipe_id, pack_ids(row[1] for row in group)) for recipe_id, group in groupby(rows, key=lambda row: row[0]))
+    return packed
+
+def insert_entries(op, rows):
+    missing = recipe_catalog_ids(op, sorted({row.RecipeID for row in rows if row.CatalogIDs is None}))
+    entries = [
+        {
+            'SMID': row.SMID,
+            'RecipeID': row.RecipeID,
+            'Payload': json.dumps(serialize_recipe(row)),
+            'Likes': row.Likes or 0,
+            'Comments': row.Comments,
+            'CatalogIDs': missing.get(row.RecipeID, row.CatalogIDs),
+            'CreatedAt': row.PostedAt,
+        }
+        for row in rows
+    ]
+    op.execute(feed_entries.insert(), entries)
+
+def upgrade(op):
+    op.create_table(feed_entries)
+    # Posts are read BATCH_SIZE at a time in SMID order, so memory stays
+    # bounded however many posts exist
+    select_posts = text(
+        'SELECT social_media."SMID", social_media."Likes", social_media."CreatedAt" AS "PostedAt", '
+        '(SELECT count(*) FROM comments WHERE comments."SMID" = social_media."SMID") AS "Comments", '
+        'recipe."RecipeID", recipe."RecipeName", recipe."RecipeContent", recipe."Visibility", '
+        'recipe."UserGenerated", recipe."Cuisine", recipe."UserID", recipe."CatalogIDs" '
+        'FROM social_media JOIN recipe ON recipe."RecipeID" = social_media."RecipeID" '
+        'WHERE social_media."SMID" > :after AND social_media."SMID" NOT IN (SELECT "SMID" FROM feed_entries) '
+        'ORDER BY social_media."SMID" LIMIT :limit'
+    ).columns(PostedAt=DateTime, Visibility=Boolean, UserGenerated=Boolean, CatalogIDs=LargeBinary)
+    after = ''
+    while True:
+        rows = op.execute(select_posts, {'after': after, 'limit': BATCH_SIZE}).all()
+        if not rows:
+            break
+        insert_entries(op, rows)
+        after = rows[-1].SMID
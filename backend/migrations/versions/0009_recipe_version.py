@@ -0,0 +1,7 @@
+"""
+Recipe version counter, keying the cache of serialized recipe payloads.
+"""
+from sqlalchemy import Column, Integer
+
+def upgrade(op):
+    op.add_column('recipe', Column('Version', Integer, nullable=False, server_default='1'))
@@ -0,0 +1,15 @@
+"""
+Version counters behind the ETags of cached read endpoints.
+"""
+from sqlalchemy import MetaData, Table, Column, String, Integer
+
+metadata = MetaData()
+
+resource_versions = Table(
+    'resource_versions', metadata,
+    Column('Key', String, primary_key=True),
+    Column('Version', Integer, nullable=False),
+)
+
+def upgrade(op):
+    op.create_table(resource_versions)
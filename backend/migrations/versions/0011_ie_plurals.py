@@ -0,0 +1,83 @@
+"""
+Ingredient catalog: plurals of -ie words and "chips".
+
+Catalog names used to singularize "cookies" to "cooky", "pies" to "py"
+and so on, and kept "chips" as it was, so they never matched "cookie",
+"pie" or "chip". Those entries are renamed, or merged into the correct
+entry when it already exists; recipes pointing at a merged entry get their
+packed catalog ids (and feed entries) rewritten.
+"""
+import sys
+from array import array
+from sqlalchemy import LargeBinary, bindparam, text
+
+# Last word of an old catalog name -> the correct singular
+RENAMED = {
+    'browny': 'brownie', 'calory': 'calorie', 'cooky': 'cookie', 'py': 'pie', 'potpy': 'potpie',
+    'smoothy': 'smoothie', 'veggy': 'veggie', 'chips': 'chip',
+}
+CATALOGUED_TABLES = ['ingredients', 'allergy', 'shopping_list_items']
+
+BATCH_SIZE = 1000
+
+def pack_ids(ids):
+    # Sorted unsigned 32-bit ids, little-endian, as allergens.pack_ids at this version
+    packed = array('I', sorted({i for i in ids if i is not None}))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def corrected(name: str):
+    words = name.split(' ')
+    if words[-1] not in RENAMED:
+        return None
+    return ' '.join(words[:-1] + [RENAMED[words[-1]]])
+
+def repack(op, recipe_ids):
+    statement = text('UPDATE recipe SET "CatalogIDs" = :catalog_ids WHERE "RecipeID" = :recipe_id').bindparams(
+        bindparam('catalog_ids', type_=LargeBinary)
+    )
+    feed_statement = text('UPDATE feed_entries SET "CatalogIDs" = :catalog_ids WHERE "RecipeID" = :recipe_id').bindparams(
+        bindparam('catalog_ids', type_=LargeBinary)
+    )
+    recipe_ids = sorted(recipe_ids)
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        chunk = recipe_ids[start:start + BATCH_SIZE]
+        packed = {recipe_id: [] for recipe_id in chunk}
+        rows = op.execute(
+            text('SELECT "RecipeID", "CatalogID" FROM ingredients WHERE "RecipeID" IN :recipe_ids').bindparams(
+                bindparam('recipe_ids', expanding=True)
+            ),
+            {'recipe_ids': chunk}
+        )
+        for recipe_id, catalog_id in rows:
+            packed[recipe_id].append(catalog_id)
+        updates = [{'recipe_id': recipe_id, 'catalog_ids': pack_ids(ids)} for recipe_id, ids in packed.items()]
+        op.execute(statement, updates)
+        op.execute(feed_statement, updates)
+
+def upgrade(op):
+    ids = dict(op.execute('SELECT "Name", "CatalogID" FROM ingredient_catalog').all())
+    merged = {}
+    for name, catalog_id in list(ids.items()):
+        new_name = corrected(name)
+        if new_name is None:
+            continue
+        if new_name in ids:
+            merged[catalog_id] = ids[new_name]
+        else:
+            op.execute('UPDATE ingredient_catalog SET "Name" = :new_name WHERE "CatalogID" = :id', {'new_name': new_name, 'id': catalog_id})
+            ids[new_name] = catalog_id
+    if not merged:
+        return
+    updates = [{'old': old, 'new': new} for old, new in merged.items()]
+    recipe_ids = set(op.execute(
+        text('SELECT DISTINCT "RecipeID" FROM ingredients WHERE "CatalogID" IN :old').bindparams(bindparam('old', expanding=True)),
+        {'old': list(merged)}
+    ).scalars())
+    for table_name in CATALOGUED_TABLES:
+        op.execute(f'UPDATE {table_name} SET "CatalogID" = :new WHERE "CatalogID" = :old', updates)
+    op.execute('DELETE FROM ingredient_catalog WHERE "CatalogID" = :old', updates)
+    repack(op, recipe_ids)
+    # Cached /posts pages may have been filtered with the old ids
+    op.execute('UPDATE resource_versions SET "Version" = "Version" + 1 WHERE "Key" = \'feed\'')
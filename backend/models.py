@@ -1,7 +1,8 @@
 from sqlalchemy import (
-    create_engine, Column, String, Boolean, Integer, ForeignKey, Text, UniqueConstraint
+    create_engine, Column, String, Boolean, Integer, ForeignKey, Text, UniqueConstraint, DateTime, Index, LargeBinary
 )
 from sqlalchemy.orm import declarative_base, relationship
+from datetime import datetime
 import uuid
 
 Base = declarative_base()
@@ -24,8 +25,15 @@ class User(Base):
     bookmarks = relationship('Bookmark', back_populates='user')
     shopping_list_items = relationship('ShoppingListItem', back_populates='user', cascade='all, delete-orphan')
     social_media = relationship('SocialMedia', back_populates='user')
+    post_likes = relationship('PostLike', back_populates='user')
+    generation_jobs = relationship('GenerationJob', back_populates='user')
 class Recipe(Base):
     __tablename__ = 'recipe'
+    __table_args__ = (
+        Index('ix_recipe_user_created', 'UserID', 'CreatedAt', 'RecipeID'),
+        Index('ix_recipe_created', 'CreatedAt', 'RecipeID'),
+        Index('ix_recipe_visibility_cuisine', 'Visibility', 'Cuisine'),
+    )
 
     RecipeID = Column(String(36), primary_key=True, default=generate_uuid)
     UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
@@ -34,68 +42,173 @@ class Recipe(Base):
     Cuisine = Column(String, nullable=False)
     Visibility = Column(Boolean, default=False)  # False for private, True for public
     UserGenerated = Column(Boolean, default=False) # False if generated by LLM, True if generated by the user
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
+    CatalogIDs = Column(LargeBinary)  # catalog ids of the ingredients, packed by allergens.pack_ids
+    Version = Column(Integer, nullable=False, default=1, server_default='1')  # bumped when a serialized field changes
 
     user = relationship('User', back_populates='recipes')
     ingredients = relationship('Ingredient', back_populates='recipe')
     social_media = relationship('SocialMedia', back_populates='recipe')
     bookmarks = relationship('Bookmark', back_populates='recipe')
 
+class IngredientCatalog(Base):
+    # One row per distinct ingredient, referenced by integer id
+    __tablename__ = 'ingredient_catalog'
+    __table_args__ = (UniqueConstraint('Name', name='uq_ingredient_catalog_name'),)
+
+    CatalogID = Column(Integer, primary_key=True, autoincrement=True)
+    Name = Column(String, nullable=False)  # normalized: lower case, single spaces, singular
+
 class Ingredient(Base):
     __tablename__ = 'ingredients'
-    __table_args__ = (UniqueConstraint( 'RecipeID','IngredientName', name='uq_recipe_ingredient'),)
+    # The unique constraint's index also serves lookups by RecipeID
+    __table_args__ = (
+        UniqueConstraint( 'RecipeID','IngredientName', name='uq_recipe_ingredient'),
+        Index('ix_ingredients_catalog', 'CatalogID', 'RecipeID'),
+    )
 
     IngredientID = Column(String(36), primary_key=True, default=generate_uuid)
     RecipeID = Column(String(36), ForeignKey('recipe.RecipeID'), nullable=False)
-    IngredientName = Column(String, nullable=False)
+    IngredientName = Column(String, nullable=False)  # as written, for display
+    CatalogID = Column(Integer, ForeignKey('ingredient_catalog.CatalogID'))  # set from IngredientName on flush
 
     recipe = relationship('Recipe', back_populates='ingredients')
 
 class Allergy(Base):
     __tablename__ = 'allergy'
+    __table_args__ = (
+        Index('ix_allergy_user_catalog', 'UserID', 'CatalogID'),
+        Index('ix_allergy_user_created', 'UserID', 'CreatedAt', 'AllergyID'),
+        Index('ix_allergy_created', 'CreatedAt', 'AllergyID'),
+    )
 
     AllergyID = Column(String(36), primary_key=True, default=generate_uuid)
     UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
-    IngredientName = Column(String, ForeignKey('ingredients.IngredientName'), nullable=False)
+    IngredientName = Column(String, nullable=False)
+    CatalogID = Column(Integer, ForeignKey('ingredient_catalog.CatalogID'))
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     user = relationship('User', back_populates='allergies')
 
 class SocialMedia(Base):
     __tablename__ = 'social_media'
+    __table_args__ = (
+        Index('ix_social_media_recipe', 'RecipeID'),
+        Index('ix_social_media_created', 'CreatedAt', 'SMID'),
+    )
 
     SMID = Column(String(36), primary_key=True, default=generate_uuid)
     RecipeID = Column(String(36), ForeignKey('recipe.RecipeID'), nullable=False)
     Likes = Column(Integer, default=0)
     UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     recipe = relationship('Recipe', back_populates='social_media')
     comments = relationship('Comment', back_populates='social')
     user = relationship('User', back_populates='social_media')
+    post_likes = relationship('PostLike', back_populates='social')
+
+class FeedEntry(Base):
+    # Read model of the /posts feed, one row per post, kept up to date by
+    # the writes to its source tables (see feed.py)
+    __tablename__ = 'feed_entries'
+    __table_args__ = (
+        Index('ix_feed_entries_created', 'CreatedAt', 'SMID'),
+        Index('ix_feed_entries_recipe', 'RecipeID'),
+    )
+
+    SMID = Column(String(36), ForeignKey('social_media.SMID'), primary_key=True)
+    RecipeID = Column(String(36), ForeignKey('recipe.RecipeID'), nullable=False)
+    Payload = Column(Text, nullable=False)  # serialize_recipe output as JSON
+    Likes = Column(Integer, nullable=False, default=0)
+    Comments = Column(Integer, nullable=False, default=0)
+    CatalogIDs = Column(LargeBinary)  # the recipe's packed catalog ids
+    CreatedAt = Column(DateTime, nullable=False)  # when the post was created
+
+class PostLike(Base):
+    __tablename__ = 'post_likes'
+    __table_args__ = (
+        UniqueConstraint('UserID', 'SMID', name='uq_post_like'),
+        Index('ix_post_likes_smid', 'SMID'),
+    )
+
+    LikeID = Column(String(36), primary_key=True, default=generate_uuid)
+    UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
+    SMID = Column(String(36), ForeignKey('social_media.SMID'), nullable=False)
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    user = relationship('User', back_populates='post_likes')
+    social = relationship('SocialMedia', back_populates='post_likes')
 
 class Comment(Base):
     __tablename__ = 'comments'
+    __table_args__ = (Index('ix_comments_smid_created', 'SMID', 'CreatedAt', 'CommentID'),)
 
     CommentID = Column(String(36), primary_key=True, default=generate_uuid)
     SMID = Column(String(36), ForeignKey('social_media.SMID'), nullable=False)
     UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
     CommentText = Column(Text, nullable=False)
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     user = relationship('User', back_populates='comments')
     social = relationship('SocialMedia', back_populates='comments')
 
 class Bookmark(Base):
     __tablename__ = 'bookmark'
+    # A unique index rather than a constraint so it can be added to existing tables
+    __table_args__ = (
+        Index('uq_bookmark_user_recipe', 'UserID', 'RecipeID', unique=True),
+        Index('ix_bookmark_user_created', 'UserID', 'CreatedAt', 'BookmarkID'),
+        Index('ix_bookmark_recipe', 'RecipeID'),
+    )
 
     BookmarkID = Column(String(36), primary_key=True, default=generate_uuid)
     UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
     RecipeID = Column(String(36), ForeignKey('recipe.RecipeID'), nullable=False)
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     user = relationship('User', back_populates='bookmarks')
     recipe = relationship('Recipe', back_populates='bookmarks')
 
 class ShoppingListItem(Base):
     __tablename__ = 'shopping_list_items'
+    __table_args__ = (Index('ix_shopping_list_user_catalog', 'UserID', 'CatalogID'),)
 
     ItemID = Column(String(36), primary_key=True, default=generate_uuid)
     UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
     IngredientName = Column(String, nullable=False)
-    user = relationship('User', back_populates='shopping_list_items')
\ No newline at end of file
+    CatalogID = Column(Integer, ForeignKey('ingredient_catalog.CatalogID'))
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
+    user = relationship('User', back_populates='shopping_list_items')
+
+class GenerationJob(Base):
+    __tablename__ = 'generation_jobs'
+    __table_args__ = (
+        Index('ix_generation_jobs_status_run_at', 'Status', 'RunAt'),
+        Index('ix_generation_jobs_user_created', 'UserID', 'CreatedAt'),
+    )
+
+    JobID = Column(String(36), primary_key=True, default=generate_uuid)
+    UserID = Column(String(36), ForeignKey('users.UserID'), nullable=False)
+    Status = Column(String, nullable=False, default='queued')  # queued, running, succeeded or dead
+    Request = Column(Text, nullable=False)  # GenerateRecipeRequest as JSON
+    Result = Column(Text)  # recipe as JSON once succeeded
+    Error = Column(Text)
+    Attempts = Column(Integer, nullable=False, default=0)
+    MaxAttempts = Column(Integer, nullable=False)
+    RunAt = Column(DateTime, nullable=False, default=datetime.utcnow)  # earliest next attempt
+    LockedUntil = Column(DateTime)  # lease of the worker running it
+    CallbackURL = Column(String)
+    CallbackStatus = Column(String)  # delivered, failed or rejected
+    CreatedAt = Column(DateTime, nullable=False, default=datetime.utcnow)
+    FinishedAt = Column(DateTime)
+
+    user = relationship('User', back_populates='generation_jobs')
+
+class ResourceVersion(Base):
+    # Version counters of cached read endpoints, bumped by the writes that
+    # change them (see etags.py)
+    __tablename__ = 'resource_versions'
+
+    Key = Column(String, primary_key=True)  # e.g. 'feed' or 'bookmarks:<UserID>'
+    Version = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,72 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Response header carrying the cursor for endpoints whose body is a plain list
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams(BaseModel):
+    cursor: Optional[str] = None
+    limit: int = DEFAULT_PAGE_SIZE
+
+def page_params(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    """
+    Dependency reading the `cursor` and `limit` query parameters.
+    """
+    return PageParams(cursor=cursor, limit=limit)
+
+def encode_cursor(created_at: datetime, key: str):
+    # Opaque, URL-safe cursor holding the sort key of the last row on a page
+    raw = json.dumps([created_at.isoformat(), key]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, key = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(key)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def paginate(query, created_column, key_column, page: PageParams, descending=True, row_key=None):
+    """
+    Apply keyset pagination to a query ordered by (created_column, key_column).
+
+    Returns the rows of the requested page and the cursor for the next page,
+    or None when there are no more rows. `row_key` extracts the
+    (created, key) pair from a result row; by default the row is expected to
+    be an entity holding both columns.
+    """
+    if row_key is None:
+        row_key = lambda row: (getattr(row, created_column.key), getattr(row, key_column.key))
+
+    if page.cursor:
+        created_at, key = decode_cursor(page.cursor)
+        if descending:
+            after = or_(created_column < created_at, and_(created_column == created_at, key_column < key))
+        else:
+            after = or_(created_column > created_at, and_(created_column == created_at, key_column > key))
+        query = query.filter(after)
+
+    if descending:
+        query = query.order_by(created_column.desc(), key_column.desc())
+    else:
+        query = query.order_by(created_column.asc(), key_column.asc())
+
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(page.limit + 1).all()
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    return rows, encode_cursor(*row_key(rows[-1]))
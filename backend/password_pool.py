@@ -0,0 +1,74 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+# bcrypt releases the GIL, so a small thread pool runs hashes in parallel
+# without tying up the request threadpool shared by every other endpoint.
+# One core is left free by default so the event loop keeps serving requests.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# Requests waiting beyond this many queued hashes are rejected with a 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "1000"))
+
+
+class PasswordPool:
+    """
+    Bounded worker pool for password hashing and verification, with
+    queueing metrics.
+    """
+
+    def __init__(self, max_workers: int, queue_limit: int):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _run(self, enqueued_at, fn, args):
+        waited = time.perf_counter() - enqueued_at
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._queued >= self.queue_limit:
+                self._rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server busy, try again later",
+                    headers={"Retry-After": "1"},
+                )
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, time.perf_counter(), fn, args)
+
+    def stats(self):
+        with self._lock:
+            started = self._completed + self._active
+            return {
+                "workers": self.max_workers,
+                "queued": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._wait_total / started * 1000, 3) if started else 0.0,
+                "max_wait_ms": round(self._wait_max * 1000, 3),
+            }
+
+password_pool = PasswordPool(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
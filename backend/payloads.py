@@ -0,0 +1,73 @@
+import json
+import os
+from json.encoder import encode_basestring_ascii
+from functools import lru_cache
+from typing import Iterable
+from cache import TTLCache
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is used instead
+    orjson = None
+
+# Responses listing many recipes are assembled from pre-serialized JSON
+# fragments instead of dicts passed to json.dumps: a recipe's fragment is
+# cached under (RecipeID, Version), and update_recipe bumps Recipe.Version
+# so an edited recipe is never served from a stale fragment.
+PAYLOAD_CACHE_SIZE = int(os.getenv('PAYLOAD_CACHE_SIZE', '20000'))
+PAYLOAD_CACHE_TTL_SECONDS = float(os.getenv('PAYLOAD_CACHE_TTL_SECONDS', '3600'))
+
+recipe_fragments = TTLCache(maxsize=PAYLOAD_CACHE_SIZE, ttl=PAYLOAD_CACHE_TTL_SECONDS)
+
+# Reused, json.dumps builds a new encoder whenever options are passed
+compact_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return compact_encoder.encode(value).encode()
+
+def encode(value) -> bytes:
+    # bytes are taken to be JSON already and spliced in as they are
+    return value if isinstance(value, bytes) else dumps(value)
+
+@lru_cache(maxsize=256)
+def encode_key(key: str) -> bytes:
+    return dumps(key) + b':'
+
+def encode_member(key: str, value) -> bytes:
+    if isinstance(value, bytes):
+        return encode_key(key) + value
+    if isinstance(value, str):
+        # Skips the per-call encoder setup of dumps for the common case
+        return encode_key(key) + encode_basestring_ascii(value).encode()
+    if type(value) is int:
+        return encode_key(key) + str(value).encode()
+    return encode_key(key) + dumps(value)
+
+def json_object(fields: dict) -> bytes:
+    """
+    Encode a flat dict whose values may be pre-serialized fragments.
+    """
+    if orjson is not None:
+        plain, raw = {}, []
+        for key, value in fields.items():
+            if isinstance(value, bytes):
+                raw.append(encode_key(key) + value)
+            else:
+                plain[key] = value
+        if not raw:
+            return orjson.dumps(plain)
+        return (orjson.dumps(plain)[:-1] + b',' if plain else b'{') + b','.join(raw) + b'}'
+    return b'{' + b','.join(encode_member(key, value) for key, value in fields.items()) + b'}'
+
+def json_array(items: Iterable) -> bytes:
+    return b'[' + b','.join(encode(item) for item in items) + b']'
+
+def cached_fragment(cache: TTLCache, key, build) -> bytes:
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = dumps(build())
+        cache.set(key, fragment)
+    return fragment
@@ -0,0 +1,70 @@
+from dataclasses import dataclass
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from cache import TTLCache
+from database import get_db
+from models import User
+
+# Who is making a request: bearer tokens resolve to a UserPrincipal. Kept
+# outside the routers so modules below them (rate limits, jobs) can depend
+# on the current user without importing a router.
+
+# JWT configuration
+SECRET_KEY = "your_secret_key"  # Replace with a secure secret key
+ALGORITHM = "HS256"
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+# Validated tokens are cached so authenticated requests skip the user lookup.
+# Entries never outlive the token's own expiry.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL_SECONDS = 300
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    # Lightweight view of the authenticated user, safe to share across requests
+    UserID: str
+    Role: bool
+    Name: str
+    Email: str
+
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+def invalidate_user(user_id):
+    # Drop every cached token of a user, e.g. after a role change or delete
+    token_cache.discard_where(lambda principal: principal.UserID == user_id)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.UserID)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+
+    # Exception to be raised if credentials are invalid
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        # Decode the JWT token to retrieve the user ID
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id: str = payload.get("sub")
+        if user_id is None:
+            raise credentials_exception
+
+    except JWTError:
+        raise credentials_exception
+    # Fetch the user from the database using the user ID
+    user = db.query(User).filter_by(UserID=user_id).first()
+    if user is None:
+        raise credentials_exception
+    principal = UserPrincipal(UserID=user.UserID, Role=user.Role, Name=user.Name, Email=user.Email)
+    token_cache.set(token, principal, expires_at=payload.get("exp"))
+    return principal
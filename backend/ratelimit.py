@@ -0,0 +1,275 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Boolean, Column, Float, MetaData, String, Table, case, create_engine, delete, func
+from sqlalchemy.dialects.sqlite import insert
+from database import apply_sqlite_pragmas
+from llm import SYSTEM_PROMPT, GenerateRecipeRequest, build_prompt
+from principal import UserPrincipal, get_current_user
+
+logger = logging.getLogger(__name__)
+
+# Token-bucket rate limits on the LLM routes. Limits are written as
+# "<count>/<second|minute|hour|day>"; a bucket holds up to <count> tokens
+# and refills evenly over the period, so short bursts are allowed while the
+# long-run rate is capped. "0" turns a limit off.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') != '0'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')  # memory or sqlite
+# The SQLite backend keeps its own file so every worker process shares the buckets
+RATE_LIMIT_PATH = os.getenv('RATE_LIMIT_PATH', 'rate_limits.db')
+GENERATION_USER_LIMIT = os.getenv('GENERATION_USER_LIMIT', '20/minute')
+GENERATION_GLOBAL_LIMIT = os.getenv('GENERATION_GLOBAL_LIMIT', '600/minute')
+# LLM tokens (prompt and completion) each user may spend per period
+LLM_TOKEN_BUDGET = os.getenv('LLM_TOKEN_BUDGET', '200000/day')
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+# A bucket left alone for longer than the longest period is full again, so
+# its state can be dropped
+BUCKET_IDLE_SECONDS = max(PERIODS.values())
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    name: str
+    limit: float
+    period: float
+    per_user: bool = True
+
+    @property
+    def rate(self):
+        # Tokens added back per second
+        return self.limit / self.period
+
+    def key(self, user_id: str):
+        return f'{self.name}:{user_id}' if self.per_user else f'{self.name}:*'
+
+def parse_policy(name: str, value: str, per_user: bool = True):
+    """
+    Build a policy from a "<count>/<period>" setting, or None if disabled.
+    """
+    if value.strip() in ('', '0'):
+        return None
+    count, _, period = value.partition('/')
+    if period.strip() not in PERIODS:
+        raise ValueError(f"Invalid rate limit '{value}', use '<count>/<second|minute|hour|day>'")
+    return RateLimitPolicy(name, float(count), PERIODS[period.strip()], per_user)
+
+def estimate_tokens(request: GenerateRecipeRequest, completion: str):
+    # Roughly four characters per token for English text
+    return math.ceil((len(SYSTEM_PROMPT) + len(build_prompt(request)) + len(completion)) / 4)
+
+
+class MemoryBucketStore:
+    """
+    Per-process buckets. The least recently used ones are dropped beyond
+    `maxsize`, which at worst hands an idle user a full bucket.
+    """
+    blocking = False
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, required: float):
+        """
+        Refill the bucket, then take `cost` tokens if at least `required`
+        are left. Returns whether they were taken and the tokens left.
+        """
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+            allowed = tokens >= required
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteBucketStore:
+    """
+    Buckets in a SQLite table shared by every worker process. Each take is
+    a single upsert, so concurrent workers cannot both spend the same
+    tokens.
+    """
+    blocking = True
+
+    def __init__(self, path: str, purge_every: int = 1000):
+        self.purge_every = purge_every
+        self.engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+        apply_sqlite_pragmas(self.engine)
+        self.table = Table(
+            'rate_limit_buckets', MetaData(),
+            Column('Key', String, primary_key=True),
+            Column('Tokens', Float, nullable=False),
+            Column('UpdatedAt', Float, nullable=False, index=True),
+            Column('Allowed', Boolean, nullable=False),
+        )
+        self._ready = False
+        self._takes = 0
+
+    def _ensure_table(self):
+        # Created on first use so importing the app runs no DDL
+        if not self._ready:
+            self.table.create(self.engine, checkfirst=True)
+            self._ready = True
+
+    def take(self, key: str, capacity: float, rate: float, cost: float, required: float):
+        self._ensure_table()
+        now = time.time()
+        columns = self.table.c
+        # SET expressions all see the row as it was before the update
+        tokens = func.min(capacity, columns.Tokens + func.max(0.0, now - columns.UpdatedAt) * rate)
+        allowed = capacity >= required
+        statement = insert(self.table).values(
+            Key=key, Tokens=capacity - cost if allowed else capacity, UpdatedAt=now, Allowed=allowed
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[columns.Key],
+            set_={
+                'Tokens': case((tokens >= required, tokens - cost), else_=tokens),
+                'UpdatedAt': now,
+                'Allowed': tokens >= required,
+            },
+        ).returning(columns.Allowed, columns.Tokens)
+        with self.engine.begin() as conn:
+            allowed, tokens = conn.execute(statement).one()
+            self._takes += 1
+            if self._takes % self.purge_every == 0:
+                conn.execute(delete(self.table).where(columns.UpdatedAt < now - BUCKET_IDLE_SECONDS))
+        return bool(allowed), tokens
+
+    def clear(self):
+        self._ensure_table()
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table))
+
+
+class RateLimiter:
+    """
+    Applies rate limit policies to a bucket store and keeps counters of
+    allowed and rejected requests.
+    """
+
+    def __init__(self, store, enabled: bool = True):
+        self.store = store
+        self.enabled = enabled
+        self.allowed = 0
+        self.limited = 0
+
+    async def _take(self, *args):
+        if self.store.blocking:
+            return await run_in_threadpool(self.store.take, *args)
+        return self.store.take(*args)
+
+    async def hit(self, policy: RateLimitPolicy, user_id: str, cost: float = 1):
+        """
+        Spend `cost` tokens of the policy's bucket, or raise a 429 telling
+        the client when enough will have refilled.
+        """
+        if not self.enabled or policy is None:
+            return
+        allowed, tokens = await self._take(policy.key(user_id), policy.limit, policy.rate, cost, cost)
+        if not allowed:
+            self.limited += 1
+            raise rate_limit_exceeded(policy, (cost - tokens) / policy.rate)
+        self.allowed += 1
+
+    async def require(self, policy: RateLimitPolicy, user_id: str):
+        # Reject when the bucket is spent without taking anything from it
+        if not self.enabled or policy is None:
+            return
+        allowed, tokens = await self._take(policy.key(user_id), policy.limit, policy.rate, 0, 1)
+        if not allowed:
+            self.limited += 1
+            raise rate_limit_exceeded(policy, (1 - tokens) / policy.rate)
+
+    async def charge(self, policy: RateLimitPolicy, user_id: str, cost: float):
+        # Spend tokens whatever is left; the bucket may go into debt
+        if not self.enabled or policy is None:
+            return
+        try:
+            await self._take(policy.key(user_id), policy.limit, policy.rate, cost, 0)
+        except Exception:
+            # Accounting must not fail a request that already succeeded
+            logger.exception("Rate limit charge failed")
+
+    async def remaining(self, policy: RateLimitPolicy, user_id: str):
+        _, tokens = await self._take(policy.key(user_id), policy.limit, policy.rate, 0, 0)
+        return tokens
+
+    def stats(self):
+        return {"enabled": self.enabled, "allowed": self.allowed, "limited": self.limited}
+
+def rate_limit_exceeded(policy: RateLimitPolicy, retry_after: float):
+    return HTTPException(
+        status_code=429,
+        detail=f"Rate limit exceeded ({policy.name}), try again later.",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+def make_bucket_store(backend: str = RATE_LIMIT_BACKEND):
+    if backend == 'memory':
+        return MemoryBucketStore()
+    if backend == 'sqlite':
+        return SQLiteBucketStore(RATE_LIMIT_PATH)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{backend}', use 'memory' or 'sqlite'")
+
+rate_limiter = RateLimiter(make_bucket_store(), enabled=RATE_LIMIT_ENABLED)
+
+generation_user_policy = parse_policy('generation', GENERATION_USER_LIMIT)
+generation_global_policy = parse_policy('generation-global', GENERATION_GLOBAL_LIMIT, per_user=False)
+llm_token_policy = parse_policy('llm-tokens', LLM_TOKEN_BUDGET)
+
+
+class RateLimit:
+    """
+    Route dependency spending one token of each policy for the current
+    user. A route lists the policies it is subject to, e.g.
+    `dependencies=[Depends(RateLimit(policy))]`.
+    """
+
+    def __init__(self, *policies: RateLimitPolicy):
+        self.policies = policies
+
+    async def __call__(self, current_user: UserPrincipal = Depends(get_current_user)):
+        for policy in self.policies:
+            await rate_limiter.hit(policy, current_user.UserID)
+        return current_user
+
+async def require_llm_budget(current_user: UserPrincipal = Depends(get_current_user)):
+    """
+    Dependency rejecting users who spent their LLM token budget. Tokens are
+    charged after each generation with `charge_llm_tokens`, since the cost
+    is only known then.
+    """
+    await rate_limiter.require(llm_token_policy, current_user.UserID)
+    return current_user
+
+async def charge_llm_tokens(user_id: str, request: GenerateRecipeRequest, completion):
+    if not isinstance(completion, str):
+        completion = json.dumps(completion)
+    await rate_limiter.charge(llm_token_policy, user_id, estimate_tokens(request, completion))
+
+async def metered(user_id: str, request: GenerateRecipeRequest, generation):
+    # Await a generation and charge its tokens to the user
+    recipe = await generation
+    await charge_llm_tokens(user_id, request, recipe)
+    return recipe
+
+generation_rate_limit = RateLimit(generation_user_policy, generation_global_policy)
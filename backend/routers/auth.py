@@ -1,11 +1,14 @@
 from fastapi import APIRouter, Request, Response, Depends, HTTPException, status, Form
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from database import get_db
 from models import User
+from password_pool import password_pool
+# Token resolution lives in principal.py; re-exported for the routers
+from principal import SECRET_KEY, ALGORITHM, UserPrincipal, token_cache, invalidate_user, get_current_user
 import json
 import uuid
 
@@ -16,11 +19,8 @@ router = APIRouter()
 # Set up password hashing context using bcrypt
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# JWT configuration
-SECRET_KEY = "your_secret_key"  # Replace with a secure secret key
-ALGORITHM = "HS256"
+# Lifetime of the access tokens issued at login
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
 def generate_uuid():
     # Generate a unique identifier for a new user
@@ -33,6 +33,13 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    # Run bcrypt on the bounded password pool instead of the request threadpool
+    return await password_pool.run(pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await password_pool.run(pwd_context.hash, password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     # Create a JWT access token with an expiration time
 
@@ -46,19 +53,37 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# The async signup and login routes await the password pool; their sync
+# database work runs in the threadpool so it never blocks the event loop.
+# Each helper closes the session so no connection is held while hashing.
+def find_user_by_email(db: Session, email: str):
+    try:
+        return db.query(User).filter_by(Email=email).first()
+    finally:
+        db.close()
+
+def add_user(db: Session, user: User):
+    try:
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user
+    finally:
+        db.close()
+
 @router.post('/signup')
-def signup(
+async def signup(
     email: str = Form(...),
     password: str = Form(...),
     name: str = Form(...),
     db: Session = Depends(get_db)
 ):
     # Check if the email is already registered
-    user = db.query(User).filter_by(Email=email).first()
+    user = await run_in_threadpool(find_user_by_email, db, email)
     if user:
         raise HTTPException(status_code=400, detail="Email already registered")
     # Hash the password
-    hashed_password = get_password_hash(password)
+    hashed_password = await get_password_hash_async(password)
     # Create a new user instance
     new_user = User(
         UserID = generate_uuid(),
@@ -68,9 +93,8 @@ def signup(
         Role=True  # Default role is user; change as needed
     )
     # Add the user to the database
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await run_in_threadpool(add_user, db, new_user)
+    invalidate_user(new_user.UserID)
     # Create an access token for the new user
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -84,11 +108,11 @@ def signup(
     }
 
 @router.post('/login')
-def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+async def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
     # Retrieve the user from the database based on the email
-    user = db.query(User).filter_by(Email=email).first()
+    user = await run_in_threadpool(find_user_by_email, db, email)
     # Verify the password and check if the user exists
-    if user and verify_password(password, user.Password):
+    if user and await verify_password_async(password, user.Password):
         # Create an access token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
@@ -108,34 +132,24 @@ def login(email: str = Form(...), password: str = Form(...), db: Session = Depen
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    # Exception to be raised if credentials are invalid
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        # Decode the JWT token to retrieve the user ID
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-
-    except JWTError:
-        raise credentials_exception
-    # Fetch the user from the database using the user ID
-    user = db.query(User).filter_by(UserID=user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
-
 @router.get('/auth/verify')
-def verify_token(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    user = get_current_user(token, db)
-    
+def verify_token(user: UserPrincipal = Depends(get_current_user)):
     return {
         "user_id": user.UserID,
         "role": user.Role,
         "email": user.Email,
     }
+
+@router.get('/auth/cache_stats')
+def token_cache_stats(user: UserPrincipal = Depends(get_current_user)):
+    # Token cache hit/miss counters, admins only
+    if user.Role:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return token_cache.stats()
+
+@router.get('/auth/password_pool_stats')
+def password_pool_stats(user: UserPrincipal = Depends(get_current_user)):
+    # Password hashing queue metrics, admins only
+    if user.Role:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return password_pool.stats()
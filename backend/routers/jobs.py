@@ -0,0 +1,88 @@
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import AnyHttpUrl
+from sqlalchemy.orm import Session
+from database import get_db
+from models import User, GenerationJob
+from routers.auth import get_current_user
+from llm import GenerateRecipeRequest
+from ratelimit import generation_rate_limit, require_llm_budget
+from jobs import JOB_MAX_ATTEMPTS, QUEUED, DEAD, check_callback_url, get_job_pool, serialize_job
+
+router = APIRouter()
+
+class GenerateRecipeJobRequest(GenerateRecipeRequest):
+    # Sent a POST with the job outcome once it succeeds or is dead-lettered
+    callback_url: Optional[AnyHttpUrl] = None
+
+@router.post('/generate-recipe/jobs', dependencies=[Depends(generation_rate_limit), Depends(require_llm_budget)])
+def create_generation_job(
+    request: GenerateRecipeJobRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    pool = Depends(get_job_pool)
+):
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="Prompt is required.")
+    if request.callback_url:
+        try:
+            check_callback_url(str(request.callback_url))
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+
+    job = GenerationJob(
+        UserID=current_user.UserID,
+        Request=GenerateRecipeRequest(**request.model_dump(exclude={"callback_url"})).model_dump_json(),
+        MaxAttempts=JOB_MAX_ATTEMPTS,
+        CallbackURL=str(request.callback_url) if request.callback_url else None,
+    )
+    db.add(job)
+    db.commit()
+    pool.notify()
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job.JobID, "status": job.Status, "status_url": f"/jobs/{job.JobID}"},
+        headers={"Location": f"/jobs/{job.JobID}"},
+    )
+
+@router.get('/jobs/metrics')
+async def job_metrics(current_user: User = Depends(get_current_user), pool = Depends(get_job_pool)):
+    # Queue depth and worker counters, admins only
+    if current_user.Role:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return await pool.stats()
+
+def get_job(db: Session, job_id: str, current_user: User):
+    job = db.query(GenerationJob).filter_by(JobID=job_id).first()
+    # Other users' jobs are reported as missing rather than forbidden
+    if not job or (current_user.Role and job.UserID != current_user.UserID):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get('/jobs/{job_id}')
+def read_job(job_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return serialize_job(get_job(db, job_id, current_user))
+
+@router.post('/jobs/{job_id}/retry')
+def retry_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    pool = Depends(get_job_pool)
+):
+    # Requeue a dead-lettered job with a fresh set of attempts, admins only
+    if current_user.Role:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    job = get_job(db, job_id, current_user)
+    if job.Status != DEAD:
+        raise HTTPException(status_code=409, detail="Only dead jobs can be retried")
+    job.Status = QUEUED
+    job.Attempts = 0
+    job.RunAt = datetime.utcnow()
+    job.FinishedAt = None
+    job.CallbackStatus = None
+    db.commit()
+    pool.notify()
+    return serialize_job(job)
@@ -1,28 +1,34 @@
+import asyncio
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from fastapi.responses import JSONResponse
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
 from database import get_db
-from models import User, Recipe, Ingredient, Allergy
-import openai
+from models import User, Recipe, Ingredient, Allergy, generate_uuid
+from catalog import catalog_ids, catalog_id
+from allergens import pack_ids, check_recipes
+from feed import refresh_feed_entries, delete_feed_entries
+from etags import version_key, bump_versions
 import json
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from routers.auth import get_current_user  # Import the dependency
+from pagination import PageParams, page_params, paginate, NEXT_CURSOR_HEADER
+from streaming import wants_ndjson, ndjson_response, sse_event, sse_response
+from llm import RecipeBase, RecipeLLM, GenerateRecipeRequest, get_llm_client, validate_recipe
+from generation import generation_cache, generation_key, batch_limiter, BATCH_MAX_ITEMS
+from ratelimit import (
+    rate_limiter, generation_rate_limit, generation_user_policy, generation_global_policy, llm_token_policy,
+    require_llm_budget, charge_llm_tokens, metered
+)
 
 router = APIRouter()
 
-# Set your OpenAI API key
-openai.api_key = 'API_KEY'
+# Recipes per /recipes/import request, all written in one transaction
+RECIPE_IMPORT_MAX_ITEMS = 5000
+# Recipes per bulk /check_allergens request
+ALLERGEN_CHECK_MAX_ITEMS = 10000
 
-class RecipeBase(BaseModel):
-    title: str
-    content: str
-
-class RecipeLLM(RecipeBase):
-    ingredients: List[str]
-    userGenerated: bool
-    cuisine: str
-    
 class RecipeOutput(BaseModel):
     RecipeID: str
     UserID: str
@@ -34,79 +40,239 @@ class RecipeOutput(BaseModel):
     class Config:
         orm_mode = True
 
-from pydantic import BaseModel
-from typing import List
+def serialize_recipe_output(recipe):
+    return {field: getattr(recipe, field) for field in RecipeOutput.model_fields}
 
-class GenerateRecipeRequest(BaseModel):
-    question: str
-    ingredients: List[str]
-    dietary_restrictions: List[str]
+def serialize_allergy(allergy):
+    return {
+        "AllergyID": allergy.AllergyID,
+        "UserID": allergy.UserID,
+        "IngredientName": allergy.IngredientName,
+        "CreatedAt": allergy.CreatedAt.isoformat(),
+    }
 
-@router.post('/generate-recipe')
+@router.post('/generate-recipe', dependencies=[Depends(generation_rate_limit), Depends(require_llm_budget)])
 async def generate_recipe(
     request: GenerateRecipeRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    llm = Depends(get_llm_client)
 ):
-    prompt = f"Create a recipe using the following ingredients: {request.ingredients}. Dietary restrictions: {request.dietary_restrictions}. Question: {request.question}"
-    if not prompt:
+    if not request.question.strip():
         raise HTTPException(status_code=400, detail="Prompt is required.")
 
-    # Call GPT-4o to generate a recipe with structured output
-    response = openai.beta.chat.completions.parse(
-        model="gpt-4o",
-        messages=[
-            { "role": "system", "content": """You create recipes using given ingredients. 
-             Include the ingredients in the contents. Return only the names of ingredients
-               in a comma separated manner without any quantities.""" },
-            {
-                "role": "user",
-                "content": prompt,
-            },
-        ],
-        response_format=RecipeLLM,
+    # Identical requests, after normalization, share one cached completion
+    key = generation_key(request.question, request.ingredients, request.dietary_restrictions, llm.model)
+    recipe_json = await generation_cache.get_or_generate(
+        key, lambda: metered(current_user.UserID, request, llm.generate(request))
     )
-    recipe_data = response.choices[0].message.content
-
-    try:
-        recipe_json = json.loads(recipe_data)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Failed to parse recipe data from OpenAI response.")
 
     return JSONResponse(status_code=201, content=recipe_json)
 
+@router.post('/generate-recipe/stream', dependencies=[Depends(generation_rate_limit), Depends(require_llm_budget)])
+async def generate_recipe_stream(
+    request: GenerateRecipeRequest,
+    current_user: User = Depends(get_current_user),
+    llm = Depends(get_llm_client)
+):
+    """
+    Stream a generated recipe as Server-Sent Events: `delta` events carry
+    the JSON text as the LLM writes it, then a final `recipe` event carries
+    the validated recipe, or an `error` event its status and detail.
+    """
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="Prompt is required.")
+    key = generation_key(request.question, request.ingredients, request.dietary_restrictions, llm.model)
+
+    async def events():
+        cached = await generation_cache.get(key)
+        if cached is not None:
+            yield sse_event("recipe", cached)
+            return
+        chunks = []
+        try:
+            async for delta in llm.stream(request):
+                chunks.append(delta)
+                yield sse_event("delta", {"content": delta})
+            recipe_json = validate_recipe("".join(chunks))
+        except HTTPException as exc:
+            yield sse_event("error", {"status": exc.status_code, "detail": exc.detail})
+            return
+        finally:
+            if chunks:
+                await charge_llm_tokens(current_user.UserID, request, "".join(chunks))
+        await generation_cache.set(key, recipe_json)
+        yield sse_event("recipe", recipe_json)
+
+    return sse_response(events())
+
+class BatchGenerateRequest(BaseModel):
+    requests: List[GenerateRecipeRequest] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+@router.post('/generate-recipes/batch', dependencies=[Depends(require_llm_budget)])
+async def generate_recipes_batch(
+    batch: BatchGenerateRequest,
+    current_user: User = Depends(get_current_user),
+    llm = Depends(get_llm_client)
+):
+    """
+    Generate several recipes in one request. Identical requests (after
+    normalization) are generated once, the others run concurrently with at
+    most BATCH_USER_CONCURRENCY upstream calls per user. Every item gets
+    its own result or error, in request order. Every item counts against
+    the generation rate limit.
+    """
+    for policy in (generation_user_policy, generation_global_policy):
+        await rate_limiter.hit(policy, current_user.UserID, cost=len(batch.requests))
+
+    async def generate(request):
+        async with batch_limiter.hold(current_user.UserID):
+            return await metered(current_user.UserID, request, llm.generate(request))
+
+    pending = {}  # generation key -> task shared by identical items
+    items = []
+    for request in batch.requests:
+        if not request.question.strip():
+            items.append(None)
+            continue
+        key = generation_key(request.question, request.ingredients, request.dietary_restrictions, llm.model)
+        if key not in pending:
+            pending[key] = asyncio.ensure_future(
+                generation_cache.get_or_generate(key, lambda request=request: generate(request))
+            )
+        items.append(pending[key])
+    await asyncio.gather(*pending.values(), return_exceptions=True)
+
+    results = []
+    for index, task in enumerate(items):
+        if task is None:
+            results.append({"index": index, "status": 400, "error": "Prompt is required."})
+        elif task.exception() is None:
+            results.append({"index": index, "status": 201, "recipe": task.result()})
+        elif isinstance(task.exception(), HTTPException):
+            results.append({"index": index, "status": task.exception().status_code, "error": task.exception().detail})
+        else:
+            results.append({"index": index, "status": 500, "error": "Recipe generation failed."})
+    return {"results": results}
+
+@router.get('/generate-recipe/cache_stats')
+def generation_cache_stats(current_user: User = Depends(get_current_user)):
+    # Generation cache counters, admins only
+    if current_user.Role:
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return generation_cache.stats()
+
+@router.get('/generate-recipe/usage')
+async def generation_usage(current_user: User = Depends(get_current_user)):
+    # LLM token budget of the current user, and the rate limiter counters for admins
+    usage = {}
+    if llm_token_policy is not None:
+        remaining = await rate_limiter.remaining(llm_token_policy, current_user.UserID)
+        usage = {
+            "token_budget": llm_token_policy.limit,
+            "period_seconds": llm_token_policy.period,
+            "tokens_remaining": max(0, int(remaining)),
+        }
+    if not current_user.Role:
+        usage["rate_limiter"] = rate_limiter.stats()
+    return usage
+
+def dedupe_ingredients(names: List[str]):
+    # Ingredient names once each, in order, so uq_recipe_ingredient holds
+    return list(dict.fromkeys(name.strip() for name in names if name.strip()))
+
+def insert_recipes(db: Session, user_id: str, recipes: List[RecipeLLM]):
+    """
+    Add recipes and their ingredients with one multi-row INSERT per table.
+    The ids are generated here, so nothing is read back; the caller
+    commits. Returns the new recipe ids in order.
+    """
+    names = {name for recipe in recipes for name in dedupe_ingredients(recipe.ingredients)}
+    ids = catalog_ids(db, names)
+    recipe_rows, ingredient_rows = [], []
+    for recipe in recipes:
+        recipe_id = generate_uuid()
+        names = dedupe_ingredients(recipe.ingredients)
+        recipe_rows.append({
+            "RecipeID": recipe_id,
+            "UserID": user_id,
+            "RecipeName": recipe.title,
+            "RecipeContent": recipe.content,
+            "Cuisine": recipe.cuisine,
+            "UserGenerated": recipe.userGenerated,
+            "CatalogIDs": pack_ids(ids.get(name) for name in names),
+        })
+        ingredient_rows.extend(
+            {"IngredientID": generate_uuid(), "RecipeID": recipe_id, "IngredientName": name, "CatalogID": ids.get(name)}
+            for name in names
+        )
+    db.execute(insert(Recipe), recipe_rows)
+    if ingredient_rows:
+        db.execute(insert(Ingredient), ingredient_rows)
+    return [row["RecipeID"] for row in recipe_rows]
+
 @router.post('/recipes')
 def create_recipe(
     recipe: RecipeLLM,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    new_recipe = Recipe(
-        UserID=current_user.UserID,
-        RecipeName=recipe.title,
-        RecipeContent=recipe.content,
-        Cuisine=recipe.cuisine,
-        UserGenerated=recipe.userGenerated,
-    )
-    db.add(new_recipe)
+    # The recipe and its ingredients are committed together or not at all
+    recipe_id, = insert_recipes(db, current_user.UserID, [recipe])
     db.commit()
-    db.refresh(new_recipe)  # Refresh to get the RecipeID
-    print("new_recipe", new_recipe.RecipeID)
-    # add ingredients to the database
-    for ingredient in recipe.ingredients:
-        new_ingredient = Ingredient(
-            RecipeID=new_recipe.RecipeID,
-            IngredientName=ingredient
-        )
-        db.add(new_ingredient)
+    return JSONResponse(status_code=201, content={"message": "Recipe created successfully.", "id": recipe_id})
+
+class RecipeImportRequest(BaseModel):
+    recipes: List[RecipeLLM] = Field(min_length=1, max_length=RECIPE_IMPORT_MAX_ITEMS)
+
+@router.post('/recipes/import')
+def import_recipes(
+    batch: RecipeImportRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    # Bulk load, in a single transaction: either every recipe is imported or none
+    recipe_ids = insert_recipes(db, current_user.UserID, batch.recipes)
     db.commit()
-    return JSONResponse(status_code=201, content={"message": "Recipe created successfully.", "id": new_recipe.RecipeID})
+    return JSONResponse(status_code=201, content={"imported": len(recipe_ids), "ids": recipe_ids})
+
 
+@router.get('/recipes/search', response_model=List[RecipeOutput])
+def search_recipes(
+    response: Response,
+    ingredient: List[str] = Query(..., min_length=1),
+    page: PageParams = Depends(page_params),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Recipes containing every given ingredient. Names are matched through
+    the ingredient catalog, so "Eggs" also finds recipes listing "egg".
+    """
+    ids = {catalog_id(db, name) for name in ingredient}
+    if None in ids:
+        return []
+    matching = (
+        db.query(Ingredient.RecipeID)
+        .filter(Ingredient.CatalogID.in_(ids))
+        .group_by(Ingredient.RecipeID)
+        .having(func.count(func.distinct(Ingredient.CatalogID)) == len(ids))
+    )
+    query = db.query(Recipe).filter(Recipe.RecipeID.in_(matching))
+    if current_user.Role:
+        query = query.filter_by(UserID=current_user.UserID)
+    recipes, next_cursor = paginate(query, Recipe.CreatedAt, Recipe.RecipeID, page)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return recipes
 
 @router.get('/recipes/{recipe_id}', response_model=RecipeOutput)
 @router.get('/recipesall', response_model=List[RecipeOutput])
 def read_recipes(
+    response: Response,
     recipe_id: str = None,
+    page: PageParams = Depends(page_params),
+    stream: bool = Depends(wants_ndjson),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):        
@@ -119,10 +285,17 @@ def read_recipes(
             raise HTTPException(status_code=404, detail="Recipe not found")
         return recipe
     else:
-        if not current_user.Role:
-            recipes = db.query(Recipe).all()
-            return recipes
-        recipes = db.query(Recipe).filter_by(UserID=current_user.UserID).all()
+        query = db.query(Recipe)
+        if current_user.Role:
+            query = query.filter_by(UserID=current_user.UserID)
+        if stream:
+            # Bulk export: stream every row instead of returning one page
+            query = query.order_by(Recipe.CreatedAt, Recipe.RecipeID)
+            return ndjson_response(db, query, serialize_recipe_output)
+        recipes, next_cursor = paginate(query, Recipe.CreatedAt, Recipe.RecipeID, page)
+        # The body stays a plain list, the next page cursor goes in a header
+        if next_cursor:
+            response.headers[NEXT_CURSOR_HEADER] = next_cursor
         return recipes
 
 @router.put('/recipes/{recipe_id}', response_model=RecipeOutput)
@@ -141,6 +314,8 @@ def update_recipe(
 
     db_recipe.RecipeName = recipe.title
     db_recipe.RecipeContent = recipe.content
+    db_recipe.Version = Recipe.Version + 1
+    refresh_feed_entries(db, recipe_ids=[recipe_id])
     db.commit()
     return db_recipe
 
@@ -155,9 +330,10 @@ def delete_recipe(
     else:
         db_recipe = db.query(Recipe).filter_by(RecipeID=recipe_id, UserID=current_user.UserID)
     
-    if not db_recipe:
+    if not db_recipe.first():
         raise HTTPException(status_code=404, detail="Recipe not found")    
-    db.query(Ingredient).filter_by(RecipeID=db_recipe.first().RecipeID).delete()
+    db.query(Ingredient).filter_by(RecipeID=recipe_id).delete()
+    delete_feed_entries(db, recipe_id)
     db_recipe.delete()
     db.commit()
     return JSONResponse(status_code=200, content={"message": "Recipe deleted successfully"})
@@ -174,6 +350,7 @@ def create_allergy(
         IngredientName=ingredient
     )
     db.add(new_allergy)
+    bump_versions(db, [version_key('allergies', current_user.UserID)])
     db.commit()
     return JSONResponse(status_code=201, content={"message": "Allergy created successfully."})
 
@@ -193,13 +370,21 @@ def read_allergy(
 
 @router.get('/allergiesall')
 def read_allergies(
+    response: Response,
+    page: PageParams = Depends(page_params),
+    stream: bool = Depends(wants_ndjson),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    if not current_user.Role:
-        allergies = db.query(Allergy).all()
-        return allergies
-    allergies = db.query(Allergy).filter_by(UserID=current_user.UserID).all()
+    query = db.query(Allergy)
+    if current_user.Role:
+        query = query.filter_by(UserID=current_user.UserID)
+    if stream:
+        query = query.order_by(Allergy.CreatedAt, Allergy.AllergyID)
+        return ndjson_response(db, query, serialize_allergy)
+    allergies, next_cursor = paginate(query, Allergy.CreatedAt, Allergy.AllergyID, page)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return allergies
 
 @router.put('/allergies/{allergy_id}')
@@ -216,6 +401,7 @@ def update_allergy(
     if not db_allergy:
         raise HTTPException(status_code=404, detail="Allergy not found")
     db_allergy.IngredientName = ingredient
+    bump_versions(db, [version_key('allergies', db_allergy.UserID)])
     db.commit()
     return db_allergy
 
@@ -229,9 +415,11 @@ def delete_allergy(
         db_allergy = db.query(Allergy).filter_by(AllergyID=allergy_id)
     else:
         db_allergy = db.query(Allergy).filter_by(AllergyID=allergy_id, UserID=current_user.UserID)
-    if not db_allergy:
+    allergy = db_allergy.first()
+    if not allergy:
         raise HTTPException(status_code=404, detail="Allergy not found")
     db_allergy.delete()
+    bump_versions(db, [version_key('allergies', allergy.UserID)])
     db.commit()
     return JSONResponse(status_code=200, content={"message": "Allergy deleted successfully"})
 
@@ -241,17 +429,22 @@ def check_allergens(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    ingredients = db.query(Ingredient).filter(Ingredient.RecipeID == recipe_id).all()
-    ingredient_names = [ingredient.IngredientName for ingredient in ingredients]
-
-    allergens = db.query(Allergy).filter(Allergy.UserID == current_user.UserID).all()
-    allergen_names = [allergy.IngredientName for allergy in allergens]
+    # The recipe's packed catalog ids against the user's allergen ids
+    contains_allergen = check_recipes(db, current_user.UserID, [recipe_id]).get(recipe_id, False)
+    return JSONResponse(status_code=200, content={"result": 0 if contains_allergen else 1})
 
-    for ingredient in ingredient_names:
-        if ingredient in allergen_names:
-            return JSONResponse(status_code=200, content={"result": 0})
+class AllergenCheckRequest(BaseModel):
+    recipe_ids: List[str] = Field(min_length=1, max_length=ALLERGEN_CHECK_MAX_ITEMS)
 
-    return JSONResponse(status_code=200, content={"result": 1})
+@router.post('/check_allergens')
+def check_allergens_bulk(
+    request: AllergenCheckRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    # Same check for many recipes at once; unknown recipe ids are left out
+    results = check_recipes(db, current_user.UserID, request.recipe_ids)
+    return {"results": {recipe_id: 0 if contains_allergen else 1 for recipe_id, contains_allergen in results.items()}}
 
 # get a list of ingredients given a recipe ID
 @router.get('/ingredients/{recipe_id}')
@@ -1,23 +1,67 @@
 from fastapi import APIRouter, Request, Response, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, RedirectResponse, Response, JSONResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
 from database import get_db
 from models import User, Recipe, ShoppingListItem
+from catalog import catalog_ids, catalog_id
+from etags import version_key, bump_versions, read_versions, make_etag, etag_matches, cache_headers, not_modified
 import json
 from routers.auth import get_current_user  # Import the dependency
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
+def shopping_list_query(db: Session, user_id: str):
+    # Items are listed in the order they were added
+    return (
+        db.query(ShoppingListItem)
+        .filter_by(UserID=user_id)
+        .order_by(ShoppingListItem.CreatedAt, ShoppingListItem.ItemID)
+    )
+
+def new_shopping_list_items(db: Session, user_id: str, ingredient_names):
+    """
+    Items for the ingredients not yet on the user's list. Names are compared
+    by catalog id, so "Eggs" is not added next to "egg", and names repeated
+    in the input are added once.
+    """
+    ids = catalog_ids(db, ingredient_names)
+    seen = {
+        item.CatalogID or item.IngredientName
+        for item in db.query(ShoppingListItem.CatalogID, ShoppingListItem.IngredientName).filter_by(UserID=user_id)
+    }
+    names = []
+    for name in ingredient_names:
+        key = ids.get(name) or name
+        if key not in seen:
+            seen.add(key)
+            names.append(name)
+    # Items added together get increasing timestamps so they keep their order
+    now = datetime.utcnow()
+    return [
+        ShoppingListItem(UserID=user_id, IngredientName=name, CatalogID=ids.get(name), CreatedAt=now + timedelta(microseconds=i))
+        for i, name in enumerate(names)
+    ]
+
+def add_shopping_list_items(db: Session, user_id: str, ingredient_names):
+    new_items = new_shopping_list_items(db, user_id, ingredient_names)
+    db.add_all(new_items)
+    if new_items:
+        bump_versions(db, [version_key('shopping_list', user_id)])
+    db.commit()
+
 @router.get('/recipes')
 def recipes(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
     Retrieve recipes for the current user.
     """
+    user_recipes = db.query(Recipe.RecipeID, Recipe.RecipeName).filter_by(UserID=current_user.UserID).all()
     recipes = [
         {'RecipeID': recipe.RecipeID, 'RecipeName': recipe.RecipeName}
-        for recipe in current_user.recipes
+        for recipe in user_recipes
     ]
     return Response(
             content=json.dumps({ "recipes": recipes}),
@@ -40,15 +84,12 @@ def add_to_shopping_list(
     if not recipe:
         raise HTTPException(status_code=404, detail="Recipe not found")
 
-    existing_items = db.query(ShoppingListItem).filter_by(UserID=current_user.UserID).all()
-    existing_ingredient_names = {item.IngredientName for item in existing_items}
-
-    new_items = [
-        ShoppingListItem(UserID=current_user.UserID, IngredientName=ingredient.IngredientName)
-        for ingredient in recipe.ingredients
-        if ingredient.IngredientName not in existing_ingredient_names
-    ]
+    new_items = new_shopping_list_items(
+        db, current_user.UserID, [ingredient.IngredientName for ingredient in recipe.ingredients]
+    )
     db.add_all(new_items)
+    if new_items:
+        bump_versions(db, [version_key('shopping_list', current_user.UserID)])
     db.commit()
     return Response(
             content=json.dumps({ "message": "Ingredients added to shopping list"}),
@@ -61,19 +102,25 @@ def add_to_shopping_list(
 
 @router.get('/shopping_list')
 def view_shopping_list_get(
+    request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     View the user's shopping list.
     """
-    shopping_list_items = db.query(ShoppingListItem).filter_by(UserID=current_user.UserID).all()
+    versions = read_versions(db, [version_key('shopping_list', current_user.UserID)])
+    etag = make_etag('shopping_list', current_user.UserID, versions)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    shopping_list_items = shopping_list_query(db, current_user.UserID).all()
     shopping_list = [item.IngredientName for item in shopping_list_items]
     return Response(
             content=json.dumps({ "shopping_list": shopping_list}),
             status_code=200,
             headers={
-                "Content-Type": "application/json"
+                "Content-Type": "application/json",
+                **cache_headers(etag)
             }
         )
 
@@ -90,18 +137,8 @@ async def view_shopping_list_post(
     shopping_list_input = form.get('shopping_list', '').split('\n')
     shopping_list_input = [item.strip() for item in shopping_list_input if item.strip()]
 
-
-    existing_items = db.query(ShoppingListItem).filter_by(UserID=current_user.UserID).all()
-    existing_ingredients = {item.IngredientName for item in existing_items}
-
-    # Add new items
-    new_items = [
-        ShoppingListItem(UserID=current_user.UserID, IngredientName=item)
-        for item in shopping_list_input
-        if item not in existing_ingredients
-    ]
-    db.add_all(new_items)
-    db.commit()
+    # The write waits its turn on the writer lock, so it runs off the event loop
+    await run_in_threadpool(add_shopping_list_items, db, current_user.UserID, shopping_list_input)
     return Response(
             content=json.dumps({ "message": "Shopping list updated"}),
             status_code=200,
@@ -112,12 +149,15 @@ async def view_shopping_list_post(
 
 @router.delete("/delete_ingredient/{ingredient_name}")
 def delete_ingredient(ingredient_name: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    existing_items = db.query(ShoppingListItem).filter_by(UserID=current_user.UserID).all()
-    existing_ingredients = {item.IngredientName for item in existing_items}
-    existing_ingredients.discard(ingredient_name)
-
-    # delete the item
-    db.query(ShoppingListItem).filter_by(UserID=current_user.UserID).filter_by(IngredientName = ingredient_name).delete()
+    # delete the item, under any spelling of the same ingredient
+    items = db.query(ShoppingListItem).filter_by(UserID=current_user.UserID)
+    ingredient_id = catalog_id(db, ingredient_name)
+    if ingredient_id is not None:
+        items = items.filter_by(CatalogID=ingredient_id)
+    else:
+        items = items.filter_by(IngredientName=ingredient_name)
+    if items.delete():
+        bump_versions(db, [version_key('shopping_list', current_user.UserID)])
 
     db.commit()
 
@@ -139,7 +179,7 @@ def save_shopping_list(
     """
     Save the user's shopping list as a text response.
     """
-    shopping_list_items = db.query(ShoppingListItem).filter_by(UserID=current_user.UserID).all()
+    shopping_list_items = shopping_list_query(db, current_user.UserID).all()
     if not shopping_list_items:
         raise HTTPException(status_code=400, detail="Your shopping list is empty.")
 
@@ -1,8 +1,12 @@
 # social_media.py
 
 from fastapi import APIRouter, Request, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import Response
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, contains_eager
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 import json
@@ -13,10 +17,22 @@ from models import (
     Bookmark,
     Comment,
     Ingredient,
-    Allergy
+    Allergy,
+    PostLike
 )
-from database import get_db
+from allergens import post_catalog_ids, recipe_catalog_ids, user_allergen_ids
+from database import get_db, get_async_db
+from feed import feed_page, entry_fragment, recipe_fragment, refresh_feed_entries, change_feed_counts
+from payloads import json_object, json_array
+from etags import (
+    FEED_VERSION, POSTED_RECIPES_VERSION, version_key, bump_versions, read_versions, make_etag, etag_matches,
+    cache_headers, not_modified
+)
+from pagination import PageParams, page_params, paginate
 from routers.auth import get_current_user 
+from like_counter import LIKE_BATCHING, like_counter
+from feed_events import POST_EVENT, LIKE_EVENT, COMMENT_EVENT, RETRY_MS, feed_broker, publish
+from streaming import sse_response
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
@@ -41,26 +57,31 @@ class CommentRequest(BaseModel):
     comment_text: str
 
 @router.post("/add_post")
-def add_post_on_social_media(
+async def add_post_on_social_media(
     request_body: RecipeIDRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user)
 ):
     recipe_id = request_body.recipe_id
-    recipe = db.query(Recipe).filter(Recipe.RecipeID == recipe_id).first()
+    recipe = await db.scalar(select(Recipe).where(Recipe.RecipeID == recipe_id))
     if not recipe:
         raise HTTPException(status_code=404, detail="Recipe not found")
     if recipe.UserID != user.UserID:
         raise HTTPException(status_code=403, detail="Permission denied")
-    recipe.Visibility = True
+    if not recipe.Visibility:
+        recipe.Visibility = True
+        recipe.Version = Recipe.Version + 1
 
     # Create a SocialMedia entry if it doesn't exist
-    social_media_entry = db.query(SocialMedia).filter(SocialMedia.RecipeID == recipe_id).first()
+    social_media_entry = await db.scalar(select(SocialMedia).where(SocialMedia.RecipeID == recipe_id))
     if not social_media_entry:
         social_media_entry = SocialMedia(RecipeID=recipe_id, UserID=user.UserID)
         db.add(social_media_entry)
+    await db.run_sync(refresh_feed_entries, recipe_ids=[recipe_id])
+    catalog_ids = (await db.run_sync(recipe_catalog_ids, [recipe_id]))[recipe_id]
 
-    db.commit()
+    await db.commit()
+    await publish(POST_EVENT, {"SMID": social_media_entry.SMID, "RecipeID": recipe_id}, catalog_ids)
     return Response(
     content=json.dumps({
         "message": "Recipe visibility updated to public and added to social media",
@@ -77,74 +98,44 @@ def add_post_on_social_media(
 
 
 
-def serialize_recipe(recipe):
-    """Helper function to serialize a Recipe object"""
-    return {
-        "RecipeID": recipe.RecipeID,
-        "RecipeName": recipe.RecipeName,
-        "RecipeContent": recipe.RecipeContent,
-        "Visibility": recipe.Visibility,
-        "UserGenerated": recipe.UserGenerated,
-        "Cuisine": recipe.Cuisine,
-        "UserID": recipe.UserID
-    }
-
 @router.get("/posts")
-def fetch_posts(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    # Fetch all public recipes with social media data in one query
-    social_media_posts = (
-        db.query(SocialMedia)
-        .options(joinedload(SocialMedia.recipe))  # Preload associated Recipe
-        .all()
-    )
-
-    # Prepare the response
-    posts = []
-    for post in social_media_posts:
-        ingredients = db.query(Ingredient).filter(Ingredient.RecipeID == post.RecipeID).all()
-        ingredient_names = [ingredient.IngredientName for ingredient in ingredients]
-        # get recipe based on recipeID
-        recipe = db.query(Recipe).filter(Recipe.RecipeID == post.RecipeID).first()
-        allergens = db.query(Allergy).filter(Allergy.UserID == user.UserID).all()
-        allergen_names = [allergy.IngredientName for allergy in allergens]
-
-        allergen_found = False
-        for ingredient in ingredient_names:
-            if ingredient in allergen_names:
-                allergen_found = True
-                break
-        if not allergen_found:
-            if not recipe:
-                continue
-            posts.append({
-                "SMID": post.SMID,
-                "Likes": post.Likes,
-                "Recipe": serialize_recipe(recipe) if recipe else ""
-            })
-
+async def fetch_posts(
+    request: Request,
+    page: PageParams = Depends(page_params),
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(get_current_user)
+):
+    # The page changes with any feed entry and with the user's allergies
+    versions = await db.run_sync(read_versions, [FEED_VERSION, version_key('allergies', user.UserID)])
+    etag = make_etag('posts', user.UserID, page.cursor, page.limit, versions)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    # Load one page of the allergen-filtered feed with a fixed number of queries
+    entries, next_cursor = await db.run_sync(feed_page, user.UserID, page)
+
+    # The stored payloads are spliced into the response without decoding
     return Response(
-        content=json.dumps({"posts": posts}),
+        content=json_object({"posts": json_array(entry_fragment(entry) for entry in entries), "next_cursor": next_cursor}),
         status_code=200,
-        headers={"Content-Type": "application/json"}
+        headers={"Content-Type": "application/json", **cache_headers(etag)}
     )
 
 @router.get("/posts/{smid}")
-def fetch_post(smid: str, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    social_media_post = (
-        db.query(SocialMedia)
-        .options(joinedload(SocialMedia.recipe))  
-        .filter(SocialMedia.SMID == smid)
-        .first()
+async def fetch_post(smid: str, db: AsyncSession = Depends(get_async_db), user: User = Depends(get_current_user)):
+    social_media_post = await db.scalar(
+        select(SocialMedia)
+        .options(joinedload(SocialMedia.recipe))
+        .where(SocialMedia.SMID == smid)
     )
     if not social_media_post:
         raise HTTPException(status_code=404, detail="Post not found on social media")
-    social_media_post = {
+    social_media_post = json_object({
         "SMID": social_media_post.SMID,
         "Likes": social_media_post.Likes,
-        "Recipe": serialize_recipe(social_media_post.recipe) if social_media_post.recipe else None
-    }
+        "Recipe": recipe_fragment(social_media_post.recipe) if social_media_post.recipe else None
+    })
     return Response(
-        content=json.dumps({"post": social_media_post}),
+        content=json_object({"post": social_media_post}),
         status_code=200,
         headers={"Content-Type": "application/json"}
     )
@@ -152,19 +143,58 @@ def fetch_post(smid: str, db: Session = Depends(get_db), user: User = Depends(ge
     # return posts
 
 
+async def change_likes(db: AsyncSession, smid: str, delta: int):
+    """
+    Apply a like/unlike to the post counter in the current transaction with
+    a single atomic UPDATE (feed entry included), or hand it to the batched
+    counter. Returns the resulting like count, or None when the post does
+    not exist.
+    """
+    if LIKE_BATCHING:
+        likes = await db.scalar(select(SocialMedia.Likes).where(SocialMedia.SMID == smid))
+        if likes is None:
+            return None
+        like_counter.add(smid, delta)
+        return likes + like_counter.pending(smid)
+    likes = await db.scalar(
+        update(SocialMedia)
+        .where(SocialMedia.SMID == smid)
+        .values(Likes=SocialMedia.Likes + delta)
+        .returning(SocialMedia.Likes)
+    )
+    if likes is not None:
+        await db.run_sync(change_feed_counts, smid, likes=delta)
+    return likes
+
 @router.post("/like_post/{smid}")
-def like_post(
+async def like_post(
     smid: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user)
 ):
-    social_media_entry = db.query(SocialMedia).filter(SocialMedia.SMID == smid).first()
-    if not social_media_entry:
+    # One like per user: the unique (UserID, SMID) constraint rejects repeats
+    try:
+        db.add(PostLike(UserID=user.UserID, SMID=smid))
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        likes = await db.scalar(select(SocialMedia.Likes).where(SocialMedia.SMID == smid))
+        if likes is None:
+            raise HTTPException(status_code=404, detail="Post not found on social media")
+        return Response(
+            content=json.dumps({"message": "Post already liked", "Likes": likes + like_counter.pending(smid)}),
+            status_code=200,
+            headers={"Content-Type": "application/json"}
+        )
+    likes = await change_likes(db, smid, 1)
+    if likes is None:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Post not found on social media")
-    social_media_entry.Likes += 1
-    db.commit()
+    catalog_ids = await db.run_sync(post_catalog_ids, smid)
+    await db.commit()
+    await publish(LIKE_EVENT, {"SMID": smid, "Likes": likes}, catalog_ids)
     return Response(
-    content=json.dumps({"message": "Post liked successfully", "Likes": social_media_entry.Likes}),
+    content=json.dumps({"message": "Post liked successfully", "Likes": likes}),
     status_code=200,
     headers={"Content-Type": "application/json"}
     )
@@ -172,18 +202,23 @@ def like_post(
     # return {"message": "Post liked successfully"}
 
 @router.post("/unlike_post")
-def unlike_post(
+async def unlike_post(
     request_body: SMIDRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user)
 ):
     smid = request_body.smid
-    social_media_entry = db.query(SocialMedia).filter(SocialMedia.SMID == smid).first()
-    if not social_media_entry:
+    post_exists = await db.scalar(select(SocialMedia.SMID).where(SocialMedia.SMID == smid))
+    if not post_exists:
         raise HTTPException(status_code=404, detail="Post not found on social media")
-    if social_media_entry.Likes > 0:
-        social_media_entry.Likes -= 1
-        db.commit()
+    removed = await db.execute(
+        delete(PostLike).where(PostLike.UserID == user.UserID, PostLike.SMID == smid)
+    )
+    if removed.rowcount:
+        likes = await change_likes(db, smid, -1)
+        catalog_ids = await db.run_sync(post_catalog_ids, smid)
+        await db.commit()
+        await publish(LIKE_EVENT, {"SMID": smid, "Likes": likes}, catalog_ids)
         # return {"message": "Post unliked successfully"}
         return Response(
             content=json.dumps({"message": "Post unliked successfully"}),
@@ -193,7 +228,7 @@ def unlike_post(
 
     else:
         return Response(
-            content=json.dumps({"message": "Cannot unlike, likes count is already zero"}),
+            content=json.dumps({"message": "Cannot unlike, post is not liked"}),
             status_code=200,
             headers={"Content-Type": "application/json"}
         )
@@ -202,14 +237,16 @@ def unlike_post(
 
 
 @router.post("/add_bookmark")
-def add_bookmark(
+async def add_bookmark(
     request_body: RecipeIDRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user)
 ):
     recipe_id = request_body.recipe_id
     new_bookmark = Bookmark(UserID=user.UserID, RecipeID=recipe_id)
-    check_bookmark = db.query(Bookmark).filter(Bookmark.UserID == user.UserID, Bookmark.RecipeID == recipe_id).first()
+    check_bookmark = await db.scalar(
+        select(Bookmark).where(Bookmark.UserID == user.UserID, Bookmark.RecipeID == recipe_id)
+    )
     if check_bookmark:
         return Response(
             content=json.dumps({"message": "Bookmark already exists"}),
@@ -219,7 +256,8 @@ def add_bookmark(
 
         # return {"message": "Bookmark already exists"}
     db.add(new_bookmark)
-    db.commit()
+    await db.run_sync(bump_versions, [version_key('bookmarks', user.UserID)])
+    await db.commit()
     return Response(
         content=json.dumps({"message": "Bookmark added successfully"}),
         status_code=200,
@@ -228,33 +266,55 @@ def add_bookmark(
 
     # return {"message": "Bookmark added successfully"}
 
+def bookmarks_page(db: Session, user_id: str, page: PageParams):
+    # Only bookmarks whose recipe is posted on social media are listed
+    query = (
+        db.query(Bookmark, SocialMedia.SMID)
+        .join(Bookmark.recipe)
+        .join(SocialMedia, SocialMedia.RecipeID == Bookmark.RecipeID)
+        .filter(Bookmark.UserID == user_id)
+        .options(contains_eager(Bookmark.recipe))
+    )
+    rows, next_cursor = paginate(
+        query, Bookmark.CreatedAt, Bookmark.BookmarkID, page,
+        row_key=lambda row: (row.Bookmark.CreatedAt, row.Bookmark.BookmarkID)
+    )
+    # One JSON fragment per bookmark, the recipe part from the payload cache
+    bookmark_list = [
+        json_object({
+            "BookmarkID": bookmark.BookmarkID,
+            "SMID": smid,
+            "Recipe": recipe_fragment(bookmark.recipe)
+        })
+        for bookmark, smid in rows
+    ]
+    return bookmark_list, next_cursor
+
 @router.get("/bookmarks")
-def fetch_bookmarks(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    bookmarks = db.query(Bookmark).filter(Bookmark.UserID == user.UserID).options(joinedload(Bookmark.recipe)).all()
-    recipes = []
-    bookmark_list = []
-    for bookmark in bookmarks:
-        if bookmark.recipe:
-            recipe = bookmark.recipe
-            smid = db.query(SocialMedia.SMID).filter(SocialMedia.RecipeID == recipe.RecipeID).first()
-            if smid:   
-                bookmark_list.append({
-                    "BookmarkID": bookmark.BookmarkID,
-                    "SMID": smid[0],
-                    "Recipe": serialize_recipe(recipe)
-                })
+async def fetch_bookmarks(
+    request: Request,
+    page: PageParams = Depends(page_params),
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(get_current_user)
+):
+    # Only posted recipes are listed, so edits to other recipes do not matter
+    versions = await db.run_sync(read_versions, [version_key('bookmarks', user.UserID), POSTED_RECIPES_VERSION])
+    etag = make_etag('bookmarks', user.UserID, page.cursor, page.limit, versions)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    bookmark_list, next_cursor = await db.run_sync(bookmarks_page, user.UserID, page)
     return Response(
-        content=json.dumps({"bookmarks": bookmark_list}),
+        content=json_object({"bookmarks": json_array(bookmark_list), "next_cursor": next_cursor}),
         status_code=200,
-        headers={"Content-Type": "application/json"}
+        headers={"Content-Type": "application/json", **cache_headers(etag)}
     )
 
     # return recipes
 
 @router.post("/add_comment")
-def add_comment(
+async def add_comment(
     request_body: CommentRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user)
 ):
     smid = request_body.smid
@@ -265,7 +325,11 @@ def add_comment(
         CommentText=comment_text
     )
     db.add(new_comment)
-    db.commit()
+    await db.run_sync(change_feed_counts, smid, comments=1)
+    await db.run_sync(bump_versions, [version_key('comments', smid)])
+    catalog_ids = await db.run_sync(post_catalog_ids, smid)
+    await db.commit()
+    await publish(COMMENT_EVENT, {"SMID": smid, "CommentID": new_comment.CommentID}, catalog_ids)
     return Response(
         content=json.dumps({"message": "Comment added successfully"}),
         status_code=200,
@@ -273,21 +337,67 @@ def add_comment(
     )
     # return {"message": "Comment added successfully"}
 
-@router.get("/comments/{smid}")
-def fetch_comments(smid: str, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
-    comments = db.query(Comment).filter(Comment.SMID == smid).all()
-    comments_with_user_info = []
-    for comment in comments:
-        commenter = db.query(User).filter(User.UserID == comment.UserID).first()
-        comments_with_user_info.append({
+def comments_page(db: Session, smid: str, page: PageParams):
+    # Comments are listed oldest first, with the commenter loaded in the same query
+    query = (
+        db.query(Comment)
+        .join(Comment.user)
+        .options(contains_eager(Comment.user))
+        .filter(Comment.SMID == smid)
+    )
+    comments, next_cursor = paginate(query, Comment.CreatedAt, Comment.CommentID, page, descending=False)
+    comments_with_user_info = [
+        {
             "CommentID": comment.CommentID,
             "CommentText": comment.CommentText,
-            "UserID": commenter.UserID,
-            "UserName": commenter.Name,
-        })
+            "UserID": comment.user.UserID,
+            "UserName": comment.user.Name,
+        }
+        for comment in comments
+    ]
+    return comments_with_user_info, next_cursor
+
+@router.get("/comments/{smid}")
+async def fetch_comments(
+    smid: str,
+    request: Request,
+    page: PageParams = Depends(page_params),
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(get_current_user)
+):
+    # The same for every reader of the post
+    versions = await db.run_sync(read_versions, [version_key('comments', smid)])
+    etag = make_etag('comments', smid, page.cursor, page.limit, versions)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    comments_with_user_info, next_cursor = await db.run_sync(comments_page, smid, page)
     return Response(
-        content=json.dumps({"comments": comments_with_user_info}),
+        content=json.dumps({"comments": comments_with_user_info, "next_cursor": next_cursor}),
         status_code=200,
-        headers={"Content-Type": "application/json"}
+        headers={"Content-Type": "application/json", **cache_headers(etag)}
     )
     # return comments_with_user_info
+
+@router.get("/feed/events")
+async def feed_events(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    """
+    Server-Sent Events stream of feed changes: `post`, `like` and `comment`
+    deltas as they are committed, and `resync` when the client fell behind
+    and should refetch /posts. Events about recipes with one of the user's
+    allergens are left out, as in the feed; allergies are read when the
+    stream opens.
+    """
+    # get_db closes the session once this returns, before the stream is
+    # sent, so the open stream holds no connection
+    allergen_ids = await run_in_threadpool(user_allergen_ids, db, user.UserID)
+
+    async def events():
+        subscription = feed_broker.hub.subscribe(allergen_ids)
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            async for message in subscription.messages():
+                yield message
+        finally:
+            feed_broker.hub.unsubscribe(subscription)
+
+    return sse_response(events())
@@ -0,0 +1,52 @@
+import json
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# Number of rows fetched from the database per round trip while streaming
+STREAM_BATCH_SIZE = 1000
+
+
+def wants_ndjson(request: Request, stream: bool = False):
+    """
+    Dependency telling whether the client opted into a streamed NDJSON
+    listing, either with `?stream=1` or `Accept: application/x-ndjson`.
+    """
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_response(db: Session, query, serialize):
+    """
+    Stream the rows of a query as newline-delimited JSON.
+
+    Rows are fetched in batches of STREAM_BATCH_SIZE with `yield_per`, so
+    memory stays flat however many rows the query returns. The request
+    session is closed before the body is sent, so the rows are read through
+    a dedicated session bound to the same engine.
+    """
+    def rows():
+        stream_db = Session(bind=db.get_bind())
+        try:
+            for row in query.with_session(stream_db).yield_per(STREAM_BATCH_SIZE):
+                yield json.dumps(serialize(row)) + "\n"
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(rows(), media_type=NDJSON_MEDIA_TYPE)
+
+def sse_event(event: str, data):
+    # One Server-Sent Event with a JSON payload
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    """
+    Send an async iterator of formatted events as a Server-Sent Events
+    stream. Proxies are asked not to buffer it so every event is flushed.
+    """
+    return StreamingResponse(
+        events,
+        media_type=SSE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
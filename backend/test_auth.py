@@ -1,9 +1,10 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
-from routers.auth import router, get_current_user, SECRET_KEY, ALGORITHM  # Import necessary items
+from routers.auth import router, get_current_user, token_cache, SECRET_KEY, ALGORITHM  # Import necessary items
 from database import get_db
 from fastapi import FastAPI, Depends, Response, status
 
@@ -193,3 +194,73 @@ def test_expired_token():
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
     assert response.json() == {"detail": "Could not validate credentials"}
     assert response.headers["www-authenticate"] == "Bearer"
+
+def test_verify_uses_token_cache():
+    response = client.post(
+        "/signup",
+        data={
+            "email": "cached@example.com",
+            "password": "strongpassword",
+            "name": "Cached User"
+        }
+    )
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get("/auth/verify", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["role"] == True
+        assert len(statements) == 1
+
+        # A second request with the same token is served from the cache
+        hits = token_cache.hits
+        response = client.get("/auth/verify", headers=headers)
+        assert response.status_code == 200
+        assert len(statements) == 1
+        assert token_cache.hits == hits + 1
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+
+    # Changing the user's role invalidates the cached principal
+    db = TestingSessionLocal()
+    user = db.query(User).filter_by(Email="cached@example.com").first()
+    user.Role = False
+    db.commit()
+    db.close()
+
+    response = client.get("/auth/verify", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["role"] == False
+
+    response = client.get("/auth/cache_stats", headers=headers)
+    assert response.status_code == 200
+    assert {"hits", "misses", "size"} <= set(response.json())
+
+def test_signup_and_login_queries_run_off_the_event_loop():
+    # Every statement of the async routes runs in a worker thread, where no loop is running
+    on_loop = []
+    def record_thread(conn, cursor, statement, parameters, context, executemany):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(statement)
+        except RuntimeError:
+            pass
+
+    event.listen(engine, "before_cursor_execute", record_thread)
+    try:
+        response = client.post(
+            "/signup",
+            data={"email": "offloop@example.com", "password": "strongpassword", "name": "Off Loop"}
+        )
+        assert response.status_code == 200
+        response = client.post("/login", data={"email": "offloop@example.com", "password": "strongpassword"})
+        assert response.status_code == 200
+    finally:
+        event.remove(engine, "before_cursor_execute", record_thread)
+    assert on_loop == []
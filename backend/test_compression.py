@@ -0,0 +1,136 @@
+import asyncio
+import gzip
+import zlib
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+from compression import CompressionMiddleware, GzipCompressor, negotiate
+from streaming import NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE
+
+BODY = b'{"posts": [' + b','.join(b'{"SMID": "%d", "Likes": 0}' % i for i in range(200)) + b']}'
+
+class IdentityCompressor:
+    # Stand-in for an optional codec, output is the input
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+    def finish(self):
+        return b''
+
+app = FastAPI()
+app.add_middleware(
+    CompressionMiddleware, minimum_size=500,
+    encodings={'zstd': IdentityCompressor, 'gzip': lambda: GzipCompressor(6)}
+)
+
+@app.get("/large")
+def large():
+    return Response(content=BODY, media_type="application/json", headers={"ETag": '"v1"'})
+
+@app.get("/small")
+def small():
+    return Response(content=b'{"ok": true}', media_type="application/json", headers={"ETag": '"v2"'})
+
+@app.get("/unchanged")
+def unchanged():
+    return Response(status_code=304, headers={"ETag": '"v1"'})
+
+@app.get("/export")
+def export():
+    return StreamingResponse((b'{"row": %d}\n' % i for i in range(500)), media_type=NDJSON_MEDIA_TYPE)
+
+@app.get("/events")
+def events():
+    return StreamingResponse((b"event: ping\ndata: {}\n\n" for _ in range(100)), media_type=SSE_MEDIA_TYPE)
+
+client = TestClient(app)
+
+def raw_get(url, accept_encoding):
+    # Read the body as sent, without the client decoding it
+    with client.stream("GET", url, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+def test_negotiate():
+    encodings = {"zstd": None, "br": None, "gzip": None}
+    assert negotiate("gzip, deflate, br", encodings) == "br"
+    assert negotiate("gzip, br;q=0.5", encodings) == "gzip"
+    assert negotiate("*;q=0.1, gzip;q=0", encodings) == "zstd"
+    assert negotiate("identity", encodings) is None
+    assert negotiate("", encodings) is None
+    assert negotiate("gzip;q=bogus", encodings) is None
+
+def test_large_response_is_compressed():
+    response, body = raw_get("/large", "gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["ETag"] == 'W/"v1"'
+    assert int(response.headers["Content-Length"]) == len(body) < len(BODY)
+    assert gzip.decompress(body) == BODY
+
+    response, body = raw_get("/large", "gzip, zstd")
+    assert response.headers["Content-Encoding"] == "zstd"
+    assert body == BODY
+
+def test_small_and_unaccepted_responses_pass_through():
+    response, body = raw_get("/small", "gzip")
+    assert "Content-Encoding" not in response.headers
+    assert body == b'{"ok": true}'
+    # Still a negotiated response: a larger body would have been compressed
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["ETag"] == 'W/"v2"'
+
+    response, body = raw_get("/large", "identity")
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["ETag"] == '"v1"'
+    assert body == BODY
+
+def test_not_modified_carries_the_tag_of_the_compressed_response():
+    response, body = raw_get("/unchanged", "gzip")
+    assert response.status_code == 304
+    assert response.headers["ETag"] == raw_get("/large", "gzip")[0].headers["ETag"] == 'W/"v1"'
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in response.headers
+
+    response, body = raw_get("/unchanged", "identity")
+    assert response.headers["ETag"] == raw_get("/large", "identity")[0].headers["ETag"] == '"v1"'
+
+def test_streamed_chunks_are_flushed():
+    rows = [b'{"row": %d}\n' % i for i in range(3)]
+
+    async def export(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", NDJSON_MEDIA_TYPE.encode())]})
+        for row in rows:
+            await send({"type": "http.response.body", "body": row, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    sent = []
+    async def send(message):
+        sent.append(message)
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    middleware = CompressionMiddleware(export, minimum_size=500, encodings={"gzip": lambda: GzipCompressor(6)})
+    scope = {"type": "http", "method": "GET", "path": "/export", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(middleware(scope, receive, send))
+
+    # Every row decodes from its own chunk, before the stream ends
+    decompressor = zlib.decompressobj(31)
+    chunks = [message["body"] for message in sent[1:]]
+    assert [decompressor.decompress(chunk) for chunk in chunks[:3]] == rows
+    decompressor.decompress(chunks[3])
+    assert decompressor.eof
+
+def test_streamed_responses():
+    response, body = raw_get("/export", "gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    rows = zlib.decompress(body, 31).splitlines()
+    assert len(rows) == 500 and rows[-1] == b'{"row": 499}'
+
+    # Server-Sent Events are on the skip list
+    response, body = raw_get("/events", "gzip")
+    assert "Content-Encoding" not in response.headers
+    assert body.count(b"event: ping") == 100
@@ -1,6 +1,7 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from models import Base, User, Recipe, Ingredient
+import catalog  # fills ingredient CatalogIDs on flush
 import bcrypt
 import uuid
 
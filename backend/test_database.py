@@ -0,0 +1,425 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from database import (
+    engine_options, apply_sqlite_pragmas, create_writer_engine, RoutingSession, FairLock
+)
+from catalog import normalize_ingredient
+from allergens import pack_ids, unpack_ids, hits, check_recipes
+from feed import build_feed, check_feed_entries, repair_feed_entries, rebuild_feed_entries
+from migrations import Operations, discover, upgrade
+from models import Base, User, Recipe, Ingredient, Allergy, Bookmark, ShoppingListItem, SocialMedia, Comment, FeedEntry
+from pagination import PageParams
+import payloads
+from etags import bump_versions, read_versions, make_etag, etag_matches
+from payloads import json_object, json_array
+from routers.shoppinglist import shopping_list_query
+from routers.social_media import bookmarks_page, comments_page
+
+
+@pytest.fixture(scope="module")
+def engines():
+    db_fd, db_path = tempfile.mkstemp(suffix=".db")
+    url = f"sqlite:///{db_path}"
+    reader = create_engine(url, **engine_options(url))
+    apply_sqlite_pragmas(reader)
+    writer = create_writer_engine(url)
+    Base.metadata.create_all(bind=writer)
+    yield reader, writer
+    reader.dispose()
+    writer.dispose()
+    os.close(db_fd)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+def test_sqlite_pragmas(engines):
+    reader, writer = engines
+    with reader.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+def test_routing_session_sends_writes_to_writer(engines):
+    reader, writer = engines
+    SessionFactory = sessionmaker(class_=RoutingSession, reader=reader, writer=writer)
+
+    statements = {"reader": [], "writer": []}
+    def recorder(name):
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements[name].append(statement.split()[0])
+        return record
+    record_reader, record_writer = recorder("reader"), recorder("writer")
+    event.listen(reader, "before_cursor_execute", record_reader)
+    event.listen(writer, "before_cursor_execute", record_writer)
+    try:
+        db = SessionFactory()
+        assert db.query(User).count() == 0
+        db.add(User(Email="writer@example.com", Password="x", Name="Writer"))
+        db.flush()
+        # Reads after a write in the same transaction see the new row
+        assert db.query(User).count() == 1
+        db.commit()
+        assert db.query(User).count() == 1
+        db.close()
+    finally:
+        event.remove(reader, "before_cursor_execute", record_reader)
+        event.remove(writer, "before_cursor_execute", record_writer)
+
+    assert statements["reader"] == ["SELECT", "SELECT"]
+    assert statements["writer"] == ["INSERT", "SELECT"]
+
+def test_sync_and_async_writers_share_one_lock():
+    db_fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(db_fd)
+    lock = FairLock()
+    writer = create_writer_engine(f"sqlite:///{db_path}", lock=lock)
+    async_writer = create_writer_engine(f"sqlite+aiosqlite:///{db_path}", create_async_engine, lock=lock)
+    with writer.begin() as conn:
+        conn.execute(text("CREATE TABLE log (entry TEXT)"))
+
+    log = []
+    holding = threading.Event()
+
+    def sync_write(entry, hold=0):
+        with writer.begin() as conn:
+            log.append(f"{entry} start")
+            holding.set()
+            time.sleep(hold)
+            conn.execute(text("INSERT INTO log VALUES (:entry)"), {"entry": entry})
+            log.append(f"{entry} end")
+
+    async def async_write(entry, hold=0):
+        async with async_writer.begin() as conn:
+            log.append(f"{entry} start")
+            holding.set()
+            await asyncio.sleep(hold)
+            await conn.execute(text("INSERT INTO log VALUES (:entry)"), {"entry": entry})
+            log.append(f"{entry} end")
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        # The sync writer holds a transaction while the async one starts:
+        # the async writer waits without blocking the event loop
+        thread = threading.Thread(target=sync_write, args=("sync", 0.2))
+        thread.start()
+        await loop.run_in_executor(None, holding.wait)
+        ticks = 0
+        write = asyncio.ensure_future(async_write("async"))
+        while not write.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        await write
+        await loop.run_in_executor(None, thread.join)
+        assert ticks > 5
+
+        # And the other way round: the sync writer waits for the async one
+        holding.clear()
+        write = asyncio.ensure_future(async_write("async again", 0.2))
+        await loop.run_in_executor(None, holding.wait)
+        await loop.run_in_executor(None, sync_write, "sync again")
+        await write
+
+    async def run_scenario():
+        try:
+            await scenario()
+        finally:
+            await async_writer.dispose()
+
+    try:
+        asyncio.run(run_scenario())
+        assert log == [
+            "sync start", "sync end", "async start", "async end",
+            "async again start", "async again end", "sync again start", "sync again end",
+        ]
+        with writer.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM log")).scalar() == 4
+        # Every connection went back, so the lock is free again
+        lock.acquire()
+        lock.release()
+    finally:
+        writer.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+def capture_selects(engine, run):
+    # Record every SELECT issued while running a hot path, with its parameters
+    captured = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        with Session(bind=engine) as db:
+            run(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return captured
+
+def test_hot_queries_use_indexes(engines):
+    reader, writer = engines
+    user_id, smid, recipe_id = "u-1", "sm-1", "r-1"
+    cursor = PageParams(limit=10)
+    hot_paths = [
+        lambda db: build_feed(db, user_id, cursor),
+        lambda db: bookmarks_page(db, user_id, cursor),
+        lambda db: comments_page(db, smid, cursor),
+        lambda db: db.query(Recipe.RecipeID, Recipe.RecipeName).filter_by(UserID=user_id).all(),
+        lambda db: db.query(Recipe).filter_by(Visibility=True, Cuisine="Italian").all(),
+        lambda db: db.query(Allergy).filter_by(UserID=user_id).order_by(Allergy.CreatedAt, Allergy.AllergyID).all(),
+        lambda db: shopping_list_query(db, user_id).all(),
+        lambda db: db.query(ShoppingListItem).filter_by(UserID=user_id, IngredientName="Salt").all(),
+    ]
+    # Give the feed's anti-join something to filter on
+    with Session(bind=writer) as db:
+        db.add(User(UserID=user_id, Email="plan@example.com", Password="x", Name="Plan"))
+        db.add(Allergy(UserID=user_id, IngredientName="Peanut"))
+        db.commit()
+
+    statements = []
+    for run in hot_paths:
+        statements += capture_selects(writer, run)
+    assert statements
+
+    with writer.connect() as conn:
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+            full_scans = [row.detail for row in plan if re.fullmatch(r"SCAN \w+", row.detail)]
+            assert not full_scans, f"{statement}\n{[row.detail for row in plan]}"
+
+def schema(engine):
+    inspector = inspect(engine)
+    return {
+        table: (
+            {column["name"] for column in inspector.get_columns(table)},
+            {index["name"] for index in inspector.get_indexes(table)},
+            {constraint["name"] for constraint in inspector.get_unique_constraints(table)},
+        )
+        for table in Base.metadata.tables
+    }
+
+@pytest.fixture
+def empty_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+def test_migrations_match_models(empty_engine, tmp_path):
+    assert upgrade(empty_engine) == [version for version, module in discover()]
+    assert upgrade(empty_engine) == []
+
+    models_engine = create_engine(f"sqlite:///{tmp_path / 'models.db'}")
+    Base.metadata.create_all(bind=models_engine)
+    assert schema(empty_engine) == schema(models_engine)
+    models_engine.dispose()
+
+@pytest.mark.parametrize("online", [False, True])
+def test_migrations_upgrade_legacy_database(empty_engine, online):
+    # A database created by create_all before migrations existed
+    version, initial = discover()[0]
+    with empty_engine.begin() as conn:
+        initial.upgrade(Operations(conn))
+        conn.execute(text("INSERT INTO users VALUES ('u-1', 'old@example.com', 'x', 1, 'Old')"))
+        conn.execute(text("INSERT INTO recipe VALUES ('r-1', 'u-1', 'Soup', 'Boil.', 'Unknown', 1, 0)"))
+        conn.execute(text("INSERT INTO bookmark VALUES ('b-1', 'u-1', 'r-1'), ('b-2', 'u-1', 'r-1')"))
+
+    upgrade(empty_engine, online=online)
+    with Session(bind=empty_engine) as db:
+        recipe = db.get(Recipe, "r-1")
+        assert recipe.CreatedAt.year == 1970
+        assert db.query(Bookmark).count() == 1
+    assert "ix_recipe_user_created" in schema(empty_engine)["recipe"][1]
+
+def test_normalize_ingredient():
+    assert normalize_ingredient("  Green   Onions! ") == "green onion"
+    assert normalize_ingredient("Tomatoes") == normalize_ingredient("tomato") == "tomato"
+    assert normalize_ingredient("Berries") == "berry"
+    assert normalize_ingredient("Peaches") == "peach"
+    assert normalize_ingredient("Hummus") == "hummus"
+    assert normalize_ingredient("Molasses") == "molasses"
+    assert normalize_ingredient("egg") == "egg"
+    assert normalize_ingredient("!!") == ""
+    for plural, name in [("Cookies", "cookie"), ("pies", "pie"), ("Brownies", "brownie"), ("veggies", "veggie"), ("chips", "chip")]:
+        assert normalize_ingredient(plural) == normalize_ingredient(name) == name
+
+def test_migrations_backfill_ingredient_catalog(empty_engine):
+    # Rows written before the catalog get their CatalogID from the name
+    versions = discover()
+    with empty_engine.begin() as conn:
+        for version, module in versions:
+            if version >= "0006":
+                break
+            module.upgrade(Operations(conn))
+        conn.execute(text("INSERT INTO users VALUES ('u-1', 'old@example.com', 'x', 1, 'Old')"))
+        conn.execute(text("INSERT INTO recipe VALUES ('r-1', 'u-1', 'Soup', 'Boil.', 'Unknown', 1, 0, '2024-01-01 00:00:00')"))
+        conn.execute(text("INSERT INTO ingredients VALUES ('i-1', 'r-1', 'Leeks'), ('i-2', 'r-1', 'Peanuts'), ('i-3', 'r-1', 'Cookies')"))
+        conn.execute(text("INSERT INTO allergy VALUES ('a-1', 'u-1', 'peanut', '2024-01-01 00:00:00')"))
+
+    upgrade(empty_engine)
+    with Session(bind=empty_engine) as db:
+        ingredients = {row.IngredientName: row.CatalogID for row in db.query(Ingredient)}
+        allergy = db.get(Allergy, "a-1")
+        assert None not in ingredients.values()
+        assert allergy.CatalogID == ingredients["Peanuts"]
+        # 0006 names entries with the rule of its time, later migrations correct them
+        names = dict(db.execute(text('SELECT "CatalogID", "Name" FROM ingredient_catalog')).all())
+        assert sorted(names.values()) == ["cookie", "leek", "peanut"]
+        # The allergen index is filled in as well
+        assert unpack_ids(db.get(Recipe, "r-1").CatalogIDs) == sorted(ingredients.values())
+    assert not [
+        foreign_key for foreign_key in inspect(empty_engine).get_foreign_keys("allergy")
+        if foreign_key["referred_table"] == "ingredients"
+    ]
+    assert "ix_allergy_user_created" in schema(empty_engine)["allergy"][1]
+
+def test_allergen_ids():
+    packed = pack_ids([70, 3, 3, None, 12, 4_000_000_000])
+    assert len(packed) == 16
+    assert unpack_ids(packed) == [3, 12, 70, 4_000_000_000]
+    assert hits(frozenset([70]), packed)
+    assert hits(frozenset([4_000_000_000]), packed)
+    assert not hits(frozenset([4, 69]), packed)
+    assert not hits(frozenset(), packed)
+
+@pytest.mark.parametrize("use_orjson", [False, True])
+def test_payload_fragments(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(payloads, "orjson", None)
+    elif payloads.orjson is None:
+        pytest.skip("orjson is not installed")
+    # bytes values are spliced in as JSON, everything else is encoded
+    body = json_object({"posts": json_array([b'{"a":1}', {"b": "x"}]), "next_cursor": None, "n": 2, "s": "caf\u00e9"})
+    assert json.loads(body) == {"posts": [{"a": 1}, {"b": "x"}], "next_cursor": None, "n": 2, "s": "caf\u00e9"}
+
+def test_allergen_index_follows_ingredient_changes(engines):
+    reader, writer = engines
+    with Session(bind=writer) as db:
+        db.add(User(UserID="u-mask", Email="mask@example.com", Password="x", Name="Mask"))
+        db.add(Recipe(RecipeID="r-mask", UserID="u-mask", RecipeName="Satay", RecipeContent="Grill.", Cuisine="Thai"))
+        db.add(Allergy(UserID="u-mask", IngredientName="Peanut"))
+        db.flush()
+        db.add_all([Ingredient(RecipeID="r-mask", IngredientName="Chicken"), Ingredient(RecipeID="r-mask", IngredientName="Peanuts")])
+        db.commit()
+        assert check_recipes(db, "u-mask", ["r-mask", "unknown"]) == {"r-mask": True}
+
+        peanut = db.query(Ingredient).filter_by(RecipeID="r-mask", IngredientName="Peanuts").one()
+        db.delete(peanut)
+        db.commit()
+        assert len(unpack_ids(db.get(Recipe, "r-mask").CatalogIDs)) == 1
+        assert check_recipes(db, "u-mask", ["r-mask"]) == {"r-mask": False}
+
+def test_migrations_backfill_feed_entries(empty_engine, monkeypatch):
+    # Posts written before the read model get their entry from the source tables
+    with empty_engine.begin() as conn:
+        for version, module in discover():
+            if version >= "0008":
+                # One post per batch, so the backfill runs over several
+                monkeypatch.setattr(module, "BATCH_SIZE", 1)
+                break
+            module.upgrade(Operations(conn))
+        conn.execute(text("INSERT INTO users VALUES ('u-1', 'old@example.com', 'x', 1, 'Old')"))
+        conn.execute(text(
+            'INSERT INTO recipe ("RecipeID", "UserID", "RecipeName", "RecipeContent", "Cuisine", "Visibility", "UserGenerated", "CreatedAt") '
+            "VALUES ('r-1', 'u-1', 'Soup', 'Boil.', 'Unknown', 1, 0, '2024-01-01 00:00:00')"
+        ))
+        conn.execute(text('INSERT INTO ingredients ("IngredientID", "RecipeID", "IngredientName") VALUES (\'i-1\', \'r-1\', \'Leek\')'))
+        conn.execute(text(
+            'INSERT INTO social_media ("SMID", "RecipeID", "Likes", "UserID", "CreatedAt") '
+            "VALUES ('sm-1', 'r-1', 4, 'u-1', '2024-01-02 00:00:00'), ('sm-2', 'r-1', 0, 'u-1', '2024-01-04 00:00:00')"
+        ))
+        conn.execute(text(
+            'INSERT INTO comments ("CommentID", "SMID", "UserID", "CommentText", "CreatedAt") '
+            "VALUES ('c-1', 'sm-1', 'u-1', 'Nice', '2024-01-03 00:00:00')"
+        ))
+
+    upgrade(empty_engine)
+    with Session(bind=empty_engine) as db:
+        assert check_feed_entries(db) == {"missing": [], "stale": [], "orphaned": []}
+        posts, _ = build_feed(db, "u-1")
+        assert [(post["SMID"], post["Likes"], post["Comments"], post["Recipe"]["RecipeName"]) for post in posts] == [
+            ("sm-2", 0, 0, "Soup"), ("sm-1", 4, 1, "Soup")
+        ]
+
+def test_migrations_fix_ie_plurals(empty_engine):
+    # Catalog names from the old singular rule are renamed or merged
+    with empty_engine.begin() as conn:
+        for version, module in discover():
+            if version >= "0011":
+                break
+            module.upgrade(Operations(conn))
+        conn.execute(text("INSERT INTO users VALUES ('u-1', 'old@example.com', 'x', 1, 'Old')"))
+        conn.execute(text('INSERT INTO ingredient_catalog ("CatalogID", "Name") VALUES (1, \'cooky\'), (2, \'cookie\'), (3, \'potato chips\')'))
+        conn.execute(text(
+            'INSERT INTO recipe ("RecipeID", "UserID", "RecipeName", "RecipeContent", "Cuisine", "Visibility", "UserGenerated", "CreatedAt", "CatalogIDs") '
+            "VALUES ('r-1', 'u-1', 'Snack', 'Bake.', 'Unknown', 1, 0, '2024-01-01 00:00:00', :packed)"
+        ), {"packed": pack_ids([1, 3])})
+        conn.execute(text(
+            'INSERT INTO ingredients ("IngredientID", "RecipeID", "IngredientName", "CatalogID") '
+            "VALUES ('i-1', 'r-1', 'Cookies', 1), ('i-2', 'r-1', 'Potato chips', 3)"
+        ))
+        conn.execute(text(
+            'INSERT INTO allergy ("AllergyID", "UserID", "IngredientName", "CatalogID", "CreatedAt") '
+            "VALUES ('a-1', 'u-1', 'cookie', 2, '2024-01-01 00:00:00')"
+        ))
+
+    upgrade(empty_engine)
+    with Session(bind=empty_engine) as db:
+        catalog = dict(db.execute(text('SELECT "Name", "CatalogID" FROM ingredient_catalog')).all())
+        assert catalog == {"cookie": 2, "potato chip": 3}
+        assert {row.IngredientName: row.CatalogID for row in db.query(Ingredient)} == {"Cookies": 2, "Potato chips": 3}
+        assert unpack_ids(db.get(Recipe, "r-1").CatalogIDs) == [2, 3]
+        assert check_recipes(db, "u-1", ["r-1"]) == {"r-1": True}
+
+def test_feed_entries_consistency_check(engines):
+    reader, writer = engines
+    with Session(bind=writer) as db:
+        db.add(User(UserID="u-feed", Email="feed@example.com", Password="x", Name="Feed"))
+        db.add_all(
+            Recipe(RecipeID=f"r-feed-{i}", UserID="u-feed", RecipeName=f"Stew {i}", RecipeContent="Simmer.", Cuisine="Irish")
+            for i in range(3)
+        )
+        db.add_all(SocialMedia(SMID=f"sm-feed-{i}", RecipeID=f"r-feed-{i}", UserID="u-feed") for i in range(3))
+        db.commit()
+        rebuild_feed_entries(db)
+        db.commit()
+        assert check_feed_entries(db) == {"missing": [], "stale": [], "orphaned": []}
+
+        # Writes that bypassed the read model show up in the diff
+        db.add(Comment(SMID="sm-feed-0", UserID="u-feed", CommentText="Hearty"))
+        db.query(FeedEntry).filter_by(SMID="sm-feed-1").delete()
+        db.query(Recipe).filter_by(RecipeID="r-feed-2").delete()
+        db.commit()
+        report = check_feed_entries(db)
+        assert report == {"missing": ["sm-feed-1"], "stale": ["sm-feed-0"], "orphaned": ["sm-feed-2"]}
+
+        repair_feed_entries(db, report)
+        db.commit()
+        assert check_feed_entries(db) == {"missing": [], "stale": [], "orphaned": []}
+        assert db.get(FeedEntry, "sm-feed-0").Comments == 1
+        assert db.get(FeedEntry, "sm-feed-2") is None
+
+def test_resource_versions(engines):
+    reader, writer = engines
+    with Session(bind=writer) as db:
+        assert read_versions(db, ["posts:u-1", "bookmarks:u-1"]) == (0, 0)
+        bump_versions(db, ["posts:u-1", "bookmarks:u-1"])
+        bump_versions(db, ["posts:u-1"])
+        db.commit()
+        assert read_versions(db, ["posts:u-1", "bookmarks:u-1"]) == (2, 1)
+
+    etag = make_etag("posts", "u-1", None, 50, (2, 1))
+    assert etag != make_etag("posts", "u-1", None, 50, (3, 1))
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
@@ -0,0 +1,88 @@
+import asyncio
+import json
+from allergens import pack_ids
+from feed_events import FeedHub, SQLiteFeedBroker, RESYNC_EVENT, KEEPALIVE
+
+def parse(message):
+    event, data = message.strip().split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+def test_slow_subscriber_gets_resync():
+    async def main():
+        hub = FeedHub(queue_size=3)
+        slow, fast = hub.subscribe(), hub.subscribe()
+        received = []
+
+        async def read_fast():
+            async for message in fast.messages():
+                received.append(parse(message))
+
+        reader = asyncio.create_task(read_fast())
+        for likes in range(10):
+            hub.deliver("like", {"SMID": "a", "Likes": likes})
+            await asyncio.sleep(0.01)
+        # The slow client's backlog was replaced by a single resync
+        pending = []
+        while not slow.queue.empty():
+            pending.append(parse(slow.queue.get_nowait()))
+        hub.close_all()
+        await reader
+        return received, pending, slow.resyncs
+
+    received, pending, resyncs = asyncio.run(main())
+    assert [data["Likes"] for _, data in received] == list(range(10))
+    assert pending == [(RESYNC_EVENT, {})]
+    assert resyncs == 3
+
+def test_events_skip_subscribers_allergic_to_the_recipe():
+    async def main():
+        hub = FeedHub()
+        allergic, other = hub.subscribe(frozenset({7})), hub.subscribe()
+        hub.deliver("post", {"SMID": "a", "RecipeID": "r1"}, pack_ids([3, 7]))
+        hub.deliver("post", {"SMID": "b", "RecipeID": "r2"}, pack_ids([3]))
+        hub.deliver("like", {"SMID": "c", "Likes": 1})
+        return [
+            [parse(subscription.queue.get_nowait())[1].get("SMID") for _ in range(subscription.queue.qsize())]
+            for subscription in (allergic, other)
+        ]
+
+    assert asyncio.run(main()) == [["b", "c"], ["a", "b", "c"]]
+
+def test_keepalive():
+    async def main():
+        subscription = FeedHub().subscribe()
+        messages = subscription.messages(keepalive=0.01)
+        return await messages.__anext__()
+
+    assert asyncio.run(main()) == KEEPALIVE
+
+def test_sqlite_broker_is_shared_by_workers(tmp_path):
+    """
+    Test that an event published on one worker reaches the subscribers of
+    another through the shared SQLite table, and that a worker starting
+    later does not replay older events.
+    """
+    path = str(tmp_path / "feed_events.db")
+
+    async def main():
+        first, second = SQLiteFeedBroker(path), SQLiteFeedBroker(path)
+        await first.publish("post", {"SMID": "old", "RecipeID": "r0"})
+        await first.start()
+        await second.start()
+        try:
+            subscription = second.hub.subscribe(frozenset({7}))
+            await first.publish("comment", {"SMID": "a", "CommentID": "c1"}, pack_ids([3]))
+            await second.publish("like", {"SMID": "a", "Likes": 3})
+            await second.publish("like", {"SMID": "b", "Likes": 1}, pack_ids([7]))
+            assert await first.poll() == 3
+            assert await second.poll() == 3
+            assert await second.poll() == 0
+            return [parse(subscription.queue.get_nowait()) for _ in range(subscription.queue.qsize())]
+        finally:
+            await first.stop()
+            await second.stop()
+
+    assert asyncio.run(main()) == [
+        ("comment", {"SMID": "a", "CommentID": "c1"}),
+        ("like", {"SMID": "a", "Likes": 3}),
+    ]
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import tempfile
+import httpx
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from main import app
+from database import Base, get_db
+from models import User, GenerationJob
+from routers.auth import get_current_user, UserPrincipal
+from generation import generation_cache
+import jobs
+from jobs import JobWorkerPool, claim_job, get_job_pool, resolve_host as original_resolve_host
+
+db_fd, db_path = tempfile.mkstemp(suffix=".db")
+engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+RECIPE = {"title": "Job cake", "content": "Mix and bake.", "ingredients": ["flour"], "userGenerated": False, "cuisine": "Unknown"}
+USER = UserPrincipal(UserID="job-user", Role=True, Name="Job User", Email="jobs@example.com")
+ADMIN = UserPrincipal(UserID="job-admin", Role=False, Name="Job Admin", Email="jobadmin@example.com")
+# Fake DNS for callback hosts; IP literals resolve to themselves
+DNS = {"hooks.example.com": {"93.184.216.34"}, "intranet.example.com": {"10.0.0.5"}}
+
+
+class FlakyLLM:
+    """
+    Fails the first `failures` generations, then returns RECIPE.
+    """
+    model = "stub"
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    async def generate(self, request):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise HTTPException(status_code=502, detail="Upstream error")
+        return RECIPE
+
+class GatedLLM:
+    """
+    Returns RECIPE once `gate` is set.
+    """
+    model = "stub"
+    gate = None
+
+    async def generate(self, request):
+        await self.gate.wait()
+        return RECIPE
+
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    for user in (USER, ADMIN):
+        db.add(User(UserID=user.UserID, Email=user.Email, Password="x", Role=user.Role, Name=user.Name))
+    db.commit()
+    db.close()
+    yield
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+    os.close(db_fd)
+    os.remove(db_path)
+
+@pytest.fixture()
+def job_env(monkeypatch):
+    """
+    Runs `scenario(client, pool, callbacks)` against the app with a worker
+    pool on the test database; webhook calls are captured, not sent.
+    """
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL_MS", 20)
+    monkeypatch.setattr(jobs, "JOB_RETRY_BASE_DELAY", 0)
+    dns = dict(DNS)
+    monkeypatch.setattr(jobs, "resolve_host", lambda host, port: dns.get(host) or original_resolve_host(host, port))
+    generation_cache.store.clear()
+    user = {"current": USER}
+
+    def override_get_db():
+        db = TestingSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def run(scenario, llm):
+        callbacks = []
+
+        def webhook(request):
+            callbacks.append(json.loads(request.content))
+            return httpx.Response(200)
+
+        async def main():
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+            pool = JobWorkerPool(async_engine, workers=2, provider=llm, transport=httpx.MockTransport(webhook))
+            app.dependency_overrides[get_job_pool] = lambda: pool
+            await pool.start()
+            try:
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    return await scenario(client, pool, callbacks, user, dns)
+            finally:
+                await pool.stop()
+                await async_engine.dispose()
+
+        return asyncio.run(main())
+
+    # Other test modules install their own overrides at import time
+    saved = dict(app.dependency_overrides)
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_current_user] = lambda: user["current"]
+    yield run
+    app.dependency_overrides.clear()
+    app.dependency_overrides.update(saved)
+
+async def wait_for(client, job_id, statuses=("succeeded", "dead")):
+    for _ in range(200):
+        response = await client.get(f"/jobs/{job_id}")
+        assert response.status_code == 200
+        if response.json()["status"] in statuses:
+            return response.json()
+        await asyncio.sleep(0.02)
+    raise AssertionError("job did not finish")
+
+def submit(client, question, callback_url=None):
+    body = {"question": question, "ingredients": ["flour"], "dietary_restrictions": []}
+    if callback_url:
+        body["callback_url"] = callback_url
+    return client.post("/generate-recipe/jobs", json=body)
+
+def test_job_succeeds_and_calls_back(job_env):
+    async def scenario(client, pool, callbacks, user, dns):
+        response = await submit(client, "Job cake", "https://hooks.example.com/done")
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert response.json()["status_url"] == f"/jobs/{job_id}"
+        job = await wait_for(client, job_id)
+        assert job["status"] == "succeeded"
+        assert job["result"] == RECIPE
+        assert job["attempts"] == 1
+        for _ in range(50):
+            if (await client.get(f"/jobs/{job_id}")).json()["callback_status"]:
+                break
+            await asyncio.sleep(0.02)
+        assert callbacks == [{"job_id": job_id, "status": "succeeded", "result": RECIPE, "error": None}]
+        assert (await client.get(f"/jobs/{job_id}")).json()["callback_status"] == "delivered"
+
+    job_env(scenario, FlakyLLM())
+
+def test_job_retries_then_succeeds(job_env):
+    async def scenario(client, pool, callbacks, user, dns):
+        job_id = (await submit(client, "Flaky cake")).json()["job_id"]
+        job = await wait_for(client, job_id)
+        assert job["status"] == "succeeded"
+        assert job["attempts"] == 3
+        assert pool.retried == 2
+
+    job_env(scenario, FlakyLLM(failures=2))
+
+def test_job_dead_letter_and_admin_retry(job_env):
+    llm = FlakyLLM(failures=jobs.JOB_MAX_ATTEMPTS)
+
+    async def scenario(client, pool, callbacks, user, dns):
+        job_id = (await submit(client, "Doomed cake")).json()["job_id"]
+        job = await wait_for(client, job_id)
+        assert job["status"] == "dead"
+        assert job["error"] == "Upstream error"
+        assert job["attempts"] == jobs.JOB_MAX_ATTEMPTS
+
+        assert (await client.post(f"/jobs/{job_id}/retry")).status_code == 403
+        user["current"] = ADMIN
+        metrics = (await client.get("/jobs/metrics")).json()
+        assert metrics["jobs"]["dead"] >= 1
+        assert metrics["dead_lettered"] == 1
+        retried = await client.post(f"/jobs/{job_id}/retry")
+        assert retried.status_code == 200
+        assert retried.json()["status"] == "queued"
+        job = await wait_for(client, job_id)
+        assert job["status"] == "succeeded"
+
+    job_env(scenario, llm)
+
+def test_jobs_are_private_and_validated(job_env):
+    async def scenario(client, pool, callbacks, user, dns):
+        assert (await submit(client, "   ")).status_code == 400
+        assert (await submit(client, "Cake", "ftp://example.com/hook")).status_code == 422
+        job_id = (await submit(client, "Private cake")).json()["job_id"]
+        user["current"] = UserPrincipal(UserID="someone-else", Role=True, Name="Other", Email="other@example.com")
+        assert (await client.get(f"/jobs/{job_id}")).status_code == 404
+        assert (await client.get("/jobs/metrics")).status_code == 403
+
+    job_env(scenario, FlakyLLM())
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8000/hook",
+    "http://localhost/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.1.2.3/hook",
+    "http://192.168.1.1/hook",
+    "http://[::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "https://intranet.example.com/hook",
+    "https://unresolvable.invalid/hook",
+])
+def test_private_callback_urls_are_rejected(job_env, url):
+    async def scenario(client, pool, callbacks, user, dns):
+        response = await submit(client, "Nosy cake", url)
+        assert response.status_code == 422
+
+    job_env(scenario, FlakyLLM())
+
+def test_callback_host_checked_again_before_sending(job_env, monkeypatch, caplog):
+    async def scenario(client, pool, callbacks, user, dns):
+        # The host passes when the job is created, then rebinds to loopback
+        llm.gate = asyncio.Event()
+        job_id = (await submit(client, "Rebound cake", "https://hooks.example.com/done")).json()["job_id"]
+        dns["hooks.example.com"] = {"127.0.0.1"}
+        llm.gate.set()
+        await wait_for(client, job_id)
+        for _ in range(50):
+            if (await client.get(f"/jobs/{job_id}")).json()["callback_status"]:
+                break
+            await asyncio.sleep(0.02)
+        assert (await client.get(f"/jobs/{job_id}")).json()["callback_status"] == "rejected"
+        assert callbacks == []
+        assert f"Job {job_id} callback not sent" in caplog.text
+
+        # With an allowlist only the listed hosts are accepted
+        monkeypatch.setattr(jobs, "JOB_CALLBACK_HOSTS", ["hooks.example.com"])
+        assert (await submit(client, "Listed cake", "https://hooks.example.com/done")).status_code == 202
+        assert (await submit(client, "Unlisted cake", "https://other.example.com/done")).status_code == 422
+
+    llm = GatedLLM()
+    job_env(scenario, llm)
+
+def test_queued_job_wakes_idle_workers(job_env, monkeypatch):
+    # The sync route notifies from a threadpool thread; workers wake before their next poll
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL_MS", 60_000)
+
+    async def scenario(client, pool, callbacks, user, dns):
+        await asyncio.sleep(0.05)
+        job_id = (await submit(client, "Prompt cake")).json()["job_id"]
+        assert (await wait_for(client, job_id))["status"] == "succeeded"
+
+    job_env(scenario, FlakyLLM())
+
+def test_claim_is_exclusive():
+    # Many concurrent claims on one queued job hand it to a single worker
+    async def main():
+        db = TestingSessionLocal()
+        db.add(GenerationJob(UserID=USER.UserID, Request="{}", MaxAttempts=1))
+        db.commit()
+        db.close()
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        try:
+            claims = await asyncio.gather(*(claim_job(async_engine) for _ in range(10)))
+        finally:
+            await async_engine.dispose()
+        return [claim for claim in claims if claim is not None]
+
+    assert len(asyncio.run(main())) == 1
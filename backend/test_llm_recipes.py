@@ -1,14 +1,25 @@
+import asyncio
 import os
 import tempfile
 import bcrypt
+import time
+import threading
+import httpx
 import pytest
+import json
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from main import app
 from database import Base, get_db
 from models import User, Recipe
-from routers.auth import get_password_hash  # Import your password hashing function
+from routers.auth import get_password_hash, get_current_user, UserPrincipal  # Import your password hashing function
+from generation import generation_cache, generation_key, SQLiteGenerationStore, batch_limiter
+import ratelimit
+from ratelimit import rate_limiter, RateLimitPolicy, MemoryBucketStore, SQLiteBucketStore, parse_policy
+import llm
+from llm import get_llm_client, RecipeProvider, OpenAIRecipeClient, OpenAICompatibleRecipeClient, TemplateRecipeProvider, GenerateRecipeRequest
 
 # Create a temporary database file
 db_fd, db_path = tempfile.mkstemp(suffix=".db")
@@ -132,4 +143,374 @@ def test_generate_recipe_unauthorized():
     """
     response = client.post("/generate-recipe", json={"question": "Create a recipe for a chocolate cake", "ingredients": ["chocolate", "flour", "sugar"], "dietary_restrictions": []})
     assert response.status_code == 401
-    assert response.json() == {"detail": "Not authenticated"}
\ No newline at end of file
+    assert response.json() == {"detail": "Not authenticated"}
+
+class StubLLM:
+    """
+    Stand-in for the OpenAI client that counts upstream calls.
+    """
+    model = "stub"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def generate(self, request):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"title": "Stub cake", "content": request.question, "ingredients": ["flour"], "userGenerated": False, "cuisine": "Unknown"}
+
+@pytest.fixture
+def stub_llm():
+    stub = StubLLM()
+    app.dependency_overrides[get_llm_client] = lambda: stub
+    app.dependency_overrides[get_current_user] = lambda: UserPrincipal(UserID="stub-user", Role=True, Name="Stub", Email="stub@example.com")
+    generation_cache.store.clear()
+    rate_limiter.store.clear()
+    yield stub
+    app.dependency_overrides.pop(get_llm_client)
+    app.dependency_overrides.pop(get_current_user)
+
+def test_generation_key_normalizes():
+    key = generation_key("Chocolate cake?", ["Flour", "sugar"], ["Vegan"])
+    assert generation_key("  chocolate   CAKE ", ["SUGAR", "flour", "flour"], ["vegan "]) == key
+    assert generation_key("Chocolate cake?", ["Flour"], ["Vegan"]) != key
+    assert generation_key("Chocolate cake?", ["Flour", "sugar"], ["Vegan"], model="other") != key
+
+def test_generate_recipe_cached(stub_llm):
+    body = {"question": "Chocolate cake", "ingredients": ["flour", "sugar"], "dietary_restrictions": ["vegan"]}
+    first = client.post("/generate-recipe", json=body)
+    assert first.status_code == 201
+    assert first.json()["title"] == "Stub cake"
+
+    same = {"question": "chocolate cake?", "ingredients": ["Sugar", "Flour"], "dietary_restrictions": ["Vegan"]}
+    second = client.post("/generate-recipe", json=same)
+    assert second.status_code == 201
+    assert second.json() == first.json()
+    assert stub_llm.calls == 1
+
+    client.post("/generate-recipe", json={**body, "ingredients": ["flour"]})
+    assert stub_llm.calls == 2
+
+def test_generate_recipe_coalesces_concurrent_requests(stub_llm):
+    stub_llm.delay = 0.2
+    body = {"question": "Chocolate cake", "ingredients": ["flour", "sugar"], "dietary_restrictions": []}
+    coalesced = generation_cache.coalesced
+
+    async def generate_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(*(async_client.post("/generate-recipe", json=body) for _ in range(10)))
+
+    responses = asyncio.run(generate_all())
+    assert all(response.status_code == 201 for response in responses)
+    assert stub_llm.calls == 1
+    assert generation_cache.coalesced - coalesced == 9
+
+def test_sqlite_generation_store(tmp_path):
+    store = SQLiteGenerationStore(str(tmp_path / "cache.db"), maxsize=2, ttl=60)
+    store.set("a", {"title": "A"})
+    store.set("b", {"title": "B"})
+    assert store.get("a") == {"title": "A"}
+    # "b" is now the least recently used entry and gets evicted
+    store.set("c", {"title": "C"})
+    assert store.get("b") is None
+    assert store.get("c") == {"title": "C"}
+    assert store.stats() == {"hits": 2, "misses": 1, "size": 2}
+
+    expired = SQLiteGenerationStore(str(tmp_path / "cache.db"), maxsize=2, ttl=0)
+    expired.set("d", {"title": "D"})
+    assert expired.get("d") is None
+    store.engine.dispose()
+    expired.engine.dispose()
+
+def completion(content):
+    # Minimal OpenAI chat completion body
+    return {
+        "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    }
+
+RECIPE = {"title": "Cake", "content": "Bake.", "ingredients": ["flour"], "userGenerated": False, "cuisine": "French"}
+CAKE = GenerateRecipeRequest(question="cake", ingredients=["flour"], dietary_restrictions=[])
+
+def test_llm_client_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_RETRY_BASE_DELAY", 0.001)
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        if len(attempts) < 3:
+            return httpx.Response(503, json={"error": {"message": "overloaded"}})
+        return httpx.Response(200, json=completion(json.dumps(RECIPE)))
+
+    client = OpenAIRecipeClient(api_key="test", base_url="http://llm.test/v1", max_retries=3, transport=httpx.MockTransport(handler))
+    assert asyncio.run(client.generate(CAKE)) == RECIPE
+    assert len(attempts) == 3
+
+    attempts.clear()
+    client = OpenAIRecipeClient(api_key="test", base_url="http://llm.test/v1", max_retries=1, transport=httpx.MockTransport(
+        lambda request: attempts.append(request) or httpx.Response(500, json={"error": {"message": "down"}})
+    ))
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(client.generate(CAKE))
+    assert error.value.status_code == 502
+    assert len(attempts) == 2
+
+def test_llm_client_bounds_concurrency():
+    running, peak = 0, 0
+
+    async def handler(request):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return httpx.Response(200, json=completion(json.dumps(RECIPE)))
+
+    client = OpenAIRecipeClient(api_key="test", base_url="http://llm.test/v1", max_concurrency=4, transport=httpx.MockTransport(handler))
+
+    async def generate_all():
+        results = await asyncio.gather(*(client.generate(GenerateRecipeRequest(question=f"cake {i}", ingredients=[], dietary_restrictions=[])) for i in range(20)))
+        await client.close()
+        return results
+
+    assert len(asyncio.run(generate_all())) == 20
+    assert peak == 4
+
+def test_llm_client_closes_the_client_of_a_previous_loop():
+    client = OpenAIRecipeClient(api_key="test", base_url="http://llm.test/v1", transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, json=completion(json.dumps(RECIPE)))
+    ))
+    assert asyncio.run(client.generate(CAKE)) == RECIPE
+    first = client._client
+
+    # A new event loop gets a new client and the old one is closed
+    assert asyncio.run(client.generate(CAKE)) == RECIPE
+    assert client._client is not first
+    assert first.is_closed()
+    assert not client._client.is_closed()
+
+    asyncio.run(client.close())
+    assert client._client is None
+
+def test_llm_client_closes_a_previous_client_on_its_running_loop():
+    client = OpenAIRecipeClient(api_key="test", base_url="http://llm.test/v1", transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, json=completion(json.dumps(RECIPE)))
+    ))
+    # First used from a loop that keeps running in another thread
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        assert asyncio.run_coroutine_threadsafe(client.generate(CAKE), other_loop).result(5) == RECIPE
+        first = client._client
+
+        assert asyncio.run(client.generate(CAKE)) == RECIPE
+        assert first.is_closed()
+        asyncio.run(client.close())
+    finally:
+        other_loop.call_soon_threadsafe(other_loop.stop)
+        thread.join(5)
+        other_loop.close()
+
+def streamed_completion(content, pieces=4):
+    # OpenAI streaming body: the content split over several chunks, then [DONE]
+    size = -(-len(content) // pieces)
+    chunks = [{"role": "assistant", "content": content[i:i + size]} for i in range(0, len(content), size)]
+    events = [
+        {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        for delta in chunks
+    ]
+    events.append({"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o",
+                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+    body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body)
+
+def read_events(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def test_generate_recipe_stream(stub_llm):
+    content = json.dumps(RECIPE)
+    llm_client = OpenAIRecipeClient(
+        api_key="test", base_url="http://llm.test/v1",
+        transport=httpx.MockTransport(lambda request: streamed_completion(content))
+    )
+    app.dependency_overrides[get_llm_client] = lambda: llm_client
+    body = {"question": "Cake", "ingredients": ["flour"], "dietary_restrictions": []}
+
+    response = client.post("/generate-recipe/stream", json=body)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = read_events(response)
+    deltas = [data["content"] for event, data in events if event == "delta"]
+    assert len(deltas) == 4
+    assert "".join(deltas) == content
+    assert events[-1] == ("recipe", RECIPE)
+
+    # The validated recipe is cached for both endpoints
+    assert read_events(client.post("/generate-recipe/stream", json=body)) == [("recipe", RECIPE)]
+    assert client.post("/generate-recipe", json=body).json() == RECIPE
+
+def test_generate_recipe_stream_invalid_recipe(stub_llm):
+    llm_client = OpenAIRecipeClient(
+        api_key="test", base_url="http://llm.test/v1",
+        transport=httpx.MockTransport(lambda request: streamed_completion('{"title": "Cake"}'))
+    )
+    app.dependency_overrides[get_llm_client] = lambda: llm_client
+    response = client.post("/generate-recipe/stream", json={"question": "Cake", "ingredients": [], "dietary_restrictions": []})
+    events = read_events(response)
+    assert events[-1] == ("error", {"status": 500, "detail": "Failed to parse recipe data from OpenAI response."})
+
+def test_openai_compatible_client():
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json=completion(json.dumps(RECIPE)))
+
+    client = OpenAICompatibleRecipeClient(model="local-model", base_url="http://localhost:8000/v1", transport=httpx.MockTransport(handler))
+    assert asyncio.run(client.generate(CAKE)) == RECIPE
+    # Plain JSON mode, with the expected shape spelled out in the prompt
+    assert requests[0]["model"] == "local-model"
+    assert requests[0]["response_format"] == {"type": "json_object"}
+    assert '"ingredients"' in requests[0]["messages"][0]["content"]
+
+def test_template_provider(stub_llm):
+    # The interface itself cannot be used as a provider
+    with pytest.raises(TypeError):
+        RecipeProvider()
+    provider = TemplateRecipeProvider()
+    request = GenerateRecipeRequest(question="An Italian dinner", ingredients=["Tomato", "basil", "Tomato"], dietary_restrictions=["vegan"])
+    recipe = asyncio.run(provider.generate(request))
+    assert recipe == asyncio.run(provider.generate(request))
+    assert recipe["cuisine"] == "Italian"
+    assert recipe["ingredients"] == ["Tomato", "basil"]
+    assert "vegan" in recipe["content"]
+
+    async def collect():
+        return "".join([chunk async for chunk in provider.stream(request)])
+    assert json.loads(asyncio.run(collect())) == recipe
+
+    # The whole endpoint runs offline
+    app.dependency_overrides[get_llm_client] = lambda: provider
+    response = client.post("/generate-recipe", json=request.model_dump())
+    assert response.status_code == 201
+    assert response.json() == recipe
+
+def test_generate_recipes_batch(stub_llm, monkeypatch):
+    running, peak = 0, 0
+    stub_generate = stub_llm.generate
+
+    async def generate(request):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            if request.question == "fail":
+                raise HTTPException(status_code=502, detail="Recipe generation failed, try again later.")
+            return await stub_generate(request)
+        finally:
+            running -= 1
+
+    stub_llm.delay = 0.2
+    monkeypatch.setattr(stub_llm, "generate", generate)
+    monkeypatch.setattr(batch_limiter, "limit", 2)
+    requests = [
+        {"question": "Cake", "ingredients": ["flour", "sugar"], "dietary_restrictions": []},
+        {"question": "cake", "ingredients": ["Sugar", "Flour"], "dietary_restrictions": []},
+        {"question": "Soup", "ingredients": ["leek"], "dietary_restrictions": []},
+        {"question": "Salad", "ingredients": ["lettuce"], "dietary_restrictions": []},
+        {"question": "", "ingredients": [], "dietary_restrictions": []},
+        {"question": "fail", "ingredients": [], "dietary_restrictions": []},
+    ]
+    start = time.perf_counter()
+    response = client.post("/generate-recipes/batch", json={"requests": requests})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200
+    results = response.json()["results"]
+
+    assert [result["index"] for result in results] == list(range(6))
+    assert [result["status"] for result in results] == [201, 201, 201, 201, 400, 502]
+    assert results[0]["recipe"] == results[1]["recipe"]
+    assert results[2]["recipe"]["content"] == "Soup"
+    assert results[4]["error"] == "Prompt is required."
+    # The duplicate cake is generated once, at most two calls run at a time
+    assert stub_llm.calls == 3
+    assert peak == 2
+    assert elapsed < 3 * 0.2
+
+    response = client.post("/generate-recipes/batch", json={"requests": [requests[0]] * 21})
+    assert response.status_code == 422
+
+def test_parse_policy():
+    policy = parse_policy("generation", "10/minute")
+    assert (policy.limit, policy.period, policy.rate) == (10, 60, 10 / 60)
+    assert policy.key("u1") == "generation:u1"
+    assert parse_policy("generation-global", "5/second", per_user=False).key("u1") == "generation-global:*"
+    assert parse_policy("generation", "0") is None
+    with pytest.raises(ValueError):
+        parse_policy("generation", "10/fortnight")
+
+@pytest.mark.parametrize("store_type", ["memory", "sqlite"])
+def test_bucket_store_take(store_type, tmp_path):
+    store = MemoryBucketStore() if store_type == "memory" else SQLiteBucketStore(str(tmp_path / "buckets.db"))
+    # A bucket of 3 tokens refilling one token per second
+    assert [store.take("k", 3, 1, 1, 1)[0] for _ in range(4)] == [True, True, True, False]
+    allowed, tokens = store.take("k", 3, 1, 1, 1)
+    assert not allowed and tokens < 1
+    # Charges may overdraw the bucket, later takes wait until it refills
+    assert store.take("other", 3, 1, 10, 0) == (True, -7)
+    assert not store.take("other", 3, 1, 0, 1)[0]
+    time.sleep(1.1)
+    assert store.take("k", 3, 1, 1, 1)[0]
+
+def test_sqlite_bucket_store_is_shared(tmp_path):
+    # Two workers with their own store see the same buckets
+    path = str(tmp_path / "buckets.db")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take("k", 2, 0.001, 1, 1)[0]
+    assert second.take("k", 2, 0.001, 1, 1)[0]
+    assert not first.take("k", 2, 0.001, 1, 1)[0]
+
+def test_generate_recipe_rate_limited(stub_llm, monkeypatch):
+    monkeypatch.setattr(ratelimit.generation_rate_limit, "policies", (RateLimitPolicy("generation", 2, 60),))
+    bodies = [{"question": f"Cake {i}", "ingredients": [], "dietary_restrictions": []} for i in range(3)]
+    assert client.post("/generate-recipe", json=bodies[0]).status_code == 201
+    assert client.post("/generate-recipe", json=bodies[1]).status_code == 201
+    limited = client.post("/generate-recipe", json=bodies[2])
+    assert limited.status_code == 429
+    assert client.post("/generate-recipe/stream", json=bodies[2]).status_code == 429
+    # One token refills every 30 seconds
+    assert 1 <= int(limited.headers["retry-after"]) <= 30
+    assert stub_llm.calls == 2
+
+def test_batch_counts_every_item(stub_llm, monkeypatch):
+    monkeypatch.setattr(ratelimit, "generation_user_policy", RateLimitPolicy("generation", 3, 60))
+    monkeypatch.setattr("routers.recipes.generation_user_policy", ratelimit.generation_user_policy)
+    requests = [{"question": f"Cake {i}", "ingredients": [], "dietary_restrictions": []} for i in range(4)]
+    response = client.post("/generate-recipes/batch", json={"requests": requests})
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+    assert stub_llm.calls == 0
+
+def test_llm_token_budget(stub_llm, monkeypatch):
+    policy = RateLimitPolicy("llm-tokens", 100, 86400)
+    monkeypatch.setattr(ratelimit, "llm_token_policy", policy)
+    monkeypatch.setattr("routers.recipes.llm_token_policy", policy)
+    body = {"question": "Budget cake", "ingredients": ["flour"], "dietary_restrictions": []}
+    assert client.post("/generate-recipe", json=body).status_code == 201
+    usage = client.get("/generate-recipe/usage").json()
+    # The prompt alone is worth more than 100 tokens, the budget is spent
+    assert usage["token_budget"] == 100
+    assert usage["tokens_remaining"] == 0
+    # A cached recipe costs nothing, but a spent budget blocks every generation
+    response = client.post("/generate-recipe", json=body)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+    assert stub_llm.calls == 1
@@ -1,10 +1,11 @@
+import json
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from main import app
 from database import Base, get_db
-from models import User, Recipe, Ingredient
+from models import User, Recipe, Ingredient, Allergy, IngredientCatalog
 from routers.auth import get_password_hash  # Import your password hashing function
 
 # Create a new database URL for testing
@@ -241,4 +242,212 @@ def test_delete_recipe(create_test_user):
     assert response.status_code == 200
 
     response = client.get(f"/recipes/{recipe.RecipeID}", headers=headers)
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+def test_read_all_recipes_paginated(create_test_user):
+    """
+    Test paging through all recipes with a cursor.
+    """
+    db = TestingSessionLocal()
+    created_ids = set()
+    for i in range(5):
+        recipe = Recipe(
+            RecipeName=f"Paged Recipe {i}",
+            UserID=create_test_user.UserID,
+            RecipeContent="Test Content",
+            Cuisine="random",
+            Visibility=True
+        )
+        db.add(recipe)
+        db.commit()
+        created_ids.add(recipe.RecipeID)
+    db.close()
+
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    seen_ids = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/recipesall", params=params, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data) <= 2
+        seen_ids.extend(recipe["RecipeID"] for recipe in data)
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        params = {"limit": 2, "cursor": next_cursor}
+
+    assert len(seen_ids) == len(set(seen_ids))
+    assert created_ids <= set(seen_ids)
+
+    response = client.get("/recipesall", params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+def test_read_all_recipes_streamed(create_test_user):
+    """
+    Test exporting all recipes as a streamed NDJSON listing.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    db = TestingSessionLocal()
+    recipe_count = db.query(Recipe).count()
+    db.close()
+
+    response = client.get("/recipesall", params={"stream": 1}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == recipe_count
+    assert {"RecipeID", "UserID", "RecipeName", "RecipeContent", "Cuisine", "Visibility"} <= set(lines[0])
+
+    response = client.get("/recipesall", headers={**headers, "Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == recipe_count
+
+def test_create_recipe_dedupes_ingredients(create_test_user):
+    """
+    Test that repeated ingredients are stored once, in the same transaction as the recipe.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    body = {"title": "Dup Recipe", "content": "Test Content", "ingredients": ["egg", "milk", " egg", "", "milk"], "cuisine": "random", "userGenerated": False}
+    response = client.post("/recipes", json=body, headers=headers)
+    assert response.status_code == 201
+    recipe_id = response.json()["id"]
+
+    db = TestingSessionLocal()
+    names = [ingredient.IngredientName for ingredient in db.query(Ingredient).filter_by(RecipeID=recipe_id)]
+    recipe = db.query(Recipe).filter_by(RecipeID=recipe_id).first()
+    db.close()
+    assert sorted(names) == ["egg", "milk"]
+    assert recipe.UserID == create_test_user.UserID
+    assert recipe.CreatedAt is not None
+
+def test_import_recipes(create_test_user):
+    """
+    Test bulk importing recipes in one request.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    recipes = [
+        {"title": f"Imported {i}", "content": "Test Content", "ingredients": ["flour", "water", "flour"], "cuisine": "random", "userGenerated": True}
+        for i in range(1500)
+    ]
+    response = client.post("/recipes/import", json={"recipes": recipes}, headers=headers)
+    assert response.status_code == 201
+    data = response.json()
+    assert data["imported"] == 1500
+    assert len(set(data["ids"])) == 1500
+
+    db = TestingSessionLocal()
+    imported = db.query(Recipe).filter(Recipe.RecipeID.in_(data["ids"][:10])).all()
+    ingredient_count = db.query(Ingredient).filter(Ingredient.RecipeID.in_(data["ids"])).count()
+    db.close()
+    assert sorted(recipe.RecipeName for recipe in imported) == sorted(f"Imported {i}" for i in range(10))
+    assert ingredient_count == 3000
+
+    response = client.post("/recipes/import", json={"recipes": []}, headers=headers)
+    assert response.status_code == 422
+
+def test_allergens_and_search_use_catalog(create_test_user):
+    """
+    Test that allergen checks and ingredient search match ingredients through the catalog.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    body = {"title": "Peanut Noodles", "content": "Toss.", "ingredients": ["Peanuts", "Noodles", "Green  Onions"], "cuisine": "Thai", "userGenerated": True}
+    recipe_id = client.post("/recipes", json=body, headers=headers).json()["id"]
+
+    db = TestingSessionLocal()
+    db.add(Allergy(UserID=create_test_user.UserID, IngredientName="peanut"))
+    db.commit()
+    catalog_names = {entry.Name for entry in db.query(IngredientCatalog)}
+    db.close()
+    assert {"peanut", "noodle", "green onion"} <= catalog_names
+
+    response = client.get(f"/check_allergens/{recipe_id}", headers=headers)
+    assert response.json() == {"result": 0}
+
+    response = client.get("/recipes/search", params={"ingredient": ["green onion", "NOODLE"]}, headers=headers)
+    assert response.status_code == 200
+    assert [recipe["RecipeID"] for recipe in response.json()] == [recipe_id]
+    response = client.get("/recipes/search", params={"ingredient": ["noodles", "saffron"]}, headers=headers)
+    assert response.json() == []
+
+def test_check_allergens_bulk(create_test_user):
+    """
+    Test checking many recipes against the user's allergens in one request.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    db = TestingSessionLocal()
+    db.add(Allergy(UserID=create_test_user.UserID, IngredientName="Shellfish"))
+    db.commit()
+    db.close()
+
+    recipes = [
+        {"title": f"Bulk {i}", "content": "Cook.", "ingredients": ["rice", "shellfish" if i % 3 == 0 else "leek"], "cuisine": "random", "userGenerated": True}
+        for i in range(300)
+    ]
+    ids = client.post("/recipes/import", json={"recipes": recipes}, headers=headers).json()["ids"]
+
+    response = client.post("/check_allergens", json={"recipe_ids": ids + ["missing"]}, headers=headers)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert "missing" not in results
+    assert [results[recipe_id] for recipe_id in ids] == [0 if i % 3 == 0 else 1 for i in range(300)]
+    assert client.get(f"/check_allergens/{ids[1]}", headers=headers).json() == {"result": 1}
@@ -1,6 +1,7 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 from main import app
@@ -332,3 +333,86 @@ def test_save_shopping_list(create_test_user):
     shopping_list_text = data["shopping_list"]
     assert isinstance(shopping_list_text, str)
     assert shopping_list_text == "Milk\nEggs\nBread"
+
+def test_shopping_list_dedupes_by_catalog(create_test_user):
+    """
+    Test that spellings of the same ingredient are one shopping list item.
+    """
+    db = TestingSessionLocal()
+    db.add(ShoppingListItem(UserID=create_test_user.UserID, IngredientName="egg"))
+    db.commit()
+    db.close()
+
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    token = response.json()["access_token"]
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+    response = client.post(
+        "/shopping_list",
+        data={"shopping_list": "Eggs\nTomatoes\ntomato\nMilk"},
+        headers=headers
+    )
+    assert response.status_code == 200
+
+    response = client.get("/shopping_list", headers=headers)
+    assert response.json()["shopping_list"] == ["egg", "Tomatoes", "Milk"]
+
+    response = client.delete("/delete_ingredient/TOMATO", headers=headers)
+    assert response.status_code == 200
+    response = client.get("/shopping_list", headers=headers)
+    assert response.json()["shopping_list"] == ["egg", "Milk"]
+
+def test_shopping_list_conditional_get(create_test_user):
+    """
+    Test that polling an unchanged shopping list with its ETag gets an empty
+    304 with fewer queries, and that a change gives a new ETag.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    client.post(
+        "/shopping_list",
+        data={"shopping_list": "\n".join(f"Item {i}" for i in range(50))},
+        headers={**headers, "Content-Type": "application/x-www-form-urlencoded"}
+    )
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    # Other test modules may have replaced the get_db override, count on every engine
+    event.listen(Engine, "before_cursor_execute", count_statement)
+    try:
+        full = client.get("/shopping_list", headers=headers)
+        full_queries = len(statements)
+        statements.clear()
+        polled = client.get("/shopping_list", headers={**headers, "If-None-Match": full.headers["ETag"]})
+        polled_queries = len(statements)
+    finally:
+        event.remove(Engine, "before_cursor_execute", count_statement)
+    assert full.status_code == 200
+    assert polled.status_code == 304
+    assert polled.headers["ETag"] == full.headers["ETag"]
+    assert len(polled.content) == 0 < len(full.content)
+    assert polled_queries < full_queries
+
+    client.delete("/delete_ingredient/Item 3", headers=headers)
+    response = client.get("/shopping_list", headers={**headers, "If-None-Match": full.headers["ETag"]})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != full.headers["ETag"]
+    assert len(response.json()["shopping_list"]) == 49
@@ -1,11 +1,20 @@
+import asyncio
+import json
+from datetime import timedelta
+import httpx
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from main import app
-from database import Base, get_db
-from models import User, Recipe, Ingredient, SocialMedia, Bookmark, Comment, Allergy
-from routers.auth import get_password_hash  # Import your password hashing function
+from database import Base, get_db, get_async_db
+from models import User, Recipe, Ingredient, SocialMedia, Bookmark, Comment, Allergy, PostLike
+from routers.auth import get_password_hash, create_access_token  # Import your password hashing function
+from like_counter import ShardedCounter, flush_likes
+from payloads import recipe_fragments
+from feed_events import feed_broker
 
 # Create a new database URL for testing
 TEST_DATABASE_URL = "sqlite:///./test.db"
@@ -18,6 +27,15 @@ TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine
 )
 
+# The async routers use the same test database through aiosqlite. TestClient
+# runs each request on a fresh event loop, so connections are not pooled.
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test.db", poolclass=NullPool
+)
+TestingAsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
 # Override the get_db dependency to use the test database
 def override_get_db():
     try:
@@ -26,8 +44,13 @@ def override_get_db():
     finally:
         db.close()
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 # Apply the dependency override
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 client = TestClient(app)
 
@@ -315,3 +338,481 @@ def test_add_comment(create_test_user):
     assert comments[0]["CommentText"] == comment_text
     assert comments[0]["UserID"] == user_id
     assert comments[0]["UserName"] == "Test User"  # Name from `create_test_user`
+
+def test_get_posts_filters_allergens(create_test_user):
+    """
+    Test that the feed hides posts containing the user's allergens and
+    uses the same number of queries regardless of how many posts exist.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # Create a post containing an allergen
+    response = client.post(
+        "/recipes",
+        json={
+            "title": "Peanut Recipe",
+            "content": "Test Content",
+            "ingredients": ["peanut", "sugar"],
+            "userGenerated": False,
+            "cuisine": "Unknown"
+        },
+        headers=headers
+    )
+    assert response.status_code == 201
+    peanut_recipe_id = response.json()["id"]
+    response = client.post("/add_post", json={"recipe_id": peanut_recipe_id}, headers=headers)
+    assert response.status_code == 200
+    peanut_smid = response.json()["SMID"]
+
+    response = client.post("/allergies", params={"ingredient": "peanut"}, headers=headers)
+    assert response.status_code == 201
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get("/posts", headers=headers)
+        assert response.status_code == 200
+        posts = response.json()["posts"]
+        assert peanut_smid not in [post["SMID"] for post in posts]
+        assert len(posts) > 0
+        queries_before = len(statements)
+
+        # Add more posts and check the query count does not grow
+        for _ in range(3):
+            response = client.post(
+                "/recipes",
+                json={
+                    "title": "Extra Recipe",
+                    "content": "Test Content",
+                    "ingredients": ["flour"],
+                    "userGenerated": False,
+                    "cuisine": "Unknown"
+                },
+                headers=headers
+            )
+            client.post("/add_post", json={"recipe_id": response.json()["id"]}, headers=headers)
+
+        statements.clear()
+        response = client.get("/posts", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()["posts"]) == len(posts) + 3
+        assert len(statements) == queries_before
+
+        # Newest posts all filtered out: a page still costs the same queries
+        for _ in range(5):
+            response = client.post(
+                "/recipes",
+                json={
+                    "title": "Peanut Recipe",
+                    "content": "Test Content",
+                    "ingredients": ["peanut"],
+                    "userGenerated": False,
+                    "cuisine": "Unknown"
+                },
+                headers=headers
+            )
+            response = client.post("/add_post", json={"recipe_id": response.json()["id"]}, headers=headers)
+            assert response.status_code == 200
+        statements.clear()
+        response = client.get("/posts", params={"limit": 1}, headers=headers)
+        assert response.status_code == 200
+        assert [post["Recipe"]["RecipeName"] for post in response.json()["posts"]] == ["Extra Recipe"]
+        assert len(statements) == queries_before
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+def test_get_posts_paginated(create_test_user):
+    """
+    Test paging through the feed with a cursor.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/posts", params={"limit": 200}, headers=headers)
+    assert response.status_code == 200
+    all_smids = [post["SMID"] for post in response.json()["posts"]]
+    assert response.json()["next_cursor"] is None
+    assert len(all_smids) > 2
+
+    paged_smids = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/posts", params=params, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["posts"]) <= 2
+        paged_smids.extend(post["SMID"] for post in data["posts"])
+        if not data["next_cursor"]:
+            break
+        params = {"limit": 2, "cursor": data["next_cursor"]}
+
+    assert paged_smids == all_smids
+
+def test_like_post_concurrent_likers(create_test_user):
+    """
+    Test that 200 users liking the same post at once lose no increments,
+    and that a user cannot like a post twice.
+    """
+    db = TestingSessionLocal()
+    recipe = Recipe(
+        RecipeName="Viral Recipe",
+        UserID=create_test_user.UserID,
+        RecipeContent="Test Content",
+        Cuisine="Unknown",
+        Visibility=True
+    )
+    db.add(recipe)
+    db.flush()
+    post = SocialMedia(RecipeID=recipe.RecipeID, UserID=create_test_user.UserID)
+    likers = [
+        User(Email=f"liker{i}@example.com", Password="x", Role=True, Name=f"Liker {i}")
+        for i in range(200)
+    ]
+    db.add(post)
+    db.add_all(likers)
+    db.commit()
+    smid = post.SMID
+    tokens = [create_access_token({"sub": liker.UserID}, timedelta(minutes=5)) for liker in likers]
+    db.close()
+
+    async def like_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(*(
+                async_client.post(f"/like_post/{smid}", headers={"Authorization": f"Bearer {token}"})
+                for token in tokens
+            ))
+
+    responses = asyncio.run(like_all())
+    assert all(response.status_code == 200 for response in responses)
+    assert sorted(response.json()["Likes"] for response in responses) == list(range(1, 201))
+
+    headers = {"Authorization": f"Bearer {tokens[0]}"}
+    response = client.post(f"/like_post/{smid}", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"message": "Post already liked", "Likes": 200}
+
+    response = client.post("/unlike_post", json={"smid": smid}, headers=headers)
+    assert response.json()["message"] == "Post unliked successfully"
+    response = client.post("/unlike_post", json={"smid": smid}, headers=headers)
+    assert response.json()["message"] == "Cannot unlike, post is not liked"
+
+    db = TestingSessionLocal()
+    assert db.query(SocialMedia).filter_by(SMID=smid).one().Likes == 199
+    assert db.query(PostLike).filter_by(SMID=smid).count() == 199
+    db.close()
+
+def test_sharded_like_counter_flush(create_test_user):
+    """
+    Test that batched like deltas are written in one flush.
+    """
+    db = TestingSessionLocal()
+    recipe = Recipe(
+        RecipeName="Batched Recipe",
+        UserID=create_test_user.UserID,
+        RecipeContent="Test Content",
+        Cuisine="Unknown",
+        Visibility=True
+    )
+    db.add(recipe)
+    db.flush()
+    posts = [SocialMedia(RecipeID=recipe.RecipeID, UserID=create_test_user.UserID, Likes=5) for _ in range(2)]
+    db.add_all(posts)
+    db.commit()
+    smids = [post.SMID for post in posts]
+    db.close()
+
+    counter = ShardedCounter(shards=4)
+    for _ in range(3):
+        counter.add(smids[0])
+    counter.add(smids[1], 2)
+    counter.add(smids[1], -1)
+    assert counter.pending(smids[0]) == 3
+
+    assert asyncio.run(flush_likes(async_engine, counter)) == 2
+    assert counter.pending(smids[0]) == 0
+    assert asyncio.run(flush_likes(async_engine, counter)) == 0
+
+    db = TestingSessionLocal()
+    assert [db.get(SocialMedia, smid).Likes for smid in smids] == [8, 6]
+    db.close()
+
+def test_feed_entries_follow_writes(create_test_user):
+    """
+    Test that posting, liking, commenting, editing and deleting a recipe
+    keep its feed entry in step with the source tables.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = client.post(
+        "/recipes",
+        json={
+            "title": "Feed Recipe",
+            "content": "Test Content",
+            "ingredients": ["oats"],
+            "userGenerated": False,
+            "cuisine": "Unknown"
+        },
+        headers=headers
+    )
+    recipe_id = response.json()["id"]
+    smid = client.post("/add_post", json={"recipe_id": recipe_id}, headers=headers).json()["SMID"]
+    assert client.post(f"/like_post/{smid}", headers=headers).status_code == 200
+    assert client.post("/add_comment", json={"smid": smid, "comment_text": "Tasty"}, headers=headers).status_code == 200
+    response = client.put(f"/recipes/{recipe_id}", json={"title": "Renamed Recipe", "content": "New Content"}, headers=headers)
+    assert response.status_code == 200
+
+    post = client.get("/posts", headers=headers).json()["posts"][0]
+    assert post["SMID"] == smid
+    assert (post["Likes"], post["Comments"]) == (1, 1)
+    assert post["Recipe"]["RecipeName"] == "Renamed Recipe"
+    assert post["Recipe"]["RecipeContent"] == "New Content"
+
+    assert client.delete(f"/recipes/{recipe_id}", headers=headers).status_code == 200
+    smids = [post["SMID"] for post in client.get("/posts", params={"limit": 200}, headers=headers).json()["posts"]]
+    assert smid not in smids
+
+def test_recipe_payload_cache_follows_version(create_test_user):
+    """
+    Test that post and bookmark responses reuse cached recipe fragments
+    and stop serving them once the recipe is edited.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = client.post(
+        "/recipes",
+        json={
+            "title": "Cached Recipe",
+            "content": "Test Content",
+            "ingredients": ["rice"],
+            "userGenerated": False,
+            "cuisine": "Unknown"
+        },
+        headers=headers
+    )
+    recipe_id = response.json()["id"]
+    smid = client.post("/add_post", json={"recipe_id": recipe_id}, headers=headers).json()["SMID"]
+    client.post("/add_bookmark", json={"recipe_id": recipe_id}, headers=headers)
+
+    recipe_fragments.clear()
+    hits = recipe_fragments.hits
+    for _ in range(2):
+        response = client.get(f"/posts/{smid}", headers=headers)
+        assert response.json()["post"]["Recipe"]["RecipeName"] == "Cached Recipe"
+    assert recipe_fragments.hits == hits + 1
+
+    client.put(f"/recipes/{recipe_id}", json={"title": "Edited Recipe", "content": "Test Content"}, headers=headers)
+    assert client.get(f"/posts/{smid}", headers=headers).json()["post"]["Recipe"]["RecipeName"] == "Edited Recipe"
+    bookmarks = client.get("/bookmarks", params={"limit": 200}, headers=headers).json()["bookmarks"]
+    assert [bookmark["Recipe"]["RecipeName"] for bookmark in bookmarks if bookmark["SMID"] == smid] == ["Edited Recipe"]
+
+def test_conditional_get_on_polled_endpoints(create_test_user):
+    """
+    Test that repeated polls of /posts, /bookmarks and /comments/{smid}
+    with their ETags get empty 304s with fewer queries, and that likes,
+    comments and bookmarks change the ETags they affect.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    assert response.status_code == 200
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.post(
+        "/recipes",
+        json={
+            "title": "Polled Recipe",
+            "content": "Test Content",
+            "ingredients": ["corn"],
+            "userGenerated": False,
+            "cuisine": "Unknown"
+        },
+        headers=headers
+    )
+    recipe_id = response.json()["id"]
+    smid = client.post("/add_post", json={"recipe_id": recipe_id}, headers=headers).json()["SMID"]
+    client.post("/add_comment", json={"smid": smid, "comment_text": "First"}, headers=headers)
+    client.post("/add_bookmark", json={"recipe_id": recipe_id}, headers=headers)
+
+    statements = []
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    urls = ["/posts", "/bookmarks", f"/comments/{smid}"]
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        etags, saved_bytes = {}, 0
+        for url in urls:
+            statements.clear()
+            full = client.get(url, headers=headers)
+            full_queries = len(statements)
+            statements.clear()
+            polled = client.get(url, headers={**headers, "If-None-Match": full.headers["ETag"]})
+            assert full.status_code == 200, url
+            assert polled.status_code == 304, url
+            assert polled.content == b""
+            assert len(statements) < full_queries, url
+            etags[url] = full.headers["ETag"]
+            saved_bytes += len(full.content)
+        assert saved_bytes > 0
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", count_statement)
+
+    def status(url):
+        return client.get(url, headers={**headers, "If-None-Match": etags[url]}).status_code
+
+    client.post(f"/like_post/{smid}", headers=headers)
+    assert [status(url) for url in urls] == [200, 304, 304]
+    client.post("/add_comment", json={"smid": smid, "comment_text": "Second"}, headers=headers)
+    assert status(f"/comments/{smid}") == 200
+    response = client.post(
+        "/recipes",
+        json={"title": "Another", "content": "Test Content", "ingredients": ["corn"], "userGenerated": False, "cuisine": "Unknown"},
+        headers=headers
+    )
+    client.post("/add_bookmark", json={"recipe_id": response.json()["id"]}, headers=headers)
+    assert status("/bookmarks") == 200
+
+def test_feed_events_stream(create_test_user):
+    """
+    Test that a connected client receives post, like and comment deltas
+    over the Server-Sent Events stream as they are committed.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = client.post(
+        "/recipes",
+        json={"title": "Pushed Recipe", "content": "Test Content", "ingredients": ["corn"], "userGenerated": False, "cuisine": "Unknown"},
+        headers=headers
+    )
+    recipe_id = response.json()["id"]
+
+    async def listen():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            stream = asyncio.create_task(async_client.get("/feed/events", headers=headers))
+            while not feed_broker.hub.subscriptions:
+                await asyncio.sleep(0.01)
+            smid = (await async_client.post("/add_post", json={"recipe_id": recipe_id}, headers=headers)).json()["SMID"]
+            await async_client.post(f"/like_post/{smid}", headers=headers)
+            await async_client.post("/add_comment", json={"smid": smid, "comment_text": "Live"}, headers=headers)
+            await async_client.post("/unlike_post", json={"smid": smid}, headers=headers)
+            feed_broker.hub.close_all()
+            return smid, await stream
+
+    smid, response = asyncio.run(listen())
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+    assert not feed_broker.hub.subscriptions
+    events = [
+        (lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: ")))
+        for lines in (block.split("\n") for block in response.text.split("\n\n"))
+        if lines[0].startswith("event: ")
+    ]
+    assert [name for name, _ in events] == ["post", "like", "comment", "like"]
+    assert events[0][1] == {"SMID": smid, "RecipeID": recipe_id}
+    assert events[1][1] == {"SMID": smid, "Likes": 1}
+    assert events[2][1]["SMID"] == smid
+    assert events[3][1] == {"SMID": smid, "Likes": 0}
+
+def test_feed_events_skip_allergens(create_test_user):
+    """
+    Test that a client gets no events about posts of recipes containing one
+    of its user's allergens, as the feed leaves those posts out.
+    """
+    response = client.post(
+        "/login",
+        data={
+            "email": TEST_USER_EMAIL,
+            "password": TEST_USER_PASSWORD
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert client.post("/allergies", params={"ingredient": "sesame"}, headers=headers).status_code == 201
+    recipe_ids = {}
+    for title, ingredient in (("Sesame Buns", "sesame"), ("Corn Bread", "corn")):
+        response = client.post(
+            "/recipes",
+            json={"title": title, "content": "Test Content", "ingredients": [ingredient], "userGenerated": False, "cuisine": "Unknown"},
+            headers=headers
+        )
+        recipe_ids[ingredient] = response.json()["id"]
+
+    async def listen():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            stream = asyncio.create_task(async_client.get("/feed/events", headers=headers))
+            while not feed_broker.hub.subscriptions:
+                await asyncio.sleep(0.01)
+            smids = {}
+            for ingredient, recipe_id in recipe_ids.items():
+                response = await async_client.post("/add_post", json={"recipe_id": recipe_id}, headers=headers)
+                smids[ingredient] = response.json()["SMID"]
+            await async_client.post(f"/like_post/{smids['sesame']}", headers=headers)
+            await async_client.post("/add_comment", json={"smid": smids["sesame"], "comment_text": "Hidden"}, headers=headers)
+            await async_client.post(f"/like_post/{smids['corn']}", headers=headers)
+            feed_broker.hub.close_all()
+            return smids, await stream
+
+    smids, response = asyncio.run(listen())
+    events = [
+        (lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: ")))
+        for lines in (block.split("\n") for block in response.text.split("\n\n"))
+        if lines[0].startswith("event: ")
+    ]
+    assert events == [
+        ("post", {"SMID": smids["corn"], "RecipeID": recipe_ids["corn"]}),
+        ("like", {"SMID": smids["corn"], "Likes": 1}),
+    ]
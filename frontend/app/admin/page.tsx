@@ -7,6 +7,7 @@ import Footer from "../components/Footer";
 import ProtectedRoute from "../components/ProtectedRoute";
 import RecipeList from "../components/RecipeList";
 import DialogBox from "../components/DialogBox";
+import { fetchAllPages } from "../utils/utils";
 
 const AdminPage = () => {
     const [recipes, setRecipes] = useState<any[]>([]);
@@ -23,14 +24,13 @@ const AdminPage = () => {
 
     const fetchRecipes = async (setRecipes: React.Dispatch<React.SetStateAction<any[]>>) => {
         try {
-            const response = await fetch("http://127.0.0.1:5000/recipesall", {
+            const data = await fetchAllPages<any>("http://127.0.0.1:5000/recipesall", {
                 method: "GET",
                 headers: {
                     Authorization: `Bearer ${localStorage.getItem("access_token")}`,
                 },
             });
-            if (response.ok) {
-                const data = await response.json();
+            if (data) {
                 console.log(data);
                 setRecipes(data);
             } else {
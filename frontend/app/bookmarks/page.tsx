@@ -6,6 +6,7 @@ import ProtectedRoute from "../components/ProtectedRoute";
 import { useState, useEffect } from "react";
 import BookmarkPageList from "../components/BookmarkPageList";
 import { Bookmark } from "../types";
+import { fetchAllPages } from "../utils/utils";
 
 export default function Bookmarks() {
   const [bookmarkedRecipes, setBookmarkedRecipes] = useState<Bookmark[]>([]);
@@ -13,17 +14,16 @@ export default function Bookmarks() {
   useEffect(() => {
     const fetchBookmarkedRecipes = async () => {
       try {
-        const response = await fetch("http://127.0.0.1:5000/bookmarks", {
+        const bookmarks = await fetchAllPages<Bookmark>("http://127.0.0.1:5000/bookmarks", {
           method: "GET",
           headers: {
             "Authorization": `Bearer ${localStorage.getItem("access_token")}`,
           },
-        });
+        }, "bookmarks");
 
-        if (response.ok) {
-          const data = await response.json();
-          setBookmarkedRecipes(data.bookmarks);
-          console.log(data)
+        if (bookmarks) {
+          setBookmarkedRecipes(bookmarks);
+          console.log(bookmarks)
         } else {
           console.error("Failed to fetch bookmarked recipes.");
         }
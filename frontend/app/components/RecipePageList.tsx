@@ -2,14 +2,12 @@
 
 import { Post } from "../types"
 import { useRouter } from "next/navigation";
-import { useState } from "react";
 import ReactMarkdown from "react-markdown";
 import { truncateContent } from "../utils/utils";
 
 const RecipePageList = ({ post }: { post: Post }) => {
     const router = useRouter();
     const { SMID, Recipe } = post;
-    const [likes, setLikes] = useState<number>(post.Likes);
 
     return (
         <div 
@@ -21,7 +19,7 @@ const RecipePageList = ({ post }: { post: Post }) => {
                 <h2 className="text-xl font-bold">{Recipe.RecipeName}</h2>
                 <div className="space-x-4">
                     <div>
-                        {likes} Likes
+                        {post.Likes} Likes
                     </div>
                 </div>
             </div>
@@ -10,6 +10,7 @@ import ReactMarkdown from "react-markdown";
 import likeIcon from "../../icons/like.svg";
 import bookmarkIcon from "../../icons/bookmark.svg";
 import DialogBox from "@/app/components/DialogBox";
+import { fetchAllPages, subscribeFeedEvents } from "../../utils/utils";
 
 const API_BASE_URL = "http://127.0.0.1:5000";
 
@@ -30,50 +31,67 @@ const RecipePage = ({params}: {params: {SMID: string}}) => {
         setDialog({ isOpen: false, title: "", message: "" });
     };
 
-    useEffect(() => {
-        const fetchPost = async () => {
-            try {
-                const token = localStorage.getItem("access_token");
-                const response = await fetch(`${API_BASE_URL}/posts/${SMID}`, {
-                    method: "GET",
-                    headers: {
-                        Authorization: `Bearer ${token}`,
-                    },
-                });
-                if (response.ok) {
-                    const data = await response.json();
-                    setPost(data.post);
-                    setRecipe(data.post.Recipe);
-                    setLikes(data.post.Likes);
-                    console.log(data);
-                }
-            } catch (err) {
-                console.error("Failed to fetch posts:", err);
+    const fetchPost = async () => {
+        try {
+            const token = localStorage.getItem("access_token");
+            const response = await fetch(`${API_BASE_URL}/posts/${SMID}`, {
+                method: "GET",
+                headers: {
+                    Authorization: `Bearer ${token}`,
+                },
+            });
+            if (response.ok) {
+                const data = await response.json();
+                setPost(data.post);
+                setRecipe(data.post.Recipe);
+                setLikes(data.post.Likes);
+                console.log(data);
             }
+        } catch (err) {
+            console.error("Failed to fetch posts:", err);
         }
-        const fetchComments = async () => {
-            try {
-                const token = localStorage.getItem("access_token");
-                const response = await fetch(`${API_BASE_URL}/comments/${SMID}`, {
-                    method: "GET",
-                    headers: {
-                        Authorization: `Bearer ${token}`,
-                    },
-                });
-                if (response.ok) {
-                    const data = await response.json();
-                    setComments(data.comments);
-                    console.log(data);
-                }
-
-            }
-            catch (err) {
-                console.error("Failed to fetch comments:", err);
+    }
+    const fetchComments = async () => {
+        try {
+            const token = localStorage.getItem("access_token");
+            const comments = await fetchAllPages<Comment>(`${API_BASE_URL}/comments/${SMID}`, {
+                method: "GET",
+                headers: {
+                    Authorization: `Bearer ${token}`,
+                },
+            }, "comments");
+            if (comments) {
+                setComments(comments);
+                console.log(comments);
             }
+
         }
+        catch (err) {
+            console.error("Failed to fetch comments:", err);
+        }
+    }
+
+    useEffect(() => {
         fetchPost();
         fetchComments();
-        
+        // Likes and comments of this post from other users appear live; a
+        // resync refetches both
+        return subscribeFeedEvents(API_BASE_URL, {
+            like: (data) => {
+                if (data.SMID === SMID) {
+                    setLikes(data.Likes);
+                }
+            },
+            comment: (data) => {
+                if (data.SMID === SMID) {
+                    fetchComments();
+                }
+            },
+            resync: () => {
+                fetchPost();
+                fetchComments();
+            },
+        });
     }, [SMID]);
     
     const handlePostComment = async () => {
@@ -102,17 +120,7 @@ const RecipePage = ({params}: {params: {SMID: string}}) => {
 
                 // Clear the input and refresh the comments
                 setCommentText("");
-                const updatedComments = await fetch(`${API_BASE_URL}/comments/${SMID}`, {
-                    method: "GET",
-                    headers: {
-                        Authorization: `Bearer ${token}`,
-                    },
-                });
-
-                if (updatedComments.ok) {
-                    const data = await updatedComments.json();
-                    setComments(data.comments);
-                }
+                fetchComments();
             } else {
                 console.error("Failed to post comment:", response.statusText);
             }
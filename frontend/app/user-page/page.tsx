@@ -8,6 +8,7 @@ import ProtectedRoute from "../components/ProtectedRoute";
 import { useEffect, useState } from "react";
 import { useRouter } from "next/navigation";
 import { Post } from "../types";
+import { subscribeFeedEvents } from "../utils/utils";
 
 const API_BASE_URL = "http://127.0.0.1:5000";
 
@@ -15,30 +16,70 @@ export default function UserPage() {
 
     const [posts, setPosts] = useState<Post[]>([]);
     const [selectedCuisine, setSelectedCuisine] = useState("");
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
 
     const router = useRouter();
 
-    useEffect(() => {
-        const fetchRecipes = async () => {
-            try {
-                const token = localStorage.getItem("access_token");
-                const response = await fetch(`${API_BASE_URL}/posts`, {
-                    method: "GET",
-                    headers: {
-                        Authorization: `Bearer ${token}`,
-                    },
-                });
-                if (response.ok) {
-                    const data = await response.json();
-                    setPosts(data.posts);
-                    console.log(data);
-                }
+    // Fetches a page of the feed; without a cursor it replaces the list,
+    // with one it appends the next page
+    const fetchRecipes = async (cursor: string | null = null) => {
+        try {
+            const token = localStorage.getItem("access_token");
+            const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+            const response = await fetch(`${API_BASE_URL}/posts${params}`, {
+                method: "GET",
+                headers: {
+                    Authorization: `Bearer ${token}`,
+                },
+            });
+            if (response.ok) {
+                const data = await response.json();
+                setPosts((previous) => (cursor ? [...previous, ...data.posts] : data.posts));
+                setNextCursor(data.next_cursor);
+                console.log(data);
             }
-            catch (err) {
-                console.error("Failed to fetch recipes:", err);
+        }
+        catch (err) {
+            console.error("Failed to fetch recipes:", err);
+        }
+    };
+
+    // Puts posts published since the feed was loaded in front of it; posts
+    // the user is allergic to are not in /posts, so the first page is
+    // fetched rather than the new post alone
+    const fetchNewPosts = async () => {
+        try {
+            const token = localStorage.getItem("access_token");
+            const response = await fetch(`${API_BASE_URL}/posts`, {
+                method: "GET",
+                headers: {
+                    Authorization: `Bearer ${token}`,
+                },
+            });
+            if (response.ok) {
+                const data = await response.json();
+                setPosts((previous) => {
+                    const known = new Set(previous.map((post) => post.SMID));
+                    return [...data.posts.filter((post: Post) => !known.has(post.SMID)), ...previous];
+                });
             }
         }
+        catch (err) {
+            console.error("Failed to fetch new posts:", err);
+        }
+    };
+
+    useEffect(() => {
         fetchRecipes();
+        // Live updates instead of polling: like counts change in place, new
+        // posts are fetched, and a resync reloads the feed
+        return subscribeFeedEvents(API_BASE_URL, {
+            post: () => fetchNewPosts(),
+            like: ({ SMID, Likes }) => setPosts((previous) =>
+                previous.map((post) => (post.SMID === SMID ? { ...post, Likes } : post))
+            ),
+            resync: () => fetchRecipes(),
+        });
     }, []);
 
     const handleCuisineChange = (event: any) => {
@@ -84,6 +125,14 @@ export default function UserPage() {
                                     ) : (
                                         <p className="text-gray-400">No posts found for this cuisine.</p>
                                     )}
+                                    {nextCursor && (
+                                        <button
+                                            className="bg-zinc-800 text-white px-4 py-2 rounded hover:bg-zinc-700"
+                                            onClick={() => fetchRecipes(nextCursor)}
+                                        >
+                                            Load more
+                                        </button>
+                                    )}
                                 </div>
                 
                                 {/* Generate Recipe Section */}
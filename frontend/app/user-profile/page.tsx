@@ -4,6 +4,7 @@ import { useState, useEffect } from "react";
 import Navbar from "../components/Navbar";
 import Footer from "../components/Footer";
 import DialogBox from "../components/DialogBox";
+import { fetchAllPages } from "../utils/utils";
 
 const UserProfilePage = () => {
   const [userName, setUserName] = useState<string>("");
@@ -36,15 +37,14 @@ const UserProfilePage = () => {
       const sessionToken = getSessionToken();
       if (!sessionToken) return;
 
-      const response = await fetch("http://127.0.0.1:5000/allergiesall", {
+      const data = await fetchAllPages<any>("http://127.0.0.1:5000/allergiesall", {
         method: "GET",
         headers: {
           Authorization: `Bearer ${sessionToken}`,
         },
       });
 
-      if (response.ok) {
-        const data = await response.json();
+      if (data) {
         setAllergies(data);
       } else {
         showDialog("Fetch Error", "Failed to fetch allergies. Please try again.");
@@ -58,15 +58,14 @@ const UserProfilePage = () => {
   useEffect(() => {
     const fetchMyRecipes = async () => {
       try {
-        const response = await fetch("http://127.0.0.1:5000/recipesall", {
+        const data = await fetchAllPages<any>("http://127.0.0.1:5000/recipesall", {
           method: "GET",
           headers: {
             Authorization: `Bearer ${localStorage.getItem("access_token")}`,
           },
         });
 
-        if (response.ok) {
-          const data = await response.json();
+        if (data) {
           console.log(data);
           setRecipeCount(data.length);
         } else {
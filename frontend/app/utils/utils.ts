@@ -5,3 +5,118 @@ export const truncateContent = (content: string, maxLines: number): string => {
   }
   return lines.slice(0, maxLines).join('\n') + '\n.....'; 
 };
+
+// Largest page the backend serves (pagination.MAX_PAGE_SIZE)
+const MAX_PAGE_SIZE = 200;
+
+// Follows the cursor of a paginated list endpoint and returns every item.
+// Object responses carry the items under `key` next to `next_cursor`; plain
+// list responses carry the cursor in the X-Next-Cursor header. Returns null
+// when a page fails, so callers keep their own error handling.
+export const fetchAllPages = async <T,>(url: string, init: RequestInit, key?: string): Promise<T[] | null> => {
+  const items: T[] = [];
+  let cursor: string | null = null;
+  do {
+    const params = new URLSearchParams({ limit: String(MAX_PAGE_SIZE) });
+    if (cursor) {
+      params.set("cursor", cursor);
+    }
+    const response = await fetch(`${url}${url.includes("?") ? "&" : "?"}${params}`, init);
+    if (!response.ok) {
+      return null;
+    }
+    const data = await response.json();
+    if (key) {
+      items.push(...data[key]);
+      cursor = data.next_cursor;
+    } else {
+      items.push(...data);
+      cursor = response.headers.get("X-Next-Cursor");
+    }
+  } while (cursor);
+  return items;
+};
+
+export type FeedEventHandlers = {
+  post?: (data: { SMID: string; RecipeID: string }) => void;
+  like?: (data: { SMID: string; Likes: number }) => void;
+  comment?: (data: { SMID: string; CommentID: string }) => void;
+  resync?: () => void;
+};
+
+// Subscribes to the backend's feed event stream (GET /feed/events, Server-Sent
+// Events) and calls the handler of each event. The stream is read with fetch
+// rather than EventSource so the token goes in the Authorization header, and
+// a dropped connection is reopened after the server's retry delay, then
+// followed by a resync since events may have been missed. A rejected token
+// (401 or 403) ends the subscription instead: retrying cannot fix it. Returns
+// a function that closes the stream.
+export const subscribeFeedEvents = (baseUrl: string, handlers: FeedEventHandlers): (() => void) => {
+  const controller = new AbortController();
+  let retryMs = 3000;
+
+  const dispatch = (block: string) => {
+    let event = "message";
+    let data = "";
+    for (const line of block.split("\n")) {
+      if (line.startsWith("event:")) {
+        event = line.slice(6).trim();
+      } else if (line.startsWith("data:")) {
+        data += line.slice(5).trim();
+      } else if (line.startsWith("retry:")) {
+        retryMs = Number(line.slice(6).trim()) || retryMs;
+      }
+    }
+    const handler = handlers[event as keyof FeedEventHandlers] as ((data?: any) => void) | undefined;
+    if (handler) {
+      handler(data ? JSON.parse(data) : undefined);
+    }
+  };
+
+  const connect = async (reconnecting: boolean) => {
+    try {
+      const response = await fetch(`${baseUrl}/feed/events`, {
+        headers: {
+          Accept: "text/event-stream",
+          Authorization: `Bearer ${localStorage.getItem("access_token")}`,
+        },
+        signal: controller.signal,
+      });
+      if (response.status === 401 || response.status === 403) {
+        console.error(`Feed events not authorized: ${response.status}`);
+        return;
+      }
+      if (!response.ok || !response.body) {
+        throw new Error(`Feed events failed: ${response.status}`);
+      }
+      if (reconnecting) {
+        handlers.resync?.();
+      }
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+          break;
+        }
+        buffer += value.replace(/\r\n?/g, "\n");
+        let end;
+        while ((end = buffer.indexOf("\n\n")) !== -1) {
+          dispatch(buffer.slice(0, end));
+          buffer = buffer.slice(end + 2);
+        }
+      }
+    } catch (err) {
+      if (controller.signal.aborted) {
+        return;
+      }
+      console.error("Feed events disconnected:", err);
+    }
+    if (!controller.signal.aborted) {
+      setTimeout(() => connect(true), retryMs);
+    }
+  };
+
+  connect(false);
+  return () => controller.abort();
+};